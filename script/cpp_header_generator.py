@@ -1,21 +1,33 @@
-from easy_template import RunTemplateString
+from easy_template import RenderTemplate
+import cpp_json_lazy_generator
 import gapi_utils
+import profiler
 import service
 
 
-def Generate(outf, service, **kwargs):
+def Generate(outf, service, options=gapi_utils.DEFAULT_GENERATOR_OPTIONS,
+             **kwargs):
   namespace = kwargs['namespace']
   header_name = kwargs['header_name']
   include_guard = gapi_utils.MakeIncludeGuard(header_name)
-  outf.write(RunTemplateString(HEADER_HEAD, vars()))
-  for schema in service.schemas.itervalues():
-    _GenerateSchema(outf, schema)
+  DecodeParams = gapi_utils.DecodeParams
+  DecodeStreamParams = gapi_utils.DecodeStreamParams
+  FieldMaskSchemaName = gapi_utils.FieldMaskSchemaName
+  RenderTemplate(outf, HEADER_HEAD, vars())
+  for _, schema in sorted(service.schemas.iteritems()):
+    with profiler.Schema(schema):
+      _GenerateSchema(outf, schema, options)
     outf.write('\n')
-  outf.write(RunTemplateString(HEADER_FOOT, vars()))
+  if options.lazy:
+    CapWords = gapi_utils.CapWords
+    LazyProperties = cpp_json_lazy_generator.LazyProperties
+    LazyArrayReferent = cpp_json_lazy_generator.LazyArrayReferent
+    RenderTemplate(outf, HEADER_LAZY, vars())
+  RenderTemplate(outf, HEADER_FOOT, vars())
 
 
-def _GenerateSchema(outf, schema):
-  service.Iterate(schema, GenerateSchemaCallbacks(outf))
+def _GenerateSchema(outf, schema, options):
+  service.Iterate(schema, GenerateSchemaCallbacks(outf, options))
 
 
 def WriteWrappedComment(f, s, indent, length):
@@ -31,30 +43,39 @@ def WriteJsonComment(f, d, indent, length):
       f.write('%s// %s\n' % (indent, wrapped_line))
 
 
+def _SetterParam(ctype):
+  # By value for the numbers and bools, by reference for the rest.
+  if ctype in ('bool', 'int32_t', 'uint32_t', 'int64_t', 'uint64_t', 'float',
+               'double'):
+    return ctype
+  return 'const %s&' % ctype
+
+
 class GenerateSchemaCallbacks(service.ServiceCallbacks):
-  def __init__(self, outf):
+  def __init__(self, outf, options):
     self.outf = outf
-
-  def GetIndentFromContext(self, context):
-    indent = ''
-    for item in context:
-      if isinstance(item, service.Schema):
-        indent += '  '
-    return indent
+    self.options = options
 
   def GetIndent(self, obj):
-    return self.GetIndentFromContext(obj.GetContext())
+    # One level per enclosing struct.
+    return '  ' * obj.schema_depth
 
-  def GetPrevIndent(self, obj):
-    return self.GetIndentFromContext(obj.GetContext()[:-1])
+  def GetPrevIndent(self, schema):
+    return '  ' * (schema.schema_depth - 1)
 
   def BeginSchema(self, schema):
-    self.outf.write(RunTemplateString(HEADER_SCHEMA_HEAD, vars(),
-                                      output_indent=self.GetPrevIndent(schema)))
+    RenderTemplate(self.outf, HEADER_SCHEMA_HEAD, vars(),
+                   output_indent=self.GetPrevIndent(schema))
 
   def EndSchema(self, schema):
-    self.outf.write(RunTemplateString(HEADER_SCHEMA_FOOT, vars(),
-                                      output_indent=self.GetPrevIndent(schema)))
+    if self.options.presence and schema.presence_properties:
+      PresenceBit = gapi_utils.PresenceBit
+      NumPresenceWords = gapi_utils.NumPresenceWords
+      SetterParam = _SetterParam
+      RenderTemplate(self.outf, HEADER_SCHEMA_PRESENCE, vars(),
+                     output_indent=self.GetPrevIndent(schema))
+    RenderTemplate(self.outf, HEADER_SCHEMA_FOOT, vars(),
+                   output_indent=self.GetPrevIndent(schema))
 
   def EndProperty(self, prop):
     indent = self.GetIndent(prop)
@@ -86,8 +107,19 @@ HEADER_HEAD = """\
 #include <vector>
 #include <string>
 
+[[if options.arena:]]
+#include "arena.h"
+[[]]
 #include "error.h"
+#include "field_mask.h"
 #include "io.h"
+[[if options.lazy:]]
+#include "json_index.h"
+[[]]
+#include "record_callback.h"
+[[if options.string_views:]]
+#include "string_view.h"
+[[]]
 
 class JsonGeneratorOptions;
 
@@ -100,8 +132,70 @@ struct {{schema.ctype}};
 [[]]
 
 [[for _, schema in sorted(service.schemas.iteritems()):]]
-void Decode(Reader* src, {{schema.ctype}}* out_data, ErrorPtr* error);
+extern const FieldMaskSchema {{FieldMaskSchemaName(schema.ctype)}};
+[[]]
+
+[[for _, schema in sorted(service.schemas.iteritems()):]]
+void Decode({{DecodeParams(schema.ctype, options)}});
+// Only decodes the |fields| that the mask selects, e.g. parsed with
+// fields.Parse("items(id,title)", {{FieldMaskSchemaName(schema.ctype)}}, error).
+void Decode({{DecodeParams(schema.ctype, options, field_mask=True)}});
+// Decodes concatenated or newline-delimited {{schema.ctype}} records, passing
+// each to |callback|.
+void DecodeStream({{DecodeStreamParams(schema.ctype, options)}});
 void Encode(Writer* src, {{schema.ctype}}* data, const JsonGeneratorOptions& options, ErrorPtr* error);
+// The exact size of what Encode generates without beautify, e.g. to reserve
+// the output buffer or set Content-Length before encoding.
+size_t EncodedSize(const {{schema.ctype}}& data, const JsonGeneratorOptions& options);
+size_t EncodedSize(const {{schema.ctype}}& data);
+[[]]
+
+"""
+
+HEADER_LAZY = """\
+[[for _, schema in sorted(service.schemas.iteritems()):]]
+class Lazy{{schema.ctype}};
+[[]]
+[[for _, schema in sorted(service.schemas.iteritems()):]]
+[[  props = LazyProperties(schema)]]
+
+// Decodes the properties of a {{schema.ctype}} value as they are accessed:
+// value |value| of |index|, which, with its input, must outlive this.
+class Lazy{{schema.ctype}} {
+ public:
+  Lazy{{schema.ctype}}(const JsonIndex* index, size_t value);
+  ~Lazy{{schema.ctype}}();
+
+  // Decodes all of the value, replacing what was decoded so far.
+  const {{schema.ctype}}& DecodeAll(ErrorPtr* error);
+  // The properties decoded so far.
+  const {{schema.ctype}}& data() const { return data_; }
+[[  for prop in props:]]
+
+  // Decodes "{{prop.name}}" on first access; only that call sets |error|.
+  const {{prop.ctype}}& Get{{CapWords(prop.name)}}(ErrorPtr* error);
+[[    referent = LazyArrayReferent(prop)]]
+[[    if referent:]]
+  // The number of elements of "{{prop.name}}", without decoding them.
+  size_t {{CapWords(prop.name)}}Size() const;
+  // Element |i| of "{{prop.name}}", decoded as it is accessed too, or NULL.
+  Lazy{{referent.ctype}}* {{CapWords(prop.name)}}At(size_t i);
+[[  ]]
+
+ private:
+  const JsonIndex* index_;
+  size_t value_;
+  {{schema.ctype}} data_;
+  bool decoded_[{{max(1, len(props))}}];
+[[  for prop in props:]]
+[[    referent = LazyArrayReferent(prop)]]
+[[    if referent:]]
+  std::vector<Lazy{{referent.ctype}}*> {{prop.base_cident}}_;
+[[  ]]
+
+  Lazy{{schema.ctype}}(const Lazy{{schema.ctype}}&);
+  Lazy{{schema.ctype}}& operator =(const Lazy{{schema.ctype}}&);
+};
 [[]]
 
 """
@@ -120,6 +214,20 @@ struct {{schema.base_ctype}} {
   ~{{schema.base_ctype}}();
 """
 
+HEADER_SCHEMA_PRESENCE = """\
+
+  // Whether each primitive property was decoded or set with its setter.
+  // Encode leaves out the ones that were not.
+[[for prop in schema.presence_properties:]]
+[[  word, mask = PresenceBit(prop)]]
+  bool has_{{prop.base_cident}}() const { return (_presence[{{word}}] & {{mask}}) != 0; }
+  void set_{{prop.base_cident}}({{SetterParam(prop.ctype)}} value) { {{prop.base_cident}} = value; _presence[{{word}}] |= {{mask}}; }
+[[]]
+
+  // The bits of the has_*() functions.
+  uint32_t _presence[{{NumPresenceWords(schema)}}];
+"""
+
 HEADER_SCHEMA_FOOT = """\
 };
 """
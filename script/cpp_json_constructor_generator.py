@@ -1,21 +1,27 @@
-from easy_template import RunTemplateString
+from easy_template import RenderTemplate
 import gapi_utils
+import profiler
 import service
 
 
-def Generate(outf, service):
-  for typ, data in service.Generator():
-    if typ == 'BeginSchema':
-      _GenerateSchema(outf, data)
+def Generate(outf, service, schemas=None,
+             options=gapi_utils.DEFAULT_GENERATOR_OPTIONS):
+  if schemas is None:
+    schemas = [schema for _, schema in sorted(service.schemas.iteritems())]
+  for schema in schemas:
+    with profiler.Schema(schema):
+      for typ, data in schema.Generator():
+        if typ == 'BeginSchema':
+          _GenerateSchema(outf, data, options)
 
 
-def _GenerateSchema(outf, schema):
-  outf.write(RunTemplateString(TEMPLATE_BEGIN_SCHEMA, vars()))
-  for prop in schema.properties.itervalues():
+def _GenerateSchema(outf, schema, options):
+  RenderTemplate(outf, TEMPLATE_BEGIN_SCHEMA, vars())
+  for _, prop in sorted(schema.properties.iteritems()):
     prop_type = prop.prop_type
     cident = gapi_utils.SnakeCase(prop.name)
-    outf.write(RunTemplateString(TEMPLATE_PRIMITIVE, vars()))
-  outf.write(RunTemplateString(TEMPLATE_END_SCHEMA, vars()))
+    RenderTemplate(outf, TEMPLATE_PRIMITIVE, vars())
+  RenderTemplate(outf, TEMPLATE_END_SCHEMA, vars())
 
 
 def CIdentFromContext(context):
@@ -34,6 +40,9 @@ TEMPLATE_BEGIN_SCHEMA = """\
 """
 
 TEMPLATE_END_SCHEMA = """\
+[[if options.presence and schema.presence_properties:]]
+  memset(_presence, 0, sizeof(_presence));
+[[]]
 }
 
 {{schema.ctype}}::~{{schema.base_ctype}}() {
@@ -1,30 +1,248 @@
 import collections
 import itertools
 
-from easy_template import RunTemplateString
+from easy_template import RenderTemplate
 import gapi_utils
+import profiler
 import service
 
 
-def Generate(outf, service):
-  for schema in service.schemas.itervalues():
-    _GenerateSchemaDeclaration(outf, schema)
-  for schema in service.schemas.itervalues():
-    _GenerateSchemaDefinition(outf, schema)
-
-
-def _GenerateSchemaDeclaration(outf, schema):
-  # TODO(binji): only create this once
-  state_info = StateInfo(schema)
-  outf.write(RunTemplateString(TEMPLATE_DECLARE_SCHEMA, vars()))
-
-def _GenerateSchemaDefinition(outf, schema):
-  state_info = StateInfo(schema)
+def Generate(outf, service, schemas=None,
+             options=gapi_utils.DEFAULT_GENERATOR_OPTIONS):
+  if schemas is None:
+    schemas = [schema for _, schema in sorted(service.schemas.iteritems())]
+  # Pushing the callbacks of a $ref needs the referent's callbacks class, so
+  # it is declared too, even if it is defined in another source shard.
+  state_infos = {}
+  for schema in service.WithReferents(schemas):
+    with profiler.Schema(schema):
+      state_info = StateInfo(schema)
+      state_infos[schema.name] = state_info
+      _GenerateSchemaDeclaration(outf, schema, state_info)
+  for schema in schemas:
+    with profiler.Schema(schema):
+      _GenerateFieldMaskSchemas(outf, schema)
+  if options.decoder == 'direct':
+    RenderTemplate(outf, TEMPLATE_DECLARE_DIRECT_PARSERS, vars())
+    for schema in schemas:
+      with profiler.Schema(schema):
+        _GenerateDirectParsers(outf, schema, options)
+  for schema in schemas:
+    with profiler.Schema(schema):
+      _GenerateSchemaDefinition(outf, schema, state_infos[schema.name],
+                                options)
+
+
+def _GenerateSchemaDeclaration(outf, schema, state_info):
+  RenderTemplate(outf, TEMPLATE_DECLARE_SCHEMA, vars())
+
+
+def _GenerateFieldMaskSchemas(outf, schema):
+  # The nested objects come after their parents in the model, so reverse it:
+  # each FieldMaskSchema only refers to the ones before it, or to top-level
+  # schemas, which the header declares.
+  nested_schemas = [data for typ, data in schema.Generator()
+                    if typ == 'BeginSchema']
+  for nested_schema in reversed(nested_schemas):
+    properties = [(prop.name, _FieldMaskChild(prop))
+                  for _, prop in sorted(nested_schema.properties.iteritems())]
+    additional_properties = nested_schema.additional_properties
+    if additional_properties:
+      additional_properties = _FieldMaskChild(additional_properties)
+    name = gapi_utils.FieldMaskSchemaName(nested_schema.ctype)
+    CStringLiteral = gapi_utils.CStringLiteral
+    RenderTemplate(outf, TEMPLATE_FIELD_MASK_SCHEMA, vars())
+
+
+def _FieldMaskChild(prop):
+  # A pointer to the FieldMaskSchema of the value of |prop|. Arrays are
+  # transparent in field masks.
+  prop_type = prop.prop_type
+  while isinstance(prop_type, service.ArrayPropertyType):
+    prop_type = prop_type.element_type
+  if isinstance(prop_type, service.ObjectPropertyType):
+    return '&' + gapi_utils.FieldMaskSchemaName(prop_type.schema.ctype)
+  elif isinstance(prop_type, service.ReferencePropertyType):
+    return '&' + gapi_utils.FieldMaskSchemaName(prop_type.referent.ctype)
+  return 'NULL'
+
+
+def _GenerateSchemaDefinition(outf, schema, state_info, options):
   debug = False
   groupby = itertools.groupby
+  MapKeyDispatch = _MapKeyDispatch
+  DecodeParams = gapi_utils.DecodeParams
+  DecodeStreamParams = gapi_utils.DecodeStreamParams
+  FieldMaskSchemaName = gapi_utils.FieldMaskSchemaName
   ReferencePropertyType = service.ReferencePropertyType
   ObjectPropertyType = service.ObjectPropertyType
-  outf.write(RunTemplateString(TEMPLATE_DEFINE_SCHEMA, vars()))
+  SetPresent = _SetPresent
+  ValueMacro = _ValueMacro
+  RenderTemplate(outf, TEMPLATE_DEFINE_SCHEMA, vars())
+
+
+def _SetPresent(prop_type, cident, options):
+  """The statement that sets the presence bit of the value |cident|, or ''.
+
+  Only with --presence, for the primitive properties of structs.
+  """
+  prop = prop_type.prop
+  if (not options.presence or prop_type.is_parent_array or
+      prop.presence_bit is None):
+    return ''
+  word, mask = gapi_utils.PresenceBit(prop)
+  obj = cident[:-len(prop.base_cident)]
+  return '%s_presence[%d] |= %s;' % (obj, word, mask)
+
+
+def _ValueMacro(prop_type):
+  """The type in the names of the SET_*/APPEND_* macros of |prop_type|."""
+  if prop_type.type_format == ('string', 'byte'):
+    return 'BYTES'
+  return {
+    'bool': 'BOOL',
+    'double': 'DOUBLE',
+    'float': 'FLOAT',
+    'int32_t': 'INT32',
+    'int64_t': 'INT64',
+    'uint32_t': 'UINT32',
+    'uint64_t': 'UINT64',
+    'StringView': 'STRING_VIEW',
+  }.get(prop_type.ctype, 'STRING')
+
+
+def _MapKeyDispatch(prop_infos):
+  """Return the lines of code that find the property named by the key."""
+  keys = []
+  for prop, next_state, _, _ in prop_infos:
+    if not prop.is_additional_properties:
+      name = prop.name.encode('utf-8')
+      keys.append((name, ['MATCH_MAP_KEY(%s, %d, %s);' % (
+          gapi_utils.CStringLiteral(name), len(name), next_state)]))
+  return _KeyDispatch(keys)
+
+
+def _KeyDispatch(keys):
+  """Return the lines of code that run the match lines of the key (s, length).
+
+  |keys| is a list of (name, match lines). Instead of comparing the key with
+  every name, switch on the key length, then on the bytes that best tell the
+  remaining names apart, so at most one memcmp is done per key. The match
+  lines do the memcmp. Falls through if no name matches.
+  """
+  keys = sorted(keys, key=lambda key: (len(key[0]), key[0]))
+  if not keys:
+    return []
+  lines = ['switch (length) {']
+  for length, group in itertools.groupby(keys, lambda key: len(key[0])):
+    lines.append('  case %d:' % length)
+    lines.extend('    ' + line for line in _KeyByteDispatch(list(group)))
+    lines.append('    break;')
+  lines.append('}')
+  return lines
+
+
+def _KeyByteDispatch(keys):
+  # |keys| are distinct names of the same length.
+  if len(keys) == 1:
+    return keys[0][1]
+  # The first of the bytes that split the names into the most groups.
+  length = len(keys[0][0])
+  index = max(xrange(length),
+              key=lambda i: (len(set(name[i] for name, _ in keys)), -i))
+  lines = ['switch (s[%d]) {' % index]
+  groups = collections.defaultdict(list)
+  for key in keys:
+    groups[key[0][index]].append(key)
+  for c, group in sorted(groups.iteritems()):
+    lines.append('  case %s:' % gapi_utils.CCharLiteral(c))
+    lines.extend('    ' + line for line in _KeyByteDispatch(group))
+    lines.append('    break;')
+  lines.append('}')
+  return lines
+
+
+def _GenerateDirectParsers(outf, schema, options):
+  # Nested objects first, so each parser is defined before it is used; the
+  # parsers of top-level schemas are declared up front, for $refs.
+  nested_schemas = [data for typ, data in schema.Generator()
+                    if typ == 'BeginSchema']
+  for nested_schema in reversed(nested_schemas):
+    lines = _DirectObjectLines(nested_schema, options)
+    RenderTemplate(outf, TEMPLATE_DIRECT_PARSER, vars())
+
+
+# The DIRECT_READ_* macro of each primitive C type; other types are strings,
+# except byte arrays.
+DIRECT_READ_MACROS = {
+  'bool': 'BOOL',
+  'double': 'DOUBLE',
+  'float': 'FLOAT',
+  'int32_t': 'INT32',
+  'int64_t': 'INT64',
+  'uint32_t': 'UINT32',
+  'uint64_t': 'UINT64',
+  'StringView': 'STRING_VIEW',
+}
+
+
+def _DirectObjectLines(schema, options):
+  """Return the lines of code that parse the value of the key (s, length)."""
+  keys = []
+  for _, prop in sorted(schema.properties.iteritems()):
+    name = prop.name.encode('utf-8')
+    cident = 'data->' + prop.base_cident
+    value_lines = _DirectValueLines(prop.prop_type, cident, options)
+    set_present = _SetPresent(prop.prop_type, cident, options)
+    if set_present:
+      value_lines.append(set_present)
+    keys.append((name, ['if (memcmp(s, %s, %d) == 0) {' % (
+                            gapi_utils.CStringLiteral(name), len(name))] +
+                       ['  ' + line for line in value_lines] +
+                       ['  continue;', '}']))
+  lines = _KeyDispatch(keys)
+  prop = schema.additional_properties
+  if prop:
+    typedef = prop.ctypedef
+    value_lines = _DirectValueLines(prop.prop_type, 'it->second', options)
+    lines += ['{',
+              '  %s::key_type key(s, s + length);' % typedef,
+              '  %s::iterator it = data->%s.insert(' % (
+                  typedef, prop.base_cident),
+              '      %s::value_type(key, %s::mapped_type())).first;' % (
+                  typedef, typedef)]
+    lines += ['  ' + line for line in value_lines]
+    lines += ['  continue;', '}']
+  lines.append('return scanner->Fail("Unknown map key");')
+  return lines
+
+
+def _DirectValueLines(prop_type, cident, options):
+  """Return the lines of code that parse a |prop_type| value into |cident|."""
+  if isinstance(prop_type, service.PrimitivePropertyType):
+    if prop_type.type_format == ('string', 'byte'):
+      macro = 'BYTES'
+    else:
+      macro = DIRECT_READ_MACROS.get(prop_type.ctype, 'STRING')
+    return ['DIRECT_READ_%s(%s);' % (macro, cident)]
+  elif isinstance(prop_type, service.ArrayPropertyType):
+    element_lines = _DirectValueLines(prop_type.element_type,
+                                      cident + '.back()', options)
+    return (['if (!scanner->StartArray()) return false;',
+             'if (!scanner->EndArray()) {',
+             '  do {',
+             '    %s.resize(%s.size() + 1);' % (cident, cident)] +
+            ['    ' + line for line in element_lines] +
+            ['  } while (scanner->NextElement());',
+             '  if (scanner->failed()) return false;',
+             '}'])
+  elif isinstance(prop_type, service.ObjectPropertyType):
+    return ['DIRECT_READ_OBJECT(%s);' % cident]
+  elif isinstance(prop_type, service.ReferencePropertyType):
+    macro = 'ARENA_REF' if options.arena else 'REF'
+    return ['DIRECT_READ_%s(%s, %s);' % (macro, prop_type.referent.ctype,
+                                         cident)]
+  raise Exception('Unexpected property type %s' % prop_type)
 
 
 class StateInfo(object):
@@ -37,6 +255,8 @@ class StateInfo(object):
     self.prop_key_states = collections.defaultdict(list)
     self.string_states = {}
     self.additional_properties_schemas = {}
+    # How deep objects nest inside the schema, see CHECK_FIELD_MASK.
+    self.max_schema_depth = 0
     self._Load(schema)
 
   def _Load(self, schema):
@@ -111,6 +331,8 @@ class StateInfoCallbacks(service.ServiceCallbacks):
     return _GetCIdentFromContext(obj.GetContext())
 
   def BeginSchema(self, schema):
+    self.state_info.max_schema_depth = max(self.state_info.max_schema_depth,
+                                           schema.schema_depth)
     if schema.additional_properties:
       info = AddlPropInfo(schema, _GetAddlPropIteratorCIdent(schema))
       self.state_info.additional_properties_schemas[schema.name] = info
@@ -175,6 +397,59 @@ PropInfo = collections.namedtuple(
 AddlPropInfo = collections.namedtuple('AddlPropInfo', ['schema', 'cident'])
 
 
+TEMPLATE_FIELD_MASK_SCHEMA = """\
+[[if properties:]]
+static const FieldMaskSchema::Property {{name}}Properties[] = {
+[[  for prop_name, child in properties:]]
+  { {{CStringLiteral(prop_name)}}, {{child}} },
+[[  ]]
+};
+
+[[]]
+[[if nested_schema.parent_schema:]]
+static const FieldMaskSchema {{name}} = {
+[[else:]]
+const FieldMaskSchema {{name}} = {
+[[]]
+  {{name + 'Properties' if properties else 'NULL'}},
+  {{len(properties)}},
+  {{'true' if additional_properties else 'false'}},
+  {{additional_properties or 'NULL'}},
+};
+
+"""
+
+
+TEMPLATE_DECLARE_DIRECT_PARSERS = """\
+[[for schema in service.WithReferents(schemas):]]
+bool ParseObject(JsonScanner* scanner, {{schema.ctype}}* data);
+[[]]
+
+"""
+
+
+TEMPLATE_DIRECT_PARSER = """\
+[[if nested_schema.parent_schema:]]
+static bool ParseObject(JsonScanner* scanner, {{nested_schema.ctype}}* data) {
+[[else:]]
+bool ParseObject(JsonScanner* scanner, {{nested_schema.ctype}}* data) {
+[[]]
+  if (!scanner->StartObject()) return false;
+  if (scanner->EndObject()) return true;
+  do {
+    const char* s;
+    size_t length;
+    if (!scanner->ReadKey(&s, &length)) return false;
+[[for line in lines:]]
+    {{line}}
+[[]]
+  } while (scanner->NextMember());
+  return !scanner->failed();
+}
+
+"""
+
+
 TEMPLATE_DECLARE_SCHEMA = """\
 class {{schema.cbtype}} : public JsonCallbacks {
  public:
@@ -186,6 +461,9 @@ class {{schema.cbtype}} : public JsonCallbacks {
   };
 
   explicit {{schema.cbtype}}({{schema.ctype}}* data);
+  void Reset({{schema.ctype}}* data);
+  // Only the fields that |mask| selects are decoded. NULL selects all.
+  void set_field_mask(const FieldMask* mask) { masks_[0] = mask; }
   virtual int OnNull(JsonParser* p, ErrorPtr* error);
   virtual int OnBool(JsonParser* p, bool value, ErrorPtr* error);
   virtual int OnNumber(JsonParser* p, const char* s, size_t length, ErrorPtr* error);
@@ -198,7 +476,9 @@ class {{schema.cbtype}} : public JsonCallbacks {
 
  private:
   {{schema.ctype}}* data_;
-[[for schema_name, info in state_info.additional_properties_schemas.iteritems():]]
+  // The field mask of the current object at each depth, see CHECK_FIELD_MASK.
+  const FieldMask* masks_[{{state_info.max_schema_depth + 1}}];
+[[for schema_name, info in sorted(state_info.additional_properties_schemas.iteritems()):]]
   {{info.schema.additional_properties.ctypedef}}::iterator {{info.cident}};
 [[]]
   int state_;
@@ -209,15 +489,69 @@ class {{schema.cbtype}} : public JsonCallbacks {
 
 TEMPLATE_DEFINE_SCHEMA = """\
 
-void Decode(Reader* src, {{schema.ctype}}* out_data, ErrorPtr* error) {
+void Decode({{DecodeParams(schema.ctype, options)}}) {
+[[if options.arena:]]
+  ScopedArena scoped_arena(arena);
+  *out_data = arena->New<{{schema.ctype}}>();
+[[]]
+[[if options.decoder == 'direct':]]
+[[  if options.string_views:]]
+  JsonScanner scanner(input);
+[[  else:]]
+  MemoryWriter input;
+  ErrorPtr read_error;
+  Copy(&input, src, &read_error);
+  if (read_error) {
+    if (error) *error = read_error;
+    return;
+  }
+  JsonScanner scanner(input.data());
+[[  ]]
+  if (ParseObject(&scanner, {{'*out_data' if options.arena else 'out_data'}}))
+    scanner.Finish();
+  if (error) *error = scanner.error();
+[[else:]]
+  JsonParser p;
+  p.PushCallbacksFor<{{schema.cbtype}}>({{'*out_data' if options.arena else 'out_data'}});
+  p.Decode({{'input' if options.string_views else 'src'}}, error);
+[[]]
+}
+
+void Decode({{DecodeParams(schema.ctype, options, field_mask=True)}}) {
+  if (fields.schema() != &{{FieldMaskSchemaName(schema.ctype)}}) {
+    if (error) error->reset(new MessageError("Field mask is for another schema"));
+    return;
+  }
+[[if options.arena:]]
+  ScopedArena scoped_arena(arena);
+  *out_data = arena->New<{{schema.ctype}}>();
+[[]]
+  JsonParser p;
+  p.PushCallbacksFor<{{schema.cbtype}}>({{'*out_data' if options.arena else 'out_data'}})->set_field_mask(&fields);
+  p.Decode({{'input' if options.string_views else 'src'}}, error);
+}
+
+void DecodeStream({{DecodeStreamParams(schema.ctype, options)}}) {
+[[if options.arena:]]
+  ScopedArena scoped_arena(arena);
+  JsonRecordDecoder<{{schema.cbtype}}, {{schema.ctype}}> records(callback, arena);
+[[else:]]
+  JsonRecordDecoder<{{schema.cbtype}}, {{schema.ctype}}> records(callback);
+[[]]
   JsonParser p;
-  p.PushCallbacks(new {{schema.cbtype}}(out_data));
-  p.Decode(src, error);
+  p.DecodeStream({{'input' if options.string_views else 'src'}}, &records, error);
 }
 
 {{schema.cbtype}}::{{schema.cbtype}}({{schema.ctype}}* data)
     : data_(data),
       state_(STATE_NONE) {
+  masks_[0] = NULL;
+}
+
+void {{schema.cbtype}}::Reset({{schema.ctype}}* data) {
+  data_ = data;
+  state_ = STATE_NONE;
+  masks_[0] = NULL;
 }
 
 int {{schema.cbtype}}::OnNull(JsonParser* p, ErrorPtr* error) {
@@ -236,7 +570,13 @@ int {{schema.cbtype}}::OnBool(JsonParser* p, bool value, ErrorPtr* error) {
   switch (state_) {
 [[  for state, info in sorted(state_info.bool_states.iteritems()):]]
     case {{state}}:
-[[    if info.prop_type.is_parent_array:]]
+[[    set_present = SetPresent(info.prop_type, info.cident, options)]]
+[[    if set_present:]]
+      SET_BOOL({{info.cident}});
+      {{set_present}}
+      state_ = {{info.prev_state}};
+      return 1;
+[[    elif info.prop_type.is_parent_array:]]
       APPEND_BOOL_AND_RETURN({{info.cident}});
 [[    else:]]
       SET_BOOL_AND_RETURN({{info.cident}}, {{info.prev_state}});
@@ -256,24 +596,19 @@ int {{schema.cbtype}}::OnNumber(JsonParser* p, const char* s, size_t length, Err
   printf("{{schema.cbtype}}::OnNumber(%.*s) %d\\n", static_cast<int>(length), s, state_);
 [[]]
 [[if state_info.number_states:]]
-  char* endptr;
-  char buffer[kMaxNumberBufferSize];
-  size_t nbytes = std::min(kMaxNumberBufferSize - 1, length);
-  strncpy(&buffer[0], s, nbytes);
-  buffer[nbytes] = 0;
   switch (state_) {
 [[  for state, info in sorted(state_info.number_states.iteritems()):]]
 [[    prefix = 'APPEND' if info.prop_type.is_parent_array else 'SET']]
 [[    optional_state = '' if info.prop_type.is_parent_array else ', ' + info.prev_state]]
     case {{state}}:
-[[    if info.prop_type.ctype == "int32_t":]]
-      {{prefix}}_INT32_AND_RETURN({{info.cident}}{{optional_state}});
-[[    elif info.prop_type.ctype == "uint32_t":]]
-      {{prefix}}_UINT32_AND_RETURN({{info.cident}}{{optional_state}});
-[[    elif info.prop_type.ctype == "float":]]
-      {{prefix}}_FLOAT_AND_RETURN({{info.cident}}{{optional_state}});
-[[    elif info.prop_type.ctype == "double":]]
-      {{prefix}}_DOUBLE_AND_RETURN({{info.cident}}{{optional_state}});
+[[    set_present = SetPresent(info.prop_type, info.cident, options)]]
+[[    if set_present:]]
+      SET_{{ValueMacro(info.prop_type)}}({{info.cident}});
+      {{set_present}}
+      state_ = {{info.prev_state}};
+      return 1;
+[[    else:]]
+      {{prefix}}_{{ValueMacro(info.prop_type)}}_AND_RETURN({{info.cident}}{{optional_state}});
 [[  ]]
     default:
       error->reset(new MessageError("Unexpected number"));
@@ -290,24 +625,19 @@ int {{schema.cbtype}}::OnString(JsonParser* p, const unsigned char* s, size_t le
   printf("{{schema.cbtype}}::OnString(%.*s) %d\\n", static_cast<int>(length), s, state_);
 [[]]
 [[if state_info.string_states:]]
-[[  if any(info.prop_type.ctype in ("int64_t", "uint64_t") for info in state_info.string_states.values()):]]
-  char* endptr;
-  char buffer[kMaxNumberBufferSize];
-  size_t nbytes = std::min(kMaxNumberBufferSize - 1, length);
-  strncpy(&buffer[0], reinterpret_cast<const char*>(s), nbytes);
-  buffer[nbytes] = 0;
-[[  ]]
   switch (state_) {
 [[  for state, info in sorted(state_info.string_states.iteritems()):]]
 [[    prefix = 'APPEND' if info.prop_type.is_parent_array else 'SET']]
 [[    optional_state = '' if info.prop_type.is_parent_array else ', ' + info.prev_state]]
     case {{state}}:
-[[    if info.prop_type.ctype == "int64_t":]]
-      {{prefix}}_INT64_AND_RETURN({{info.cident}}{{optional_state}});
-[[    elif info.prop_type.ctype == "uint64_t":]]
-      {{prefix}}_UINT64_AND_RETURN({{info.cident}}{{optional_state}});
+[[    set_present = SetPresent(info.prop_type, info.cident, options)]]
+[[    if set_present:]]
+      SET_{{ValueMacro(info.prop_type)}}({{info.cident}});
+      {{set_present}}
+      state_ = {{info.prev_state}};
+      return 1;
 [[    else:]]
-      {{prefix}}_STRING_AND_RETURN({{info.cident}}{{optional_state}});
+      {{prefix}}_{{ValueMacro(info.prop_type)}}_AND_RETURN({{info.cident}}{{optional_state}});
 [[  ]]
     default:
       error->reset(new MessageError("Unexpected string"));
@@ -327,9 +657,14 @@ int {{schema.cbtype}}::OnMapKey(JsonParser* p, const unsigned char* s, size_t le
   switch (state_) {
 [[for state, info in sorted(state_info.prop_key_states.iteritems()):]]
     case {{state}}:
-[[  for prop, next_state, _, _ in sorted(info):]]
-[[    if not prop.is_additional_properties:]]
+      CHECK_FIELD_MASK({{info[0].prop.schema.schema_depth - 1}});
+[[  if options.map_key_dispatch == 'linear':]]
+[[    for prop, next_state, _, _ in sorted(info, key=lambda i: i.prop.name):]]
+[[      if not prop.is_additional_properties:]]
       CHECK_MAP_KEY("{{prop.name}}", {{len(prop.name)}}, {{next_state}});
+[[  else:]]
+[[    for line in MapKeyDispatch(info):]]
+      {{line}}
 [[  for prop, next_state, cident, iter_ident in info:]]
 [[    if prop.is_additional_properties:]]
       MAP_KEY_ADDL_PROPS({{cident}}, {{prop.ctypedef}}, {{iter_ident}}, {{next_state}});
@@ -355,10 +690,11 @@ int {{schema.cbtype}}::OnStartMap(JsonParser* p, ErrorPtr* error) {
 [[  for state, info in sorted(state_info.object_states.iteritems()):]]
     case {{state}}:
 [[    if isinstance(info.prop_type, ReferencePropertyType):]]
+[[      ref_macro = 'ARENA_REF' if options.arena else 'REF']]
 [[      if info.prop_type.is_parent_array:]]
-      PUSH_CALLBACK_REF_ARRAY_AND_RETURN({{info.prop_type.referent.ctype}}, {{info.prop_type.referent.cbtype}}, {{info.cident}});
+      PUSH_CALLBACK_{{ref_macro}}_ARRAY_AND_RETURN({{info.prop_type.referent.ctype}}, {{info.prop_type.referent.cbtype}}, {{info.cident}}, masks_[{{info.prop_type.schema_depth}}]);
 [[      else:]]
-      PUSH_CALLBACK_REF_AND_RETURN({{info.prop_type.referent.ctype}}, {{info.prop_type.referent.cbtype}}, {{info.cident}});
+      PUSH_CALLBACK_{{ref_macro}}_AND_RETURN({{info.prop_type.referent.ctype}}, {{info.prop_type.referent.cbtype}}, {{info.cident}}, masks_[{{info.prop_type.schema_depth}}]);
 [[    elif isinstance(info.prop_type, ObjectPropertyType):]]
 [[      if info.prop_type.is_parent_array:]]
       {{info.cident}}.push_back({{info.prop_type.ctype}}());
@@ -405,7 +741,7 @@ int {{schema.cbtype}}::OnStartArray(JsonParser* p, ErrorPtr* error) {
 [[]]
 [[if state_info.array_states:]]
   switch (state_) {
-[[  for state, info in state_info.array_states.iteritems():]]
+[[  for state, info in sorted(state_info.array_states.iteritems()):]]
     case {{state}}:
 [[    if info.prop_type.is_parent_array:]]
       {{info.cident}}.push_back({{info.prop_type.ctype}}());
@@ -429,7 +765,7 @@ int {{schema.cbtype}}::OnEndArray(JsonParser* p, ErrorPtr* error) {
 [[]]
 [[if state_info.array_states:]]
   switch (state_) {
-[[  for state, info in state_info.array_states.iteritems():]]
+[[  for state, info in sorted(state_info.array_states.iteritems()):]]
     case {{info.next_state}}:
       state_ = {{info.prev_state}};
       return 1;
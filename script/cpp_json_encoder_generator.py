@@ -1,25 +1,38 @@
-from easy_template import RunTemplateString
+from easy_template import RenderTemplate
 import gapi_utils
+import profiler
 import service
 
 
-def Generate(outf, service):
-  for schema in service.schemas.itervalues():
-    _GenerateSchemaDeclaration(outf, schema)
-  for schema in service.schemas.itervalues():
-    _GenerateSchemaThunkDefinition(outf, schema)
-  for schema in service.schemas.itervalues():
-    _GenerateSchemaDefinition(outf, schema)
+def Generate(outf, service, schemas=None,
+             options=gapi_utils.DEFAULT_GENERATOR_OPTIONS):
+  if schemas is None:
+    schemas = [schema for _, schema in sorted(service.schemas.iteritems())]
+  for schema in service.WithReferents(schemas):
+    with profiler.Schema(schema):
+      _GenerateSchemaDeclaration(outf, schema)
+  for schema in schemas:
+    with profiler.Schema(schema):
+      _GenerateSchemaThunkDefinition(outf, schema)
+  for schema in schemas:
+    with profiler.Schema(schema):
+      _GenerateSchemaDefinition(outf, schema, options)
+  for schema in schemas:
+    with profiler.Schema(schema):
+      _GenerateSchemaSizeDefinition(outf, schema, options)
 
 
 def _GenerateSchemaDeclaration(outf, schema):
-  outf.write(RunTemplateString(TEMPLATE_DECLARE_SCHEMA, vars()))
+  RenderTemplate(outf, TEMPLATE_DECLARE_SCHEMA, vars())
 
 def _GenerateSchemaThunkDefinition(outf, schema):
-  outf.write(RunTemplateString(TEMPLATE_DEFINE_SCHEMA_THUNK, vars()))
+  RenderTemplate(outf, TEMPLATE_DEFINE_SCHEMA_THUNK, vars())
 
-def _GenerateSchemaDefinition(outf, schema):
-  service.Iterate(schema, GenerateSchemaCallbacks(outf))
+def _GenerateSchemaDefinition(outf, schema, options):
+  service.Iterate(schema, GenerateSchemaCallbacks(outf, options))
+
+def _GenerateSchemaSizeDefinition(outf, schema, options):
+  service.Iterate(schema, SizeSchemaCallbacks(outf, options))
 
 
 def _IncrementIndexVar(index_var):
@@ -29,9 +42,30 @@ def _IncrementIndexVar(index_var):
     return 'i'
 
 
+def _IndexVar(obj):
+  """The loop variable of the innermost loop enclosing |obj|, or None."""
+  if obj.loop_depth:
+    return chr(ord('i') + obj.loop_depth - 1)
+  return None
+
+
+def _IsLiteralKey(name):
+  """Whether |name| is the same escaped as not, whatever the options."""
+  return all(' ' <= c <= '~' and c not in '"\\/' for c in name)
+
+
+def _Indent(obj):
+  # One level per enclosing loop.
+  return '  ' * obj.loop_depth
+
+
 class GenerateSchemaCallbacks(service.ServiceCallbacks):
-  def __init__(self, outf):
+  # The macros of the keys of properties, and of additional properties.
+  KEY_MACRO = 'CHECK_GEN_KEY'
+
+  def __init__(self, outf, options):
     self.outf = outf
+    self.options = options
 
   def CIdentFromContext(self, context):
     cident = 'data->'
@@ -53,100 +87,197 @@ class GenerateSchemaCallbacks(service.ServiceCallbacks):
       prev_item = item
     return cident
 
-  def IndexVarFromContext(self, context):
-    index_var = None
-    for item in context:
-      if (isinstance(item, service.ArrayPropertyType) or
-          (isinstance(item, service.Property) and
-           item.is_additional_properties)):
-        index_var = _IncrementIndexVar(index_var)
-    return index_var
-
-  def IndentFromContext(self, context):
-    indent = ''
-    for item in context:
-      if isinstance(item, service.ArrayPropertyType):
-        indent += '  '
-      elif isinstance(item, service.Property) and item.is_additional_properties:
-        indent += '  '
-    return indent
-
-  def GetPropKeyAndLen(self, prop):
+  def GenKey(self, prop):
+    """The statement that generates the key of |prop|."""
     if prop.is_additional_properties:
-      index_var = self.IndexVarFromContext(prop.GetContext())
-      return ('%s->first.c_str()' % index_var,
-              '%s->first.length()' % index_var)
-    return '"%s"' % prop.name, str(len(prop.name))
+      index_var = _IndexVar(prop)
+      return '%s(%s->first.c_str(), %s->first.length())' % (
+          self.KEY_MACRO, index_var, index_var)
+    name = prop.name.encode('utf-8')
+    if not _IsLiteralKey(name):
+      return '%s(%s, %d)' % (self.KEY_MACRO, gapi_utils.CStringLiteral(name),
+                             len(name))
+    # "name": as it is in the JSON, so that only its bytes are copied.
+    literal = '"\\"%s\\":"' % gapi_utils.CStringLiteral(name)[1:-1]
+    return '%s_LITERAL(%s, %d)' % (self.KEY_MACRO, literal, len(name) + 3)
+
+  def PresenceTest(self, prop_type, cident):
+    """Whether the value |cident| of |prop_type| is set, or None.
+
+    Only with --presence, for the primitive properties of structs; the other
+    values are always encoded.
+    """
+    prop = prop_type.prop
+    if (not self.options.presence or prop_type.is_parent_array or
+        prop.presence_bit is None):
+      return None
+    return '%shas_%s()' % (cident[:-len(prop.base_cident)], prop.base_cident)
 
   def BeginSchema(self, schema):
     if not schema.parent_schema:
-      self.outf.write(RunTemplateString(TEMPLATE_BEGIN_SCHEMA, vars()))
+      RenderTemplate(self.outf, TEMPLATE_BEGIN_SCHEMA, vars())
 
   def EndSchema(self, schema):
     if not schema.parent_schema:
-      self.outf.write(RunTemplateString(TEMPLATE_END_SCHEMA, vars()))
+      RenderTemplate(self.outf, TEMPLATE_END_SCHEMA, vars())
 
   def BeginProperty(self, prop):
     if prop.is_additional_properties:
       cident = self.CIdentFromContext(prop.GetContext())
-      indent = self.IndentFromContext(prop.schema.GetContext())
-      index_var = self.IndexVarFromContext(prop.GetContext())
-      self.outf.write(RunTemplateString(TEMPLATE_BEGIN_ADDL_PROPS, vars(),
-                                        output_indent=indent))
+      indent = _Indent(prop.schema)
+      index_var = _IndexVar(prop)
+      RenderTemplate(self.outf, TEMPLATE_BEGIN_ADDL_PROPS, vars(),
+                     output_indent=indent)
 
   def EndProperty(self, prop):
     if prop.is_additional_properties:
-      indent = self.IndentFromContext(prop.schema.GetContext())
-      self.outf.write(RunTemplateString(TEMPLATE_END_ADDL_PROPS, vars(),
-                                        output_indent=indent))
+      indent = _Indent(prop.schema)
+      RenderTemplate(self.outf, TEMPLATE_END_ADDL_PROPS, vars(),
+                     output_indent=indent)
 
   def PrimitivePropertyType(self, prop_type):
-    context = prop_type.GetContext()
-    indent = self.IndentFromContext(context)
+    indent = _Indent(prop_type)
     cident = self.CIdentFromContext(prop_type.GetContext())
-    prop_key, prop_key_len = self.GetPropKeyAndLen(prop_type.prop)
-    self.outf.write(RunTemplateString(TEMPLATE_PRIMITIVE_HEADER, vars(),
-                                      output_indent=indent))
+    gen_key = self.GenKey(prop_type.prop)
+    present = self.PresenceTest(prop_type, cident)
+    if present:
+      RenderTemplate(self.outf, TEMPLATE_BEGIN_PRESENT, vars(),
+                     output_indent=indent)
+      indent += '  '
+    RenderTemplate(self.outf, TEMPLATE_PRIMITIVE_HEADER, vars(),
+                   output_indent=indent)
     type_macro = TYPE_MACRO_DICT[prop_type.type_format]
     if type_macro == 'String':
-      self.outf.write(RunTemplateString(TEMPLATE_PRIMITIVE_STRING, vars(),
-                                        output_indent=indent))
+      RenderTemplate(self.outf, TEMPLATE_PRIMITIVE_STRING, vars(),
+                     output_indent=indent)
+    elif type_macro == 'Bytes':
+      RenderTemplate(self.outf, TEMPLATE_PRIMITIVE_BYTES, vars(),
+                     output_indent=indent)
     else:
-      self.outf.write(RunTemplateString(TEMPLATE_PRIMITIVE_NON_STRING, vars(),
-                                        output_indent=indent))
+      RenderTemplate(self.outf, TEMPLATE_PRIMITIVE_NON_STRING, vars(),
+                     output_indent=indent)
+    if present:
+      RenderTemplate(self.outf, TEMPLATE_END_PRESENT, vars(),
+                     output_indent=_Indent(prop_type))
+
+  def BeginArrayPropertyType(self, prop_type):
+    indent = _Indent(prop_type.parent)
+    cident = self.CIdentFromContext(prop_type.parent.GetContext())
+    gen_key = self.GenKey(prop_type.prop)
+    index_var = _IndexVar(prop_type)
+    RenderTemplate(self.outf, TEMPLATE_BEGIN_ARRAY, vars(),
+                   output_indent=indent)
+
+  def EndArrayPropertyType(self, prop_type):
+    indent = _Indent(prop_type.parent)
+    RenderTemplate(self.outf, TEMPLATE_END_ARRAY, vars(), output_indent=indent)
+
+  def BeginObjectPropertyType(self, prop_type):
+    indent = _Indent(prop_type)
+    gen_key = self.GenKey(prop_type.prop)
+    RenderTemplate(self.outf, TEMPLATE_BEGIN_OBJECT, vars(),
+                   output_indent=indent)
+
+  def EndObjectPropertyType(self, prop_type):
+    indent = _Indent(prop_type)
+    RenderTemplate(self.outf, TEMPLATE_END_OBJECT, vars(), output_indent=indent)
+
+  def ReferencePropertyType(self, prop_type):
+    indent = _Indent(prop_type)
+    cident = self.CIdentFromContext(prop_type.GetContext())
+    gen_key = self.GenKey(prop_type.prop)
+    # A shared_ptr, or with --arena, a plain pointer.
+    pointer = cident if self.options.arena else cident + '.get()'
+    RenderTemplate(self.outf, TEMPLATE_REFERENCE, vars(), output_indent=indent)
+
+
+class SizeSchemaCallbacks(GenerateSchemaCallbacks):
+  """Generates EncodedSize, which adds up what Encode would generate.
+
+  Every member of a map and element of an array counts one byte for the ','
+  before it; a map or array counts one more for its brackets, or two if it
+  is empty, which it finds out by comparing the size with its |start|.
+  """
+  KEY_MACRO = 'SIZE_KEY'
+
+  def __init__(self, outf, options):
+    GenerateSchemaCallbacks.__init__(self, outf, options)
+    # The start variables of the maps and arrays being sized.
+    self.starts = []
+    self.num_starts = 0
+
+  def SizeKey(self, prop_type):
+    """The statement that sizes the key of |prop_type|, or its ','."""
+    if prop_type.is_parent_array:
+      return 'SIZE_ELEMENT'
+    return self.GenKey(prop_type.prop)
+
+  def PushStart(self):
+    self.num_starts += 1
+    self.starts.append('start%d' % self.num_starts)
+    return self.starts[-1]
+
+  def BeginSchema(self, schema):
+    if not schema.parent_schema:
+      self.num_starts = 0
+      start = self.PushStart()
+      RenderTemplate(self.outf, TEMPLATE_SIZE_BEGIN_SCHEMA, vars())
+
+  def EndSchema(self, schema):
+    if not schema.parent_schema:
+      start = self.starts.pop()
+      RenderTemplate(self.outf, TEMPLATE_SIZE_END_SCHEMA, vars())
+
+  def PrimitivePropertyType(self, prop_type):
+    indent = _Indent(prop_type)
+    cident = self.CIdentFromContext(prop_type.GetContext())
+    size_key = self.SizeKey(prop_type)
+    type_macro = TYPE_MACRO_DICT[prop_type.type_format]
+    present = self.PresenceTest(prop_type, cident)
+    if present:
+      RenderTemplate(self.outf, TEMPLATE_BEGIN_PRESENT, vars(),
+                     output_indent=indent)
+    RenderTemplate(self.outf, TEMPLATE_SIZE_PRIMITIVE, vars(),
+                   output_indent=indent + '  ' if present else indent)
+    if present:
+      RenderTemplate(self.outf, TEMPLATE_END_PRESENT, vars(),
+                     output_indent=indent)
 
   def BeginArrayPropertyType(self, prop_type):
-    context = prop_type.GetPrevContext()
-    indent = self.IndentFromContext(context)
-    cident = self.CIdentFromContext(context)
-    prop_key, prop_key_len = self.GetPropKeyAndLen(prop_type.prop)
-    index_var = self.IndexVarFromContext(prop_type.GetContext())
-    self.outf.write(RunTemplateString(TEMPLATE_BEGIN_ARRAY, vars(),
-                                      output_indent=indent))
+    indent = _Indent(prop_type.parent)
+    cident = self.CIdentFromContext(prop_type.parent.GetContext())
+    size_key = self.SizeKey(prop_type)
+    index_var = _IndexVar(prop_type)
+    start = self.PushStart()
+    RenderTemplate(self.outf, TEMPLATE_SIZE_BEGIN_ARRAY, vars(),
+                   output_indent=indent)
 
   def EndArrayPropertyType(self, prop_type):
-    indent = self.IndentFromContext(prop_type.GetPrevContext())
-    self.outf.write(RunTemplateString(TEMPLATE_END_ARRAY, vars(),
-                                      output_indent=indent))
+    indent = _Indent(prop_type.parent)
+    start = self.starts.pop()
+    RenderTemplate(self.outf, TEMPLATE_SIZE_END_ARRAY, vars(),
+                   output_indent=indent)
 
   def BeginObjectPropertyType(self, prop_type):
-    indent = self.IndentFromContext(prop_type.GetContext())
-    prop_key, prop_key_len = self.GetPropKeyAndLen(prop_type.prop)
-    self.outf.write(RunTemplateString(TEMPLATE_BEGIN_OBJECT, vars(),
-                                      output_indent=indent))
+    indent = _Indent(prop_type)
+    size_key = self.SizeKey(prop_type)
+    start = self.PushStart()
+    RenderTemplate(self.outf, TEMPLATE_SIZE_BEGIN_OBJECT, vars(),
+                   output_indent=indent)
 
   def EndObjectPropertyType(self, prop_type):
-    indent = self.IndentFromContext(prop_type.GetContext())
-    self.outf.write(RunTemplateString(TEMPLATE_END_OBJECT, vars(),
-                                      output_indent=indent))
+    indent = _Indent(prop_type)
+    start = self.starts.pop()
+    RenderTemplate(self.outf, TEMPLATE_SIZE_END_OBJECT, vars(),
+                   output_indent=indent)
 
   def ReferencePropertyType(self, prop_type):
-    context = prop_type.GetContext()
-    indent = self.IndentFromContext(context)
-    cident = self.CIdentFromContext(context)
-    prop_key, prop_key_len = self.GetPropKeyAndLen(prop_type.prop)
-    self.outf.write(RunTemplateString(TEMPLATE_REFERENCE, vars(),
-                                      output_indent=indent))
+    indent = _Indent(prop_type)
+    cident = self.CIdentFromContext(prop_type.GetContext())
+    size_key = self.SizeKey(prop_type)
+    pointer = cident if self.options.arena else cident + '.get()'
+    RenderTemplate(self.outf, TEMPLATE_SIZE_REFERENCE, vars(),
+                   output_indent=indent)
 
 
 TYPE_MACRO_DICT = {
@@ -157,6 +288,7 @@ TYPE_MACRO_DICT = {
   ('number', 'double'): 'Double',
   ('number', 'float'): 'Float',
   ('string', ''): 'String',
+  ('string', 'byte'): 'Bytes',
   ('string', 'int64'): 'Int64',
   ('string', 'uint64'): 'Uint64',
 }
@@ -164,13 +296,23 @@ TYPE_MACRO_DICT = {
 
 TEMPLATE_DECLARE_SCHEMA = """\
 bool Encode(JsonGenerator* g, {{schema.ctype}}* data, ErrorPtr* error);
+size_t EncodedSize(const {{schema.ctype}}* data, const JsonGeneratorOptions& options);
 """
 
 TEMPLATE_DEFINE_SCHEMA_THUNK = """\
 
 void Encode(Writer* src, {{schema.ctype}}* data, const JsonGeneratorOptions& options, ErrorPtr* error) {
   JsonGenerator g(src, options);
-  Encode(&g, data, error);
+  if (Encode(&g, data, error))
+    g.Flush(error);
+}
+
+size_t EncodedSize(const {{schema.ctype}}& data, const JsonGeneratorOptions& options) {
+  return EncodedSize(&data, options);
+}
+
+size_t EncodedSize(const {{schema.ctype}}& data) {
+  return EncodedSize(&data, JsonGeneratorOptions());
 }
 """
 
@@ -194,9 +336,17 @@ TEMPLATE_END_ADDL_PROPS = """\
   }
 """
 
+TEMPLATE_BEGIN_PRESENT = """\
+  if ({{present}}) {
+"""
+
+TEMPLATE_END_PRESENT = """\
+  }
+"""
+
 TEMPLATE_PRIMITIVE_HEADER = """\
 [[if not prop_type.is_parent_array:]]
-  CHECK_GEN_KEY({{prop_key}}, {{prop_key_len}});
+  {{gen_key}};
 """
 
 TEMPLATE_PRIMITIVE_NON_STRING = """\
@@ -207,9 +357,13 @@ TEMPLATE_PRIMITIVE_STRING = """\
   CHECK_GEN_STRING({{cident}});
 """
 
+TEMPLATE_PRIMITIVE_BYTES = """\
+  CHECK_GEN_BYTES({{cident}});
+"""
+
 TEMPLATE_BEGIN_ARRAY = """\
 [[if not prop_type.is_parent_array:]]
-  CHECK_GEN_KEY({{prop_key}}, {{prop_key_len}});
+  {{gen_key}};
 [[]]
   CHECK_GEN(StartArray);
   GEN_FOREACH({{index_var}}, {{cident}}) {
@@ -222,7 +376,7 @@ TEMPLATE_END_ARRAY = """\
 
 TEMPLATE_BEGIN_OBJECT = """\
 [[if not prop_type.is_parent_array:]]
-  CHECK_GEN_KEY({{prop_key}}, {{prop_key_len}});
+  {{gen_key}};
 [[]]
   CHECK_GEN(StartMap);
 """
@@ -232,10 +386,60 @@ TEMPLATE_END_OBJECT = """\
 """
 
 TEMPLATE_REFERENCE = """\
-  if ({{cident}}.get()) {
+  if ({{pointer}}) {
 [[if not prop_type.is_parent_array:]]
-    CHECK_GEN_KEY({{prop_key}}, {{prop_key_len}});
+    {{gen_key}};
 [[]]
-    CHECK_ENCODE({{cident}}.get());
+    CHECK_ENCODE({{pointer}});
+  }
+"""
+
+TEMPLATE_SIZE_BEGIN_SCHEMA = """\
+
+size_t EncodedSize(const {{schema.ctype}}* data, const JsonGeneratorOptions& options) {
+  size_t size = 0;
+  SIZE_START({{start}});
+"""
+
+TEMPLATE_SIZE_END_SCHEMA = """\
+  SIZE_END({{start}});
+  return size;
+}
+"""
+
+TEMPLATE_SIZE_PRIMITIVE = """\
+  {{size_key}};
+[[if type_macro == 'String':]]
+  SIZE_STRING({{cident}});
+[[elif type_macro == 'Bytes':]]
+  SIZE_BYTES({{cident}});
+[[else:]]
+  SIZE1({{type_macro}}, {{cident}});
+"""
+
+TEMPLATE_SIZE_BEGIN_ARRAY = """\
+  {{size_key}};
+  SIZE_START({{start}});
+  GEN_FOREACH({{index_var}}, {{cident}}) {
+"""
+
+TEMPLATE_SIZE_END_ARRAY = """\
+  }
+  SIZE_END({{start}});
+"""
+
+TEMPLATE_SIZE_BEGIN_OBJECT = """\
+  {{size_key}};
+  SIZE_START({{start}});
+"""
+
+TEMPLATE_SIZE_END_OBJECT = """\
+  SIZE_END({{start}});
+"""
+
+TEMPLATE_SIZE_REFERENCE = """\
+  if ({{pointer}}) {
+    {{size_key}};
+    SIZE_ENCODE({{pointer}});
   }
 """
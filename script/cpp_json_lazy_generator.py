@@ -0,0 +1,99 @@
+from easy_template import RenderTemplate
+import gapi_utils
+import profiler
+import service
+
+
+def Generate(outf, service, schemas=None,
+             options=gapi_utils.DEFAULT_GENERATOR_OPTIONS):
+  if not options.lazy:
+    return
+  if schemas is None:
+    schemas = [schema for _, schema in sorted(service.schemas.iteritems())]
+  CapWords = gapi_utils.CapWords
+  CStringLiteral = gapi_utils.CStringLiteral
+  ArrayReferent = LazyArrayReferent
+  for schema in schemas:
+    with profiler.Schema(schema):
+      props = LazyProperties(schema)
+      RenderTemplate(outf, TEMPLATE_LAZY, vars())
+
+
+def LazyProperties(schema):
+  """The properties of |schema| that its Lazy class has accessors for."""
+  return [prop for _, prop in sorted(schema.properties.iteritems())]
+
+
+def LazyArrayReferent(prop):
+  """The referent of |prop| if it is an array of $refs, else None.
+
+  Their Lazy classes have accessors for each element, for list responses.
+  """
+  prop_type = prop.prop_type
+  if (isinstance(prop_type, service.ArrayPropertyType) and
+      isinstance(prop_type.element_type, service.ReferencePropertyType)):
+    return prop_type.element_type.referent
+  return None
+
+
+TEMPLATE_LAZY = """\
+Lazy{{schema.ctype}}::Lazy{{schema.ctype}}(const JsonIndex* index, size_t value)
+    : index_(index),
+      value_(value) {
+  memset(decoded_, 0, sizeof(decoded_));
+}
+
+Lazy{{schema.ctype}}::~Lazy{{schema.ctype}}() {
+[[for prop in props:]]
+[[  if ArrayReferent(prop):]]
+  for (size_t i = 0; i < {{prop.base_cident}}_.size(); ++i)
+    delete {{prop.base_cident}}_[i];
+[[]]
+}
+
+const {{schema.ctype}}& Lazy{{schema.ctype}}::DecodeAll(ErrorPtr* error) {
+  data_ = {{schema.ctype}}();
+  memset(decoded_, 0, sizeof(decoded_));
+  if (DecodeIndexedValue<{{schema.cbtype}}>(*index_, value_, &data_, error)) {
+    for (size_t i = 0; i < sizeof(decoded_)/sizeof(decoded_[0]); ++i)
+      decoded_[i] = true;
+  }
+  return data_;
+}
+[[for i, prop in enumerate(props):]]
+[[  name = prop.name.encode('utf-8')]]
+
+const {{prop.ctype}}& Lazy{{schema.ctype}}::Get{{CapWords(prop.name)}}(ErrorPtr* error) {
+  if (!decoded_[{{i}}]) {
+    decoded_[{{i}}] = true;
+    DecodeIndexedMember<{{schema.cbtype}}>(*index_, value_, {{CStringLiteral(name)}}, {{len(name)}}, &data_, error);
+  } else if (error) {
+    error->reset();
+  }
+  return data_.{{prop.base_cident}};
+}
+[[  referent = ArrayReferent(prop)]]
+[[  if referent:]]
+
+size_t Lazy{{schema.ctype}}::{{CapWords(prop.name)}}Size() const {
+  size_t array = index_->Find(value_, {{CStringLiteral(name)}}, {{len(name)}});
+  if (array == JsonIndex::kNone || !index_->IsArray(array))
+    return 0;
+  return index_->num_children(array);
+}
+
+Lazy{{referent.ctype}}* Lazy{{schema.ctype}}::{{CapWords(prop.name)}}At(size_t i) {
+  size_t size = {{CapWords(prop.name)}}Size();
+  if (i >= size)
+    return NULL;
+  if ({{prop.base_cident}}_.empty())
+    {{prop.base_cident}}_.resize(size);
+  if (!{{prop.base_cident}}_[i]) {
+    size_t array = index_->Find(value_, {{CStringLiteral(name)}}, {{len(name)}});
+    {{prop.base_cident}}_[i] = new Lazy{{referent.ctype}}(index_, index_->child(array, i));
+  }
+  return {{prop.base_cident}}_[i];
+}
+[[]]
+
+"""
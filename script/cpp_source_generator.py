@@ -1,20 +1,56 @@
 import cpp_json_constructor_generator
 import cpp_json_decoder_generator
 import cpp_json_encoder_generator
-from easy_template import RunTemplateString
+import cpp_json_lazy_generator
+from easy_template import RenderTemplate
+import gapi_utils
+import profiler
 
 
-def Generate(outf, s, **kwargs):
-  outf.write(RunTemplateString(SOURCE_HEAD, kwargs))
-  cpp_json_constructor_generator.Generate(outf, s)
-  cpp_json_decoder_generator.Generate(outf, s)
-  cpp_json_encoder_generator.Generate(outf, s)
-  outf.write(RunTemplateString(SOURCE_FOOT, kwargs))
+# Pass as |num_shards| to ShardSchemas for one shard per top-level schema.
+SHARD_PER_SCHEMA = 'schema'
+
+
+def Generate(outf, s, schemas=None,
+             options=gapi_utils.DEFAULT_GENERATOR_OPTIONS, **kwargs):
+  """Write the source for |schemas|, a list of top-level schemas.
+
+  By default the source covers every schema in |s|; see ShardSchemas.
+  """
+  RenderTemplate(outf, SOURCE_HEAD, kwargs)
+  for generator in (cpp_json_constructor_generator,
+                    cpp_json_decoder_generator,
+                    cpp_json_encoder_generator,
+                    cpp_json_lazy_generator):
+    with profiler.Phase(generator.__name__):
+      generator.Generate(outf, s, schemas, options)
+  RenderTemplate(outf, SOURCE_FOOT, kwargs)
+
+
+def ShardSchemas(s, num_shards):
+  """Split the top-level schemas of |s| into |num_shards| lists.
+
+  Each list is the |schemas| of one source file, so the files can be compiled
+  in parallel. Schemas are assigned largest first to the smallest shard so
+  far, using the number of model events as an estimate of their code size.
+  With SHARD_PER_SCHEMA, each schema gets a shard of its own.
+  """
+  schemas = [schema for _, schema in sorted(s.schemas.iteritems())]
+  if num_shards == SHARD_PER_SCHEMA:
+    return [[schema] for schema in schemas]
+  shards = [[] for _ in xrange(num_shards)]
+  sizes = [0] * num_shards
+  for schema in sorted(schemas, key=lambda schema: -len(schema.events)):
+    index = sizes.index(min(sizes))
+    shards[index].append(schema)
+    sizes[index] += len(schema.events)
+  for shard in shards:
+    shard.sort(key=lambda schema: schema.name)
+  return shards
 
 
 SOURCE_HEAD = """\
 #include "{{header_name}}"
-#include <errno.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
@@ -23,13 +59,12 @@ SOURCE_HEAD = """\
 #include "json_generator.h"
 #include "json_parser.h"
 #include "json_parser_macros.h"
+#include "json_scanner.h"
 
 
 [[if namespace:]]
 namespace {{namespace}} {
 
-static const size_t kMaxNumberBufferSize = 32;
-
 [[]]
 """
 
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""Download discovery documents into a local cache.
+
+Documents are fetched by a bounded pool of threads. Each thread keeps one
+persistent HTTP/1.1 connection per host, so refreshing hundreds of APIs from
+the same server reuses a handful of connections. The ETag and Last-Modified
+headers of every response are stored next to the cached file (as
+<filename>.meta) and sent back as If-None-Match/If-Modified-Since, so
+unchanged documents cost a 304 and no body.
+"""
+
+import collections
+import gzip
+import httplib
+import json
+import optparse
+import os
+import Queue
+import socket
+import StringIO
+import sys
+import threading
+import urlparse
+
+
+MAX_REDIRECTS = 5
+DEFAULT_MAX_CONNECTIONS = 8
+DEFAULT_TIMEOUT = 60
+
+FetchResult = collections.namedtuple(
+    'FetchResult', ['url', 'filename', 'status', 'error'])
+# status is one of:
+#   'fetched'       - the document was downloaded and the cache updated.
+#   'not-modified'  - the server answered 304, the cache is current.
+#   'failed'        - see error; a previously cached copy may still exist.
+
+
+class FetchError(Exception):
+  pass
+
+
+def MetaFilename(filename):
+  return filename + '.meta'
+
+
+def ReadMeta(filename):
+  if not os.path.exists(filename):
+    # Without the document, old validators are useless.
+    return {}
+  try:
+    with open(MetaFilename(filename)) as f:
+      return json.load(f)
+  except (IOError, ValueError):
+    return {}
+
+
+def _WriteAtomic(filename, data):
+  tmp_name = filename + '.tmp'
+  with open(tmp_name, 'wb') as f:
+    f.write(data)
+  os.rename(tmp_name, filename)
+
+
+class _ConnectionCache(object):
+  """Persistent connections of one worker thread, keyed by scheme and host."""
+
+  def __init__(self, timeout):
+    self.timeout = timeout
+    self.connections = {}
+
+  def Get(self, scheme, netloc):
+    key = (scheme, netloc)
+    conn = self.connections.get(key)
+    if conn is None:
+      if scheme == 'https':
+        conn = httplib.HTTPSConnection(netloc, timeout=self.timeout)
+      elif scheme == 'http':
+        conn = httplib.HTTPConnection(netloc, timeout=self.timeout)
+      else:
+        raise FetchError('Unsupported URL scheme: %s' % scheme)
+      self.connections[key] = conn
+    return conn
+
+  def Drop(self, scheme, netloc):
+    conn = self.connections.pop((scheme, netloc), None)
+    if conn:
+      conn.close()
+
+  def CloseAll(self):
+    for conn in self.connections.itervalues():
+      conn.close()
+    self.connections.clear()
+
+
+class Fetcher(object):
+  def __init__(self, max_connections=DEFAULT_MAX_CONNECTIONS,
+               timeout=DEFAULT_TIMEOUT):
+    self.max_connections = max_connections
+    self.timeout = timeout
+
+  def Fetch(self, requests):
+    """Fetch each (url, filename) in |requests|.
+
+    Returns a list of FetchResult, in the same order as |requests|.
+    """
+    requests = list(requests)
+    results = [None] * len(requests)
+    work = Queue.Queue()
+    for index, request in enumerate(requests):
+      work.put((index, request))
+
+    def Worker():
+      connections = _ConnectionCache(self.timeout)
+      try:
+        while True:
+          try:
+            index, (url, filename) = work.get_nowait()
+          except Queue.Empty:
+            return
+          results[index] = self._FetchOne(connections, url, filename)
+      finally:
+        connections.CloseAll()
+
+    num_threads = max(1, min(self.max_connections, len(requests)))
+    threads = [threading.Thread(target=Worker) for _ in xrange(num_threads)]
+    for thread in threads:
+      thread.daemon = True
+      thread.start()
+    for thread in threads:
+      thread.join()
+    return results
+
+  def _FetchOne(self, connections, url, filename):
+    # Anything can go wrong with one document (e.g. a zlib.error from a
+    # corrupt gzip body); it must fail only that document, not its worker.
+    try:
+      return self._FetchWithRedirects(connections, url, filename)
+    except Exception as e:
+      return FetchResult(url, filename, 'failed', str(e) or repr(e))
+
+  def _FetchWithRedirects(self, connections, url, filename):
+    meta = ReadMeta(filename)
+    headers = {'Accept-Encoding': 'gzip'}
+    if meta.get('url') == url:
+      if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+      if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+
+    request_url = url
+    for _ in xrange(MAX_REDIRECTS + 1):
+      response, body = self._Request(connections, request_url, headers)
+      if response.status in (301, 302, 303, 307, 308):
+        location = response.getheader('location')
+        if not location:
+          raise FetchError('%s: redirect without Location' % request_url)
+        request_url = urlparse.urljoin(request_url, location)
+        continue
+      if response.status == 304:
+        return FetchResult(url, filename, 'not-modified', None)
+      if response.status != 200:
+        raise FetchError('%s: HTTP %d %s' % (request_url, response.status,
+                                             response.reason))
+      if response.getheader('content-encoding', '').lower() == 'gzip':
+        body = gzip.GzipFile(fileobj=StringIO.StringIO(body)).read()
+      try:
+        json.loads(body)
+      except ValueError as e:
+        # Keep the cached copy rather than replace it with this.
+        raise FetchError('%s: invalid JSON: %s' % (request_url, e))
+      _WriteAtomic(filename, body)
+      new_meta = {
+        'url': url,
+        'etag': response.getheader('etag'),
+        'last_modified': response.getheader('last-modified'),
+      }
+      _WriteAtomic(MetaFilename(filename),
+                   json.dumps(new_meta, indent=2, sort_keys=True,
+                              separators=(',', ': ')) + '\n')
+      return FetchResult(url, filename, 'fetched', None)
+    raise FetchError('%s: too many redirects' % url)
+
+  def _Request(self, connections, url, headers):
+    parts = urlparse.urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+      path += '?' + parts.query
+    # A kept-alive connection may have been closed by the server since its
+    # last use; retry once on a fresh connection in that case.
+    for attempt in (0, 1):
+      conn = connections.Get(parts.scheme, parts.netloc)
+      try:
+        conn.request('GET', path, headers=headers)
+        response = conn.getresponse()
+        body = response.read()
+      except (httplib.HTTPException, socket.error):
+        connections.Drop(parts.scheme, parts.netloc)
+        if attempt:
+          raise
+        continue
+      if response.getheader('connection', '').lower() == 'close':
+        connections.Drop(parts.scheme, parts.netloc)
+      return response, body
+
+
+def main(args):
+  parser = optparse.OptionParser(usage='%prog [options] url filename ...')
+  parser.add_option('-j', '--jobs', type='int',
+                    default=DEFAULT_MAX_CONNECTIONS,
+                    help='maximum number of concurrent connections.')
+  options, args = parser.parse_args(args)
+  if not args or len(args) % 2:
+    parser.error('Expected pairs of url and filename.')
+
+  requests = zip(args[::2], args[1::2])
+  failed = 0
+  for result in Fetcher(options.jobs).Fetch(requests):
+    print '%s: %s' % (result.filename, result.status)
+    if result.error:
+      print '  %s' % result.error
+      failed += 1
+  return 1 if failed else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
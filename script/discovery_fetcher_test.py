@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""Tests of discovery_fetcher against a local HTTP server."""
+
+import BaseHTTPServer
+import gzip
+import json
+import os
+import shutil
+import SocketServer
+import StringIO
+import tempfile
+import threading
+import unittest
+
+import discovery_fetcher
+
+
+DOCUMENT = json.dumps({'name': 'test', 'schemas': {}})
+ETAG = '"v1"'
+
+
+def Gzip(data):
+  f = StringIO.StringIO()
+  with gzip.GzipFile(fileobj=f, mode='wb') as g:
+    g.write(data)
+  return f.getvalue()
+
+
+def CorruptGzip(data):
+  # Keep the gzip header, so only inflating the body fails (with zlib.error):
+  # the first deflate block gets the reserved block type.
+  data = Gzip(data)
+  return data[:10] + '\x07' + data[11:]
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+  # Keep-alive, like the servers the fetcher talks to.
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):
+    self.server.requests.append((self.path, dict(self.headers)))
+    if self.path == '/document':
+      if self.headers.get('if-none-match') == ETAG:
+        self.Reply(304)
+      else:
+        self.Reply(200, DOCUMENT, {'ETag': ETAG})
+    elif self.path == '/bad-json':
+      self.Reply(200, '{"name": ')
+    elif self.path == '/bad-gzip':
+      self.Reply(200, CorruptGzip(DOCUMENT), {'Content-Encoding': 'gzip'})
+    else:
+      self.Reply(404)
+
+  def Reply(self, status, body='', headers={}):
+    self.send_response(status)
+    for name, value in headers.iteritems():
+      self.send_header(name, value)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+
+class FetcherTest(unittest.TestCase):
+  def setUp(self):
+    self.server = Server(('127.0.0.1', 0), Handler)
+    self.server.requests = []
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+    shutil.rmtree(self.dir)
+
+  def Url(self, path):
+    return 'http://127.0.0.1:%d%s' % (self.server.server_port, path)
+
+  def Filename(self, name):
+    return os.path.join(self.dir, name)
+
+  def Fetch(self, *paths):
+    requests = [(self.Url(path), self.Filename(path.strip('/') + '.json'))
+                for path in paths]
+    return discovery_fetcher.Fetcher(max_connections=4).Fetch(requests)
+
+  def testRevalidation(self):
+    result, = self.Fetch('/document')
+    self.assertEqual('fetched', result.status)
+    with open(result.filename) as f:
+      self.assertEqual(DOCUMENT, f.read())
+
+    result, = self.Fetch('/document')
+    self.assertEqual('not-modified', result.status)
+    self.assertEqual(None, result.error)
+    _, headers = self.server.requests[-1]
+    self.assertEqual(ETAG, headers['if-none-match'])
+
+  def testNotFound(self):
+    result, = self.Fetch('/missing')
+    self.assertEqual('failed', result.status)
+    self.assertIn('HTTP 404', result.error)
+    self.assertFalse(os.path.exists(result.filename))
+
+  def testBadJson(self):
+    result, = self.Fetch('/bad-json')
+    self.assertEqual('failed', result.status)
+    self.assertIn('invalid JSON', result.error)
+    self.assertFalse(os.path.exists(result.filename))
+
+  def testBadJsonKeepsCachedCopy(self):
+    filename = self.Filename('bad-json.json')
+    with open(filename, 'w') as f:
+      f.write(DOCUMENT)
+    result, = self.Fetch('/bad-json')
+    self.assertEqual('failed', result.status)
+    with open(filename) as f:
+      self.assertEqual(DOCUMENT, f.read())
+
+  def testErrorsOnlyFailTheirDocument(self):
+    results = self.Fetch('/bad-gzip', '/document', '/missing', '/bad-json')
+    self.assertEqual(['failed', 'fetched', 'failed', 'failed'],
+                     [result.status for result in results])
+    self.assertIn('invalid block type', results[0].error)
+    self.assertFalse(os.path.exists(results[0].filename))
+
+
+if __name__ == '__main__':
+  unittest.main()
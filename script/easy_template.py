@@ -3,16 +3,35 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import collections
 import copy
 import cStringIO
+import hashlib
+import imp
+import marshal
 import optparse
+import os
 import re
 import sys
+import tempfile
 
 
 STATEMENT_RE = "\[\[(.*?)\]\]"  # [[...]]
 EXPR_RE = "\{\{(.*?)\}\}"  # {{...}}
 
+# Bump this whenever TemplateToPython changes the code it produces, so stale
+# entries in an on-disk cache are not reused.
+CACHE_VERSION = 2
+
+# Compiled template code objects, keyed by _CacheKey().
+_code_cache = {}
+# Directory for the optional on-disk cache, see SetCacheDir().
+_cache_dir = None
+# Counts of 'hits' (in memory), 'disk_hits' and 'misses'.
+cache_stats = collections.Counter()
+# Counts of rendered templates ('calls') and 'bytes' emitted.
+render_stats = collections.Counter()
+
 def TemplateToPython(template, statement_re, expr_re, output_indent):
   output = cStringIO.StringIO()
   indent_re = re.compile(r'\s*')
@@ -41,7 +60,7 @@ def TemplateToPython(template, statement_re, expr_re, output_indent):
       else:
         subst_line = r'r"""%s%s"""' % (output_indent, line)
 
-      out_string = r'%s__outfile__.write(%s + %s)' % (
+      out_string = r'%s__write__(%s + %s)' % (
           indent_string,
           subst_line,
           repr(line_ending))
@@ -50,14 +69,126 @@ def TemplateToPython(template, statement_re, expr_re, output_indent):
   return output.getvalue()
 
 
+_DEFAULT_STATEMENT_RE = re.compile(STATEMENT_RE)
+_DEFAULT_EXPR_RE = re.compile(EXPR_RE)
+
+
+def SetCacheDir(cache_dir):
+  """Also cache compiled templates in |cache_dir|, shared between processes.
+
+  Pass None to only cache in memory.
+  """
+  global _cache_dir
+  if cache_dir and not os.path.isdir(cache_dir):
+    os.makedirs(cache_dir)
+  _cache_dir = cache_dir
+
+
+def ClearCache():
+  _code_cache.clear()
+  cache_stats.clear()
+
+
+def _CacheKey(template, statement_re, expr_re, output_indent):
+  return (template, statement_re.pattern, statement_re.flags,
+          expr_re.pattern, expr_re.flags, output_indent)
+
+
+def _DiskCachePath(key):
+  digest = hashlib.sha1(repr((CACHE_VERSION,) + key)).hexdigest()
+  return os.path.join(_cache_dir, digest + '.tmplc')
+
+
+def _ReadDiskCache(key):
+  try:
+    with open(_DiskCachePath(key), 'rb') as f:
+      data = f.read()
+  except IOError:
+    return None
+  magic = imp.get_magic()
+  if not data.startswith(magic):
+    return None
+  try:
+    return marshal.loads(data[len(magic):])
+  except (EOFError, ValueError, TypeError):
+    return None
+
+
+def _WriteDiskCache(key, code):
+  # Write to a temporary file and rename, so concurrent generators never see a
+  # partially written entry.
+  fd, tmp_name = tempfile.mkstemp(dir=_cache_dir)
+  try:
+    with os.fdopen(fd, 'wb') as f:
+      f.write(imp.get_magic())
+      f.write(marshal.dumps(code))
+    os.rename(tmp_name, _DiskCachePath(key))
+  except (IOError, OSError):
+    if os.path.exists(tmp_name):
+      os.remove(tmp_name)
+
+
+def CompileTemplate(template, statement_re=None, expr_re=None,
+                    output_indent=''):
+  """Return the code object for |template|, translating it at most once."""
+  statement_re = statement_re or _DEFAULT_STATEMENT_RE
+  expr_re = expr_re or _DEFAULT_EXPR_RE
+  key = _CacheKey(template, statement_re, expr_re, output_indent)
+  code = _code_cache.get(key)
+  if code is not None:
+    cache_stats['hits'] += 1
+    return code
+
+  if _cache_dir:
+    code = _ReadDiskCache(key)
+    if code is not None:
+      cache_stats['disk_hits'] += 1
+      _code_cache[key] = code
+      return code
+
+  cache_stats['misses'] += 1
+  script = TemplateToPython(template, statement_re, expr_re, output_indent)
+  code = compile(script, '<template>', 'exec')
+  _code_cache[key] = code
+  if _cache_dir:
+    _WriteDiskCache(key, code)
+  return code
+
+
+def FormatCacheStats():
+  return 'template cache: %d hits, %d disk hits, %d misses' % (
+      cache_stats['hits'], cache_stats['disk_hits'], cache_stats['misses'])
+
+
+def _Tell(f):
+  try:
+    return f.tell()
+  except (AttributeError, IOError):
+    # Not seekable, e.g. a pipe.
+    return None
+
+
+def RenderTemplate(outf, src, template_dict, statement_re=None, expr_re=None,
+                   output_indent=''):
+  """Render the template string |src| directly into the file-like |outf|.
+
+  Nothing is buffered here, so a generator can render all of its templates
+  into one shared sink (e.g. the output file) in bounded memory.
+  """
+  code = CompileTemplate(src, statement_re, expr_re, output_indent)
+  template_dict = copy.copy(template_dict)
+  template_dict['__write__'] = outf.write
+  start = _Tell(outf)
+  exec code in template_dict
+  render_stats['calls'] += 1
+  if start is not None:
+    render_stats['bytes'] += outf.tell() - start
+
+
 def RunTemplate(src, dst, template_dict, statement_re=None, expr_re=None,
                 output_indent=''):
-  statement_re = statement_re or re.compile(STATEMENT_RE)
-  expr_re = expr_re or re.compile(EXPR_RE)
-  script = TemplateToPython(src.read(), statement_re, expr_re, output_indent)
-  template_dict = copy.copy(template_dict)
-  template_dict['__outfile__'] = dst
-  exec script in template_dict
+  RenderTemplate(dst, src.read(), template_dict, statement_re, expr_re,
+                 output_indent)
 
 
 def RunTemplateFile(srcfile, dstfile, template_dict, statement_re=None,
@@ -69,9 +200,9 @@ def RunTemplateFile(srcfile, dstfile, template_dict, statement_re=None,
 
 def RunTemplateString(src, template_dict, statement_re=None, expr_re=None,
                       output_indent=''):
-  srcf = cStringIO.StringIO(src)
   dstf = cStringIO.StringIO()
-  RunTemplate(srcf, dstf, template_dict, statement_re, expr_re, output_indent)
+  RenderTemplate(dstf, src, template_dict, statement_re, expr_re,
+                 output_indent)
   return dstf.getvalue()
 
 
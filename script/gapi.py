@@ -1,76 +1,444 @@
 #!/usr/bin/env python
-import cStringIO
+import collections
+import hashlib
 import json
+import multiprocessing
 import optparse
 import os
 import sys
-import urllib2
+import traceback
 
 import cpp_header_generator
+import cpp_json_constructor_generator
+import cpp_json_decoder_generator
+import cpp_json_encoder_generator
+import cpp_json_lazy_generator
 import cpp_source_generator
+import discovery_fetcher
+import easy_template
+import gapi_utils
+import profiler
 import service
 
 
 DISCOVERY_API = 'https://www.googleapis.com/discovery/v1/apis'
 API_JSON = 'out/api.json'
 
+# Generated files are streamed to disk through a buffer of this size.
+OUTPUT_BUFFER_SIZE = 1 << 16
 
-def ReadCachedJson(url, filename):
-  if os.path.exists(filename):
-    return json.loads(open(filename).read())
-  with open(filename, 'w') as outf:
-    try:
-      inf = urllib2.urlopen(url)
-      data = inf.read()
-      outf.write(data)
-    finally:
-      inf.close()
-  return json.loads(data)
+# Modules whose source determines the generated output. If any of them
+# change, every API is regenerated.
+GENERATOR_MODULES = [
+  cpp_header_generator,
+  cpp_json_constructor_generator,
+  cpp_json_decoder_generator,
+  cpp_json_encoder_generator,
+  cpp_json_lazy_generator,
+  cpp_source_generator,
+  easy_template,
+  gapi_utils,
+  service,
+]
+
+GenerateResult = collections.namedtuple(
+    'GenerateResult',
+    ['basename', 'error', 'cache_stats', 'status', 'profile'])
+
+
+def FetchDiscoveryDocuments(fetcher, requests, offline):
+  """Refresh the cached copies of |requests|, a list of (url, filename).
+
+  Returns the filenames that could not be fetched and have no cached copy.
+  With |offline|, cached files are used as-is and only missing ones fetched.
+  """
+  if offline:
+    requests = [(url, filename) for url, filename in requests
+                if not os.path.exists(filename)]
+  missing = []
+  for result in fetcher.Fetch(requests):
+    if not result.error:
+      continue
+    if os.path.exists(result.filename):
+      sys.stderr.write('Warning: using cached %s: %s\n' % (
+          result.filename, result.error))
+    else:
+      sys.stderr.write('Error fetching %s: %s\n' % (
+          result.filename, result.error))
+      missing.append(result.filename)
+  return missing
 
 
 def main(args):
+  defaults = gapi_utils.DEFAULT_GENERATOR_OPTIONS
   parser = optparse.OptionParser()
   parser.add_option('-o', dest='outbasename')
   parser.add_option('-n', '--namespace')
   parser.add_option('-d', '--debug', action='store_true')
+  parser.add_option('-j', '--jobs', type='int', default=1,
+                    help='number of APIs to generate in parallel.')
+  parser.add_option('-f', '--force', action='store_true',
+                    help='regenerate even if the manifest is up to date.')
+  parser.add_option('--template-cache-dir',
+                    help='cache compiled templates in this directory.')
+  parser.add_option('--discovery-url', default=DISCOVERY_API,
+                    help='discovery directory to generate all APIs from.')
+  parser.add_option('--fetch-connections', type='int',
+                    default=discovery_fetcher.DEFAULT_MAX_CONNECTIONS,
+                    help='maximum concurrent connections when fetching.')
+  parser.add_option('--offline', action='store_true',
+                    help="don't revalidate cached discovery documents.")
+  parser.add_option('--shards', default='1',
+                    help='split the generated source into this many files, '
+                         'or "schema" for one file per top-level schema.')
+  parser.add_option('--map-key-dispatch',
+                    choices=gapi_utils.MAP_KEY_DISPATCH_TYPES,
+                    default=defaults.map_key_dispatch,
+                    help='how the decoder looks up property names: %s. '
+                         '"linear" is only useful for comparison.' %
+                         ', '.join(gapi_utils.MAP_KEY_DISPATCH_TYPES))
+  parser.add_option('--arena', action='store_true', default=defaults.arena,
+                    help='decode into structs allocated from an Arena, '
+                         'which frees a whole response at once.')
+  parser.add_option('--string-views', action='store_true',
+                    default=defaults.string_views,
+                    help='decode strings as views into the input, which the '
+                         'caller keeps alive in a PinnedBuffer.')
+  parser.add_option('--decoder', choices=gapi_utils.DECODER_TYPES,
+                    default=defaults.decoder,
+                    help='how Decode parses: %s. "direct" generates a '
+                         'parser per schema instead of using yajl '
+                         'callbacks.' % ', '.join(gapi_utils.DECODER_TYPES))
+  parser.add_option('--lazy', action='store_true', default=defaults.lazy,
+                    help='also generate Lazy classes, which decode the '
+                         'properties of a JsonIndex of the input as they '
+                         'are accessed.')
+  parser.add_option('--presence', action='store_true',
+                    default=defaults.presence,
+                    help='track which properties are set, with setters, '
+                         'and only encode those.')
+  parser.add_option('--list-outputs', action='store_true',
+                    help='print the files that would be generated for the '
+                         'input, and exit.')
+  parser.add_option('--profile', action='store_true',
+                    help='report time and memory per phase and per schema. '
+                         'Implies --force.')
+  parser.add_option('--profile-json', metavar='FILE',
+                    help='also write the --profile report to FILE as JSON.')
   options, args = parser.parse_args(args)
 
+  if options.jobs < 1:
+    parser.error('-j must be at least 1.')
+  if options.shards != cpp_source_generator.SHARD_PER_SCHEMA:
+    try:
+      options.shards = int(options.shards)
+    except ValueError:
+      options.shards = 0
+    if options.shards < 1:
+      parser.error('--shards must be a positive number or "%s".' %
+                   cpp_source_generator.SHARD_PER_SCHEMA)
+  if options.lazy and (options.arena or options.string_views):
+    parser.error('--lazy can\'t be used with --arena or --string-views.')
+
+  if options.profile_json:
+    options.profile = True
+  if options.profile:
+    # Skipped APIs have nothing to measure.
+    options.force = True
+
+  if options.template_cache_dir:
+    easy_template.SetCacheDir(options.template_cache_dir)
+
   inputs = []
+  failed = []
   if args:
     if len(args) > 1:
       print 'Ignoring additional args: %s' % ', '.join(args[1:])
     if not options.outbasename:
       parser.error('no output file given.')
-    with open(args[0]) as inf:
-      service_json = json.load(inf)
-    inputs.append((options.outbasename, service_json))
+    inputs.append((options.outbasename, args[0]))
+    if options.list_outputs:
+      # Used by build/build.nw to find out which files the gapi-gen rule
+      # produces.
+      for outfname in ListOutputs(options.outbasename, args[0],
+                                  options.shards):
+        print outfname
+      return 0
+  elif options.list_outputs:
+    parser.error('--list-outputs needs an input file.')
   else:
-    # Read and generate for all descovery APIs.
-    d = ReadCachedJson(DISCOVERY_API, API_JSON)
+    # Read and generate for all discovery APIs.
+    fetcher = discovery_fetcher.Fetcher(options.fetch_connections)
+    if FetchDiscoveryDocuments(fetcher, [(options.discovery_url, API_JSON)],
+                               options.offline):
+      return 1
+    with open(API_JSON) as inf:
+      d = json.load(inf)
+    requests = []
     for item in d['items']:
       basename = 'out/%s_%s' % (item['name'], item['version'])
-      service_json = ReadCachedJson(item['discoveryRestUrl'], json_name)
-      inputs.append((basename, service_json))
+      json_name = basename + '.json'
+      requests.append((item['discoveryRestUrl'], json_name))
+      inputs.append((basename, json_name))
+    missing = set(FetchDiscoveryDocuments(fetcher, requests, options.offline))
+    failed.extend(basename for basename, json_name in inputs
+                  if json_name in missing)
+    inputs = [(basename, json_name) for basename, json_name in inputs
+              if json_name not in missing]
+
+  # APIs that failed to fetch are already in |failed|.
+  num_apis = len(inputs) + len(failed)
+  generator_options = gapi_utils.GeneratorOptions(
+      map_key_dispatch=options.map_key_dispatch,
+      arena=options.arena,
+      string_views=options.string_views,
+      decoder=options.decoder,
+      lazy=options.lazy,
+      presence=options.presence)
+  jobs = [(basename, json_name, options.namespace, options.shards,
+           generator_options, options.force, options.profile)
+          for basename, json_name in inputs]
+  status_counts = collections.Counter()
+  # Count the fetch failures too, like the summary at the end.
+  status_counts['failed'] = len(failed)
+  profiles = []
 
-  for basename, service_json in inputs:
-    basename = options.outbasename
+  def HandleResult(result):
+    status_counts[result.status] += 1
+    if result.profile:
+      sys.stderr.write('Profile of %s:\n%s\n' % (
+          result.basename, profiler.FormatReport(result.profile)))
+      profile = dict(result.profile)
+      profile['api'] = result.basename
+      profiles.append(profile)
+    if result.error:
+      ReportError(result.basename, result.error)
+      failed.append(result.basename)
+
+  if options.jobs == 1 or len(jobs) == 1:
+    for job in jobs:
+      HandleResult(GenerateApi(job))
+  else:
+    pool = multiprocessing.Pool(options.jobs)
+    try:
+      # imap returns results in input order, so the report is the same from
+      # run to run, regardless of which worker finishes first.
+      for result in pool.imap(GenerateApi, jobs):
+        easy_template.cache_stats.update(result.cache_stats)
+        HandleResult(result)
+      pool.close()
+    except:
+      pool.terminate()
+      raise
+    finally:
+      pool.join()
+
+  if options.debug:
+    sys.stderr.write(easy_template.FormatCacheStats() + '\n')
+    sys.stderr.write('%d up to date, %d unchanged, %d written, %d failed\n' % (
+        status_counts['up-to-date'], status_counts['unchanged'],
+        status_counts['written'], status_counts['failed']))
+
+  if options.profile_json:
+    with open(options.profile_json, 'w') as f:
+      json.dump(profiles, f, indent=2, sort_keys=True,
+                separators=(',', ': '))
+      f.write('\n')
+
+  if failed:
+    sys.stderr.write('Failed to generate %d of %d APIs: %s\n' % (
+        len(failed), num_apis, ', '.join(failed)))
+    return 1
+  return 0
+
+
+def GenerateApi(job):
+  """Generate the header and sources for one API.
+
+  Runs in a worker process when -j is given, so it never raises. Returns a
+  GenerateResult whose status is 'up-to-date' (skipped, manifest matched),
+  'unchanged' (regenerated, same bytes), 'written' or 'failed'. With
+  |profile|, the result also carries a profiler report.
+  """
+  (basename, json_name, namespace, shards, generator_options, force,
+   profile) = job
+  stats_before = easy_template.cache_stats.copy()
+  prof = profiler.Enable() if profile else None
+  try:
+    with profiler.Phase('read'):
+      with open(json_name, 'rb') as inf:
+        data = inf.read()
     header_name = basename + '.h'
-    source_name = basename + '.cc'
-    s = service.Service(service_json)
-    Generate(cpp_header_generator, header_name, s,
-             header_name=header_name,
-             namespace=options.namespace)
-    Generate(cpp_source_generator, source_name, s,
-             header_name=header_name,
-             namespace=options.namespace)
+    manifest_name = basename + '.manifest'
+    manifest = {
+      'input': Sha1(data),
+      'generator': GeneratorHash(),
+      'namespace': namespace,
+      'shards': shards,
+      'options': generator_options._asdict(),
+    }
+    if not force and IsUpToDate(manifest_name, manifest):
+      return GenerateResult(basename, None, None, 'up-to-date', None)
+
+    with profiler.Phase('load json'):
+      data = json.loads(data)
+    s = service.Service(data, generator_options)
+    shard_schemas = cpp_source_generator.ShardSchemas(s, shards)
+    files = [(cpp_header_generator, header_name, {})]
+    for source_name, schemas in zip(SourceNames(basename, len(shard_schemas)),
+                                    shard_schemas):
+      files.append((cpp_source_generator, source_name, {'schemas': schemas}))
+    outputs = {}
+    changed = False
+    for generator, outfname, kwargs in files:
+      # Named after the file too, so the shards are separate phases.
+      with profiler.Phase('%s %s' % (generator.__name__,
+                                     os.path.basename(outfname))):
+        file_changed, digest = GenerateFile(generator, s, outfname,
+                                            header_name=header_name,
+                                            namespace=namespace,
+                                            options=generator_options,
+                                            **kwargs)
+      changed |= file_changed
+      outputs[outfname] = digest
+    RemoveStaleOutputs(manifest_name, outputs)
+    manifest['outputs'] = outputs
+    WriteIfChanged(manifest_name,
+                   json.dumps(manifest, indent=2, sort_keys=True,
+                              separators=(',', ': ')) + '\n')
+  except Exception:
+    return GenerateResult(basename, traceback.format_exc(), None, 'failed',
+                          None)
+  finally:
+    profiler.Disable()
+  return GenerateResult(basename, None,
+                        easy_template.cache_stats - stats_before,
+                        'written' if changed else 'unchanged',
+                        prof.Report() if prof else None)
+
+
+def SourceNames(basename, num_sources):
+  if num_sources == 1:
+    return [basename + '.cc']
+  return ['%s_%d.cc' % (basename, i) for i in xrange(num_sources)]
+
+
+def ListOutputs(basename, json_name, shards):
+  """The files GenerateApi writes for |json_name|, except the manifest."""
+  if shards == cpp_source_generator.SHARD_PER_SCHEMA:
+    with open(json_name) as f:
+      # Service has one top-level schema per key, see Service._Parse.
+      shards = len(json.load(f).get('schemas', {}))
+  return [basename + '.h'] + SourceNames(basename, shards)
+
+
+def RemoveStaleOutputs(manifest_name, outputs):
+  """Delete files of the previous generation that are not in |outputs|.
+
+  E.g. when the number of shards goes down.
+  """
+  try:
+    with open(manifest_name) as f:
+      old_outputs = json.load(f).get('outputs', {})
+  except (IOError, ValueError):
+    return
+  for outfname in old_outputs:
+    if outfname not in outputs and os.path.exists(outfname):
+      os.remove(outfname)
+
+
+def ReportError(basename, error):
+  sys.stderr.write('Error generating %s:\n%s\n' % (basename, error))
+
+
+def Sha1(data):
+  return hashlib.sha1(data).hexdigest()
+
+
+def Sha1File(filename):
+  """Return the sha1 of |filename|, or None if it can't be read."""
+  h = hashlib.sha1()
+  try:
+    with open(filename, 'rb') as f:
+      for block in iter(lambda: f.read(OUTPUT_BUFFER_SIZE), ''):
+        h.update(block)
+  except IOError:
+    return None
+  return h.hexdigest()
+
+
+_generator_hash = None
+
+def GeneratorHash():
+  global _generator_hash
+  if _generator_hash is None:
+    h = hashlib.sha1()
+    for module in GENERATOR_MODULES:
+      filename = os.path.splitext(module.__file__)[0] + '.py'
+      with open(filename, 'rb') as f:
+        h.update(os.path.basename(filename))
+        h.update(f.read())
+    _generator_hash = h.hexdigest()
+  return _generator_hash
+
+
+def IsUpToDate(manifest_name, manifest):
+  """True if |manifest_name| matches |manifest| and its outputs are intact."""
+  try:
+    with open(manifest_name) as f:
+      old_manifest = json.load(f)
+  except (IOError, ValueError):
+    return False
+  outputs = old_manifest.pop('outputs', None)
+  if old_manifest != manifest or not outputs:
+    return False
+  for outfname, digest in outputs.iteritems():
+    if Sha1File(outfname) != digest:
+      return False
+  return True
+
+
+def WriteIfChanged(outfname, contents):
+  """Write |contents| to |outfname| unless it already holds those bytes.
+
+  Leaving identical files alone keeps their timestamps, so ninja (with restat)
+  and ccache don't rebuild anything that depends on them.
+  """
+  try:
+    with open(outfname, 'rb') as f:
+      if f.read() == contents:
+        return False
+  except IOError:
+    pass
+  tmp_name = outfname + '.tmp'
+  with open(tmp_name, 'wb') as f:
+    f.write(contents)
+  os.rename(tmp_name, outfname)
+  return True
+
 
+def GenerateFile(generator, service, outfname, **kwargs):
+  """Stream the output of |generator| into |outfname|.
 
-def Generate(generator, outfname, service, **kwargs):
-  outf = cStringIO.StringIO()
-  generator.Generate(outf, service, **kwargs)
-  with open(outfname, 'w') as real_outf:
-    real_outf.write(outf.getvalue())
+  The output is never held in memory: the templates render straight into a
+  buffered temporary file. Like WriteIfChanged, an existing |outfname| with
+  the same contents is left alone. Returns (changed, sha1 of the contents).
+  """
+  tmp_name = outfname + '.tmp'
+  try:
+    with open(tmp_name, 'wb', OUTPUT_BUFFER_SIZE) as outf:
+      generator.Generate(outf, service, **kwargs)
+    digest = Sha1File(tmp_name)
+    if Sha1File(outfname) == digest:
+      os.remove(tmp_name)
+      return False, digest
+    os.rename(tmp_name, outfname)
+    return True, digest
+  except:
+    if os.path.exists(tmp_name):
+      os.remove(tmp_name)
+    raise
 
 
 if __name__ == '__main__':
-  main(sys.argv[1:])
+  sys.exit(main(sys.argv[1:]))
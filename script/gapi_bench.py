@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+"""Benchmark the code generator on synthetic discovery documents.
+
+The documents under src/test/data are tiny; the ones here are generated from
+a Shape, so the cost of each stage can be measured as the number of schemas,
+the nesting depth, the width of additionalProperties and the density of the
+$ref graph grow. Each benchmark times service.Service construction and each
+generator separately, and the results can be saved as JSON and compared
+against a previous run (e.g. from another commit):
+
+  script/gapi_bench.py -o before.json
+  (apply change)
+  script/gapi_bench.py --compare before.json
+"""
+
+import collections
+import cStringIO
+import json
+import optparse
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import cpp_header_generator
+import cpp_json_constructor_generator
+import cpp_json_decoder_generator
+import cpp_json_encoder_generator
+import service
+
+
+# schemas: number of top-level schemas.
+# properties: primitive properties of each object.
+# depth: levels of inline objects below each top-level schema.
+# objects: inline object properties of each object above |depth|.
+# array_depth: arrays of arrays of ... of each property's type; 0 for none.
+# addl_props: properties of the object that each top-level schema's
+#     additionalProperties map to; 0 for no additionalProperties.
+# refs: $ref properties of each object, to randomly chosen top-level schemas.
+Shape = collections.namedtuple(
+    'Shape', ['schemas', 'properties', 'depth', 'objects', 'array_depth',
+              'addl_props', 'refs'])
+
+BENCHMARKS = collections.OrderedDict([
+  ('small', Shape(schemas=20, properties=8, depth=1, objects=1,
+                  array_depth=0, addl_props=0, refs=1)),
+  ('many_schemas', Shape(schemas=2000, properties=8, depth=0, objects=0,
+                         array_depth=0, addl_props=0, refs=1)),
+  ('deep_objects', Shape(schemas=20, properties=4, depth=6, objects=2,
+                         array_depth=0, addl_props=0, refs=0)),
+  ('deep_arrays', Shape(schemas=200, properties=8, depth=2, objects=1,
+                        array_depth=4, addl_props=0, refs=0)),
+  ('wide_addl_props', Shape(schemas=200, properties=4, depth=0, objects=0,
+                            array_depth=0, addl_props=64, refs=0)),
+  ('dense_refs', Shape(schemas=500, properties=2, depth=1, objects=1,
+                       array_depth=0, addl_props=0, refs=32)),
+])
+
+# Only the types the encoder knows how to write.
+PRIMITIVE_TYPES = sorted(cpp_json_encoder_generator.TYPE_MACRO_DICT)
+
+STAGES = [
+  'service',
+  'cpp_header_generator',
+  'cpp_json_constructor_generator',
+  'cpp_json_decoder_generator',
+  'cpp_json_encoder_generator',
+]
+
+RESULTS_VERSION = 1
+
+
+def SynthesizeDocument(shape, seed=0):
+  """Return a discovery document (as parsed JSON) with the given |shape|."""
+  rand = random.Random(seed)
+  schema_names = ['Schema%04d' % i for i in xrange(shape.schemas)]
+
+  def Primitive():
+    typ, fmt = rand.choice(PRIMITIVE_TYPES)
+    data = {'type': typ}
+    if fmt:
+      data['format'] = fmt
+    return data
+
+  def Arrays(data):
+    for _ in xrange(shape.array_depth):
+      data = {'type': 'array', 'items': data}
+    return data
+
+  def Object(depth, num_properties):
+    properties = {}
+    for i in xrange(num_properties):
+      properties['prop%d' % i] = Arrays(Primitive())
+    if depth < shape.depth:
+      # Nested structs are named after their property; a struct can't have
+      # the same name as the struct containing it, so name them by depth.
+      for i in xrange(shape.objects):
+        properties['object%d_%d' % (depth, i)] = Arrays(
+            Object(depth + 1, shape.properties))
+    for i in xrange(shape.refs):
+      properties['ref%d' % i] = Arrays({'$ref': rand.choice(schema_names)})
+    return {'type': 'object', 'properties': properties}
+
+  schemas = {}
+  for name in schema_names:
+    schema = Object(0, shape.properties)
+    schema['id'] = name
+    if shape.addl_props:
+      schema['additionalProperties'] = Object(shape.depth, shape.addl_props)
+    schemas[name] = schema
+  return {'name': 'bench', 'version': 'v1', 'schemas': schemas}
+
+
+def _Generate(generator, s, **kwargs):
+  outf = cStringIO.StringIO()
+  generator.Generate(outf, s, **kwargs)
+  return outf.tell()
+
+
+def RunOnce(data):
+  """Time each stage once. Returns ({stage: seconds}, bytes generated)."""
+  times = {}
+  start = time.time()
+  s = service.Service(data)
+  times['service'] = time.time() - start
+
+  output_bytes = 0
+  for generator in (cpp_header_generator,
+                    cpp_json_constructor_generator,
+                    cpp_json_decoder_generator,
+                    cpp_json_encoder_generator):
+    kwargs = {}
+    if generator is cpp_header_generator:
+      kwargs = {'header_name': 'out/bench_v1.h', 'namespace': 'bench'}
+    start = time.time()
+    output_bytes += _Generate(generator, s, **kwargs)
+    times[generator.__name__] = time.time() - start
+  return times, output_bytes
+
+
+def RunBenchmark(shape, repeat, seed=0):
+  data = SynthesizeDocument(shape, seed)
+  runs = collections.defaultdict(list)
+  output_bytes = 0
+  for _ in xrange(repeat):
+    times, output_bytes = RunOnce(data)
+    for stage, seconds in times.iteritems():
+      runs[stage].append(seconds)
+  stages = {}
+  for stage in STAGES:
+    seconds = sorted(runs[stage])
+    stages[stage] = {
+      'min': seconds[0],
+      'median': seconds[len(seconds) // 2],
+    }
+  return {
+    'shape': shape._asdict(),
+    'output_bytes': output_bytes,
+    'stages': stages,
+    'total': sum(stage['min'] for stage in stages.itervalues()),
+  }
+
+
+def GitRevision():
+  try:
+    return subprocess.check_output(
+        ['git', 'rev-parse', '--short', 'HEAD'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stderr=open(os.devnull, 'w')).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def FormatResults(results, baseline=None):
+  lines = []
+  header = '%-18s %-32s %10s %10s' % ('benchmark', 'stage', 'min ms',
+                                      'median ms')
+  if baseline:
+    header += ' %10s %8s' % ('base ms', 'ratio')
+  lines.append(header)
+  for name, result in results['benchmarks'].iteritems():
+    base = baseline and baseline['benchmarks'].get(name)
+    if base and base['shape'] != result['shape']:
+      lines.append('%-18s (shape differs from baseline, not compared)' % name)
+      base = None
+    for stage in STAGES + ['total']:
+      if stage == 'total':
+        seconds = {'min': result['total'], 'median': None}
+        base_min = base and base['total']
+      else:
+        seconds = result['stages'][stage]
+        base_min = base and base['stages'][stage]['min']
+      median = ''
+      if seconds['median'] is not None:
+        median = '%.1f' % (seconds['median'] * 1000)
+      line = '%-18s %-32s %10.1f %10s' % (name, stage, seconds['min'] * 1000,
+                                          median)
+      if base_min:
+        line += ' %10.1f %7.2fx' % (base_min * 1000, seconds['min'] / base_min)
+      lines.append(line.rstrip())
+  return '\n'.join(lines)
+
+
+def main(args):
+  parser = optparse.OptionParser(usage='%prog [options] [benchmark ...]')
+  parser.add_option('-r', '--repeat', type='int', default=3,
+                    help='runs per benchmark; the minimum is reported.')
+  parser.add_option('-o', dest='outfname',
+                    help='write the results to this file as JSON.')
+  parser.add_option('--compare', metavar='FILE',
+                    help='compare against results written earlier with -o.')
+  parser.add_option('--seed', type='int', default=0,
+                    help='seed for the synthetic documents.')
+  parser.add_option('--dump-dir',
+                    help='also write each synthetic document to this '
+                         'directory, e.g. to run gapi.py on it.')
+  parser.add_option('-l', '--list', action='store_true',
+                    help='list the benchmarks and their shapes.')
+  options, args = parser.parse_args(args)
+
+  if options.list:
+    for name, shape in BENCHMARKS.iteritems():
+      print '%-18s %s' % (name, shape)
+    return 0
+
+  names = args or BENCHMARKS.keys()
+  for name in names:
+    if name not in BENCHMARKS:
+      parser.error('Unknown benchmark: %s' % name)
+  if options.repeat < 1:
+    parser.error('-r must be at least 1.')
+
+  baseline = None
+  if options.compare:
+    with open(options.compare) as f:
+      baseline = json.load(f)
+    if baseline.get('version') != RESULTS_VERSION:
+      parser.error('%s: unsupported results version.' % options.compare)
+
+  if options.dump_dir:
+    for name in names:
+      filename = os.path.join(options.dump_dir, 'bench_%s.json' % name)
+      with open(filename, 'w') as f:
+        json.dump(SynthesizeDocument(BENCHMARKS[name], options.seed), f,
+                  indent=2, sort_keys=True, separators=(',', ': '))
+        f.write('\n')
+
+  results = {
+    'version': RESULTS_VERSION,
+    'revision': GitRevision(),
+    'python': platform.python_version(),
+    'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    'repeat': options.repeat,
+    'seed': options.seed,
+    'benchmarks': collections.OrderedDict(),
+  }
+  for name in names:
+    sys.stderr.write('Running %s...\n' % name)
+    results['benchmarks'][name] = RunBenchmark(BENCHMARKS[name],
+                                               options.repeat, options.seed)
+
+  print FormatResults(results, baseline)
+
+  if options.outfname:
+    with open(options.outfname, 'w') as f:
+      json.dump(results, f, indent=2, separators=(',', ': '))
+      f.write('\n')
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
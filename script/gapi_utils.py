@@ -1,5 +1,82 @@
+import collections
 import re
 
+
+# Options that change the generated code. The generators take them as
+# |options|; gapi.py sets them from the command line.
+#   map_key_dispatch: how OnMapKey finds a property by name, 'switch' (on the
+#       key length, then on its bytes) or 'linear' (compare every name).
+#   arena: decode into structs allocated from an Arena (see src/arena.h).
+#       Strings and containers use ArenaAllocator and references are plain
+#       pointers, instead of std::string, std::allocator and shared_ptr.
+#   string_views: decode from a PinnedBuffer (see src/string_view.h), with
+#       StringView fields that point into it instead of std::string.
+#   decoder: how Decode parses, 'yajl' (callbacks from the yajl parser) or
+#       'direct' (a recursive-descent parser per schema, see
+#       src/json_scanner.h). Field masks and DecodeStream always use yajl.
+#   lazy: also generate a Lazy class per schema, which decodes properties
+#       from a JsonIndex (see src/json_index.h) as they are accessed.
+#   presence: give structs a bit per primitive property, set when it is
+#       decoded or set with its generated setter. Encode leaves out the
+#       properties whose bit is not set.
+GeneratorOptions = collections.namedtuple(
+    'GeneratorOptions',
+    ['map_key_dispatch', 'arena', 'string_views', 'decoder', 'lazy',
+     'presence'])
+
+DEFAULT_GENERATOR_OPTIONS = GeneratorOptions(
+    map_key_dispatch='switch',
+    arena=False,
+    string_views=False,
+    decoder='yajl',
+    lazy=False,
+    presence=False)
+
+MAP_KEY_DISPATCH_TYPES = ['switch', 'linear']
+
+DECODER_TYPES = ['yajl', 'direct']
+
+
+def DecodeParams(ctype, options, field_mask=False):
+  """The parameter list of the generated Decode function for |ctype|.
+
+  With |field_mask|, the overload that only decodes the selected fields.
+  """
+  params = ['PinnedBuffer* input' if options.string_views else 'Reader* src']
+  if options.arena:
+    params += ['Arena* arena', '%s** out_data' % ctype]
+  else:
+    params.append('%s* out_data' % ctype)
+  if field_mask:
+    params.append('const FieldMask& fields')
+  params.append('ErrorPtr* error')
+  return ', '.join(params)
+
+
+def DecodeStreamParams(ctype, options):
+  """The parameter list of the generated DecodeStream function for |ctype|."""
+  params = ['PinnedBuffer* input' if options.string_views else 'Reader* src']
+  if options.arena:
+    params.append('Arena* arena')
+  params += ['RecordCallback<%s>* callback' % ctype, 'ErrorPtr* error']
+  return ', '.join(params)
+
+
+def PresenceBit(prop):
+  """The word of _presence that has the bit of |prop|, and its mask."""
+  return prop.presence_bit // 32, '0x%xu' % (1 << prop.presence_bit % 32)
+
+
+def NumPresenceWords(schema):
+  """The size of the _presence array of |schema|, with --presence."""
+  return (len(schema.presence_properties) + 31) // 32
+
+
+def FieldMaskSchemaName(ctype):
+  "Foo::BarObject -> kFoo_BarObjectFields"
+  return 'k%sFields' % ctype.replace('::', '_')
+
+
 def MixedCaseToSnakeCase(s):
   "fooBar -> foo_bar"
   result = ''
@@ -53,6 +130,27 @@ def Upper(s):
   return MakeCIdentifier(s.upper())
 
 
+def CStringLiteral(s):
+  """A C string literal for the bytes of |s|, which may be unicode."""
+  if isinstance(s, unicode):
+    s = s.encode('utf-8')
+  result = ''
+  for c in s:
+    # '?' is escaped too, to avoid trigraphs.
+    if ' ' <= c <= '~' and c not in '"\\?':
+      result += c
+    else:
+      result += '\\%03o' % ord(c)
+  return '"%s"' % result
+
+
+def CCharLiteral(c):
+  """A C constant for the byte |c|, comparable to an unsigned char."""
+  if c.isalnum() or c in '_-.$@':
+    return "'%s'" % c
+  return str(ord(c))
+
+
 def WrapType(outer, inner):
   """Put |inner| inside |outer|, a format string, e.g. "std::vector<%s>"."""
   if inner and inner[-1] == '>':
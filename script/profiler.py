@@ -0,0 +1,159 @@
+"""Optional timing and memory accounting for gapi.py --profile.
+
+The generators call Phase() and Schema() unconditionally; until Enable() is
+called these return a shared no-op context manager, so they cost next to
+nothing in normal runs.
+"""
+
+import collections
+import resource
+import time
+
+import easy_template
+
+
+PhaseStats = collections.namedtuple(
+    'PhaseStats', ['name', 'depth', 'seconds', 'peak_rss_kb',
+                   'rss_growth_kb', 'template_calls', 'template_bytes'])
+# Phases are listed in the order they start; depth is the number of phases
+# enclosing this one (e.g. the decoder inside cpp_source_generator).
+
+
+def _PeakRssKb():
+  # ru_maxrss is in kilobytes on Linux.
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class _NullContext(object):
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    return False
+
+_NULL_CONTEXT = _NullContext()
+
+
+class _PhaseContext(object):
+  def __init__(self, profiler, name):
+    self.profiler = profiler
+    self.name = name
+
+  def __enter__(self):
+    self.start_rss = _PeakRssKb()
+    self.start_calls = easy_template.render_stats['calls']
+    self.start_bytes = easy_template.render_stats['bytes']
+    self.depth = len(self.profiler.phase_stack)
+    self.index = len(self.profiler.phases)
+    self.profiler.phases.append(None)
+    self.profiler.phase_stack.append(self.name)
+    self.start = time.time()
+    return self
+
+  def __exit__(self, *args):
+    seconds = time.time() - self.start
+    self.profiler.phase_stack.pop()
+    peak_rss = _PeakRssKb()
+    self.profiler.phases[self.index] = PhaseStats(
+        self.name, self.depth, seconds, peak_rss, peak_rss - self.start_rss,
+        easy_template.render_stats['calls'] - self.start_calls,
+        easy_template.render_stats['bytes'] - self.start_bytes)
+    return False
+
+
+class _SchemaContext(object):
+  def __init__(self, profiler, schema_name):
+    self.profiler = profiler
+    self.schema_name = schema_name
+
+  def __enter__(self):
+    self.start = time.time()
+    return self
+
+  def __exit__(self, *args):
+    seconds = time.time() - self.start
+    phase = self.profiler.phase_stack[-1] if self.profiler.phase_stack else ''
+    self.profiler.schemas[self.schema_name][phase] += seconds
+    return False
+
+
+class Profiler(object):
+  def __init__(self):
+    self.phases = []
+    self.phase_stack = []
+    # schema name -> phase name -> seconds
+    self.schemas = collections.defaultdict(collections.Counter)
+    self.start_calls = easy_template.render_stats['calls']
+    self.start_bytes = easy_template.render_stats['bytes']
+
+  def Phase(self, name):
+    return _PhaseContext(self, name)
+
+  def Schema(self, schema):
+    # Nested schemas are accounted to the top-level schema containing them.
+    return _SchemaContext(self, schema.context[0].name)
+
+  def Report(self):
+    """Return the collected data as a dict, suitable for json.dump."""
+    return {
+      'phases': [stats._asdict() for stats in self.phases],
+      'schemas': dict((name, dict(phases))
+                      for name, phases in self.schemas.iteritems()),
+      'templates': {
+        'calls': easy_template.render_stats['calls'] - self.start_calls,
+        'bytes': easy_template.render_stats['bytes'] - self.start_bytes,
+      },
+    }
+
+
+_current = None
+
+
+def Enable():
+  """Start collecting into a new Profiler, and return it."""
+  global _current
+  _current = Profiler()
+  return _current
+
+
+def Disable():
+  global _current
+  _current = None
+
+
+def Phase(name):
+  if _current:
+    return _current.Phase(name)
+  return _NULL_CONTEXT
+
+
+def Schema(schema):
+  if _current:
+    return _current.Schema(schema)
+  return _NULL_CONTEXT
+
+
+def FormatReport(report, max_schemas=20):
+  lines = []
+  lines.append('  %-48s %10s %12s %10s %8s %10s' % (
+      'phase', 'wall ms', 'peak RSS KB', '+RSS KB', 'tmpl', 'tmpl KB'))
+  for stats in report['phases']:
+    lines.append('  %-48s %10.1f %12d %10d %8d %10.1f' % (
+        '  ' * stats['depth'] + stats['name'], stats['seconds'] * 1000,
+        stats['peak_rss_kb'], stats['rss_growth_kb'], stats['template_calls'],
+        stats['template_bytes'] / 1024.0))
+  templates = report['templates']
+  lines.append('  templates: %d rendered, %d bytes emitted' % (
+      templates['calls'], templates['bytes']))
+
+  schema_totals = sorted(
+      ((sum(phases.itervalues()), name)
+       for name, phases in report['schemas'].iteritems()),
+      reverse=True)
+  if schema_totals:
+    lines.append('  top-level schemas by generation time:')
+    for seconds, name in schema_totals[:max_schemas]:
+      lines.append('    %-40s %10.1f ms' % (name, seconds * 1000))
+    if len(schema_totals) > max_schemas:
+      lines.append('    ... %d more' % (len(schema_totals) - max_schemas))
+  return '\n'.join(lines)
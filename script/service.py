@@ -1,6 +1,7 @@
 import collections
 
 import gapi_utils
+import profiler
 
 
 TYPE_DICT = {
@@ -19,16 +20,111 @@ TYPE_DICT = {
 }
 
 
+class CTypes(object):
+  """Spells the C types of the model, see Service._Finalize."""
+
+  def __init__(self, string_views=False):
+    self.string_views = string_views
+
+  def Primitive(self, type_format):
+    ctype = TYPE_DICT[type_format]
+    if self.string_views and ctype == 'std::string':
+      return 'StringView'
+    return ctype
+
+  def Array(self, element_ctype):
+    return gapi_utils.WrapType('std::vector<%s>', element_ctype)
+
+  def AdditionalProperties(self, value_ctype):
+    return gapi_utils.WrapType('std::map<std::string, %s>', value_ctype)
+
+  def Reference(self, referent_ctype):
+    return gapi_utils.WrapType('std::tr1::shared_ptr<%s>', referent_ctype)
+
+
+class ArenaCTypes(CTypes):
+  """Types that allocate from the current Arena, see src/arena.h.
+
+  References are plain pointers into the arena.
+  """
+
+  def Primitive(self, type_format):
+    ctype = super(ArenaCTypes, self).Primitive(type_format)
+    if ctype == 'std::string':
+      return 'ArenaString'
+    elif ctype.startswith('std::vector<'):
+      return self.Array(ctype[len('std::vector<'):-1])
+    return ctype
+
+  def Array(self, element_ctype):
+    return gapi_utils.WrapType(
+        'std::vector<%s>',
+        '%s, %s' % (element_ctype, self._Allocator(element_ctype)))
+
+  def AdditionalProperties(self, value_ctype):
+    value_type = gapi_utils.WrapType('std::pair<const ArenaString, %s>',
+                                     value_ctype)
+    return gapi_utils.WrapType(
+        'std::map<%s>',
+        'ArenaString, %s, std::less<ArenaString>, %s' % (
+            value_ctype, self._Allocator(value_type)))
+
+  def Reference(self, referent_ctype):
+    return referent_ctype + '*'
+
+  def _Allocator(self, ctype):
+    return gapi_utils.WrapType('ArenaAllocator<%s>', ctype)
+
+
+EVENT_TYPES = [
+  'BeginSchema',
+  'EndSchema',
+  'BeginProperty',
+  'EndProperty',
+  'PrimitivePropertyType',
+  'BeginArrayPropertyType',
+  'EndArrayPropertyType',
+  'BeginObjectPropertyType',
+  'EndObjectPropertyType',
+  'ReferencePropertyType',
+]
+
+
 class Service(object):
-  def __init__(self, data):
+  __slots__ = ['schemas', 'events', 'ctypes']
+
+  def __init__(self, data, options=gapi_utils.DEFAULT_GENERATOR_OPTIONS):
     self.schemas = {}
-    self._Parse(data)
-    self._FixReferences()
+    self.events = []
+    ctypes_class = ArenaCTypes if options.arena else CTypes
+    self.ctypes = ctypes_class(string_views=options.string_views)
+    with profiler.Phase('parse'):
+      self._Parse(data)
+    with profiler.Phase('flatten'):
+      self._Flatten()
+    with profiler.Phase('fix references'):
+      self._FixReferences()
+    with profiler.Phase('finalize'):
+      self._Finalize()
 
   def Generator(self):
+    return iter(self.events)
+
+  def WithReferents(self, schemas):
+    """|schemas| and the schemas they refer to directly, sorted by name."""
+    result = set(schemas)
+    for schema in schemas:
+      result |= schema.GetReferents()
+    return sorted(result, key=lambda schema: schema.name)
+
+  def _Flatten(self):
+    # Walk the model once, producing a flat list of (event type, node) for
+    # the whole service. Each top-level schema keeps its own slice, so the
+    # generators can iterate over one schema without walking the tree again.
     for _, schema in sorted(self.schemas.iteritems()):
-      for result in schema.Generator():
-        yield result
+      start = len(self.events)
+      schema._Flatten(self.events)
+      schema.events = self.events[start:]
 
   def _Parse(self, data):
     for schema_name, schema_data in \
@@ -37,35 +133,86 @@ class Service(object):
       self.schemas[schema_name] = Schema(None, schema_name, schema_data)
 
   def _FixReferences(self):
-    for typ, data in self.Generator():
+    for typ, data in self.events:
       if typ == 'ReferencePropertyType':
         # References always point to top-level schemas, so we can always find
         # them in the self.schemas dict.
         data.referent = self.schemas[data.referent_name]
 
+  def _Finalize(self):
+    # Compute the C types that depend on referents or on child types, once
+    # all references are known. Everything else is computed on construction.
+    for _, schema in sorted(self.schemas.iteritems()):
+      schema._Finalize(self.ctypes)
+
+
+# Each node of the model stores its context: the tuple of nodes from the
+# top-level schema down to (and including) the node itself. It is built once,
+# when the node is constructed, from its parent's context. Along with it, each
+# node stores:
+#   schema_depth: the number of Schemas in its context.
+#   loop_depth: the number of ArrayPropertyTypes and additionalProperties
+#       Properties in its context, i.e. how many loops deep its value is.
+# Schemas also list their presence_properties: the primitive properties,
+# which get a bit each with --presence, the presence_bit of the Property.
 
 class Schema(object):
+  __slots__ = ['name', 'parent_prop_type', 'parent_schema', 'properties',
+               'additional_properties', 'context', 'schema_depth',
+               'loop_depth', 'base_ctype', 'ctype', 'cbtype', 'events',
+               'presence_properties']
+
   def __init__(self, parent_prop_type, name, data):
     self.name = name
     self.parent_prop_type = parent_prop_type
     self.properties = {}
     self.additional_properties = None
+    # Only set for top-level schemas, see Service._Flatten.
+    self.events = None
+    if parent_prop_type:
+      self.parent_schema = parent_prop_type.prop.schema
+      self.context = parent_prop_type.context + (self,)
+      self.schema_depth = parent_prop_type.schema_depth + 1
+      self.loop_depth = parent_prop_type.loop_depth
+      self.base_ctype = gapi_utils.CapWords(name) + 'Object'
+      self.ctype = '%s::%s' % (self.parent_schema.ctype, self.base_ctype)
+    else:
+      self.parent_schema = None
+      self.context = (self,)
+      self.schema_depth = 1
+      self.loop_depth = 0
+      self.base_ctype = gapi_utils.CapWords(name)
+      self.ctype = self.base_ctype
+    self.cbtype = self.ctype + 'Callbacks'
     self._Parse(data)
+    self.presence_properties = [
+        prop for _, prop in sorted(self.properties.iteritems())
+        if isinstance(prop.prop_type, PrimitivePropertyType)]
+    for bit, prop in enumerate(self.presence_properties):
+      prop.presence_bit = bit
 
   def GetContext(self):
-    if self.parent_prop_type:
-      return self.parent_prop_type.GetContext() + [self]
-    return [self]
+    return self.context
 
   def Generator(self):
-    yield 'BeginSchema', self
+    if self.events is not None:
+      return iter(self.events)
+    events = []
+    self._Flatten(events)
+    return iter(events)
+
+  def GetReferents(self):
+    """The top-level schemas that this one refers to with $ref."""
+    return set(data.referent for typ, data in self.Generator()
+               if typ == 'ReferencePropertyType')
+
+  def _Flatten(self, events):
+    events.append(('BeginSchema', self))
     for _, prop in sorted(self.properties.iteritems()):
-      for result in prop.Generator():
-        yield result
+      prop._Flatten(events)
     if self.additional_properties:
-      for result in self.additional_properties.Generator():
-        yield result
-    yield 'EndSchema', self
+      self.additional_properties._Flatten(events)
+    events.append(('EndSchema', self))
 
   def _Parse(self, data):
     for prop_name, prop_data in \
@@ -76,79 +223,65 @@ class Schema(object):
       self.additional_properties = Property(self, None,
                                             data['additionalProperties'])
 
+  def _Finalize(self, ctypes):
+    for _, prop in sorted(self.properties.iteritems()):
+      prop._Finalize(ctypes)
+    if self.additional_properties:
+      self.additional_properties._Finalize(ctypes)
+
   def __str__(self):
     return '<Schema %s>' % self.name
 
-  @property
-  def parent_schema(self):
-    if self.parent_prop_type:
-      return self.parent_prop_type.prop.schema
-    return None
-
-  @property
-  def ctype(self):
-    if self.parent_schema:
-      return '%s::%s' % (self.parent_schema.ctype, self.base_ctype)
-    return self.base_ctype
-
-  @property
-  def base_ctype(self):
-    if self.parent_schema:
-      return gapi_utils.CapWords(self.name) + 'Object'
-    return gapi_utils.CapWords(self.name)
-
-  @property
-  def cbtype(self):
-    return self.ctype + 'Callbacks'
-
 
 class Property(object):
+  __slots__ = ['is_additional_properties', 'name', 'schema', 'description',
+               'prop_type', 'context', 'schema_depth', 'loop_depth',
+               'base_cident', 'ctype', 'ctypedef', 'base_ctypedef',
+               'presence_bit']
+
   def __init__(self, schema, name, data):
     self.is_additional_properties = name is None
     if name is None:
       self.name = '_additionalProperties'
+      self.base_cident = '_additional_properties'
+      self.base_ctypedef = 'AddlPropsType'
+      self.ctypedef = '%s::%s' % (schema.ctype, self.base_ctypedef)
     else:
       self.name = name
+      self.base_cident = gapi_utils.SnakeCase(name)
+      self.base_ctypedef = None
+      self.ctypedef = None
     self.schema = schema
+    self.context = schema.context + (self,)
+    self.schema_depth = schema.schema_depth
+    self.loop_depth = schema.loop_depth + self.is_additional_properties
     self.description = data.get('description', '').encode('ascii', 'replace')
+    self.ctype = None
+    self.presence_bit = None
     self.prop_type = MakePropertyType(self, None, data)
 
   def GetContext(self):
-    return self.schema.GetContext() + [self]
+    return self.context
 
   def Generator(self):
-    yield 'BeginProperty', self
-    for result in self.prop_type.Generator():
-      yield result
-    yield 'EndProperty', self
-
-  def __str__(self):
-    return '<Property %s>' % self.name
+    events = []
+    self._Flatten(events)
+    return iter(events)
 
-  @property
-  def base_cident(self):
-    if self.is_additional_properties:
-      return '_additional_properties'
-    else:
-      return gapi_utils.SnakeCase(self.name)
+  def _Flatten(self, events):
+    events.append(('BeginProperty', self))
+    self.prop_type._Flatten(events)
+    events.append(('EndProperty', self))
 
-  @property
-  def ctype(self):
+  def _Finalize(self, ctypes):
+    self.prop_type._Finalize(ctypes)
     if self.is_additional_properties:
-      return gapi_utils.WrapType('std::map<std::string, %s>',
-                                 self.prop_type.ctype)
+      self.ctype = ctypes.AdditionalProperties(self.prop_type.ctype)
     else:
-      return self.prop_type.ctype
+      self.ctype = self.prop_type.ctype
 
-  @property
-  def ctypedef(self):
-    assert self.is_additional_properties
-    return '%s::%s' % (self.schema.ctype, self.base_ctypedef)
-
-  @property
-  def base_ctypedef(self):
-    assert self.is_additional_properties
-    return 'AddlPropsType'
+  def __str__(self):
+    return '<Property %s>' % self.name
 
 
 def MakePropertyType(prop, parent_prop_type, data):
@@ -167,101 +300,118 @@ def MakePropertyType(prop, parent_prop_type, data):
 
 
 class PropertyType(object):
+  __slots__ = ['prop', 'parent_prop_type', 'parent', 'context',
+               'schema_depth', 'loop_depth', 'is_parent_array', 'ctype']
+
   def __init__(self, prop, parent_prop_type):
     self.prop = prop
     self.parent_prop_type = parent_prop_type
     if self.parent_prop_type:
       self.parent = self.parent_prop_type
+      self.is_parent_array = isinstance(parent_prop_type, ArrayPropertyType)
     else:
       self.parent = self.prop
+      self.is_parent_array = False
+    self.context = self.parent.context + (self,)
+    self.schema_depth = self.parent.schema_depth
+    self.loop_depth = self.parent.loop_depth
+    self.ctype = None
 
   def GetContext(self):
-    return self.parent.GetContext() + [self]
+    return self.context
+
+  def Generator(self):
+    events = []
+    self._Flatten(events)
+    return iter(events)
 
   def GetPrevContext(self):
-    return self.GetContext()[:-1]
+    return self.context[:-1]
 
-  @property
-  def is_parent_array(self):
-    if self.parent_prop_type:
-      return isinstance(self.parent_prop_type, ArrayPropertyType)
-    return False
+  def _Finalize(self, ctypes):
+    pass
 
 
 class PrimitivePropertyType(PropertyType):
+  __slots__ = ['type_format']
+
   def __init__(self, prop, parent_prop_type, type_format):
     super(PrimitivePropertyType, self).__init__(prop, parent_prop_type)
     self.type_format = type_format
 
-  def Generator(self):
-    yield 'PrimitivePropertyType', self
+  def _Flatten(self, events):
+    events.append(('PrimitivePropertyType', self))
+
+  def _Finalize(self, ctypes):
+    self.ctype = ctypes.Primitive(self.type_format)
 
   def __str__(self):
     return '<PrimitivePropertyType %s>' % (self.type_format,)
 
-  @property
-  def ctype(self):
-    return TYPE_DICT[self.type_format]
-
 
 class ArrayPropertyType(PropertyType):
+  __slots__ = ['element_type']
+
   def __init__(self, prop, parent_prop_type, items):
     super(ArrayPropertyType, self).__init__(prop, parent_prop_type)
+    self.loop_depth += 1
     self.element_type = MakePropertyType(prop, self, items)
 
-  def Generator(self):
-    yield 'BeginArrayPropertyType', self
-    for result in self.element_type.Generator():
-      yield result
-    yield 'EndArrayPropertyType', self
+  def _Flatten(self, events):
+    events.append(('BeginArrayPropertyType', self))
+    self.element_type._Flatten(events)
+    events.append(('EndArrayPropertyType', self))
+
+  def _Finalize(self, ctypes):
+    self.element_type._Finalize(ctypes)
+    self.ctype = ctypes.Array(self.element_type.ctype)
 
   def __str__(self):
     return '<ArrayPropertyType %s>' % self.element_type
 
-  @property
-  def ctype(self):
-    return gapi_utils.WrapType('std::vector<%s>', self.element_type.ctype)
-
 
 class ObjectPropertyType(PropertyType):
+  __slots__ = ['schema']
+
   def __init__(self, prop, parent_prop_type, data):
     super(ObjectPropertyType, self).__init__(prop, parent_prop_type)
     self.schema = Schema(self, self.prop.name, data)
+    self.ctype = self.schema.ctype
 
-  def Generator(self):
-    yield 'BeginObjectPropertyType', self
-    for result in self.schema.Generator():
-      yield result
-    yield 'EndObjectPropertyType', self
+  def _Flatten(self, events):
+    events.append(('BeginObjectPropertyType', self))
+    self.schema._Flatten(events)
+    events.append(('EndObjectPropertyType', self))
+
+  def _Finalize(self, ctypes):
+    self.schema._Finalize(ctypes)
 
   def __str__(self):
     return '<ObjectPropertyType %s>' % self.schema
 
-  @property
-  def ctype(self):
-    return self.schema.ctype
-
 
 class ReferencePropertyType(PropertyType):
+  __slots__ = ['referent_name', 'referent']
+
   def __init__(self, prop, parent_prop_type, referent_name):
     super(ReferencePropertyType, self).__init__(prop, parent_prop_type)
     self.referent_name = referent_name
     self.referent = None
 
-  def Generator(self):
-    yield 'ReferencePropertyType', self
+  def _Flatten(self, events):
+    events.append(('ReferencePropertyType', self))
+
+  def _Finalize(self, ctypes):
+    self.ctype = ctypes.Reference(self.referent.ctype)
 
   def __str__(self):
     return '<ReferencePropertyType %s>' % self.referent
 
-  @property
-  def ctype(self):
-    return gapi_utils.WrapType('std::tr1::shared_ptr<%s>', self.referent.ctype)
-
 
 def Iterate(obj, callbacks):
+  handlers = dict((typ, getattr(callbacks, typ)) for typ in EVENT_TYPES)
   for typ, data in obj.Generator():
-    getattr(callbacks, typ)(data)
+    handlers[typ](data)
 
 
 class ServiceCallbacks(object):
@@ -0,0 +1,52 @@
+#include "arena.h"
+
+#include <stdlib.h>
+
+namespace {
+
+// Enough for pointers, int64_t and double.
+const size_t kAlignment = 8;
+
+size_t Align(size_t size) {
+  return (size + kAlignment - 1) & ~(kAlignment - 1);
+}
+
+}  // namespace
+
+__thread Arena* Arena::current_ = NULL;
+
+Arena::Arena(size_t block_size)
+    : block_size_(block_size),
+      ptr_(NULL),
+      end_(NULL),
+      bytes_allocated_(0) {
+}
+
+Arena::~Arena() {
+  for (size_t i = 0; i < blocks_.size(); ++i)
+    free(blocks_[i]);
+}
+
+void* Arena::Allocate(size_t size) {
+  size = Align(size);
+  bytes_allocated_ += size;
+  if (size > static_cast<size_t>(end_ - ptr_)) {
+    // Large allocations get a block of their own, so they don't waste the
+    // rest of the current one.
+    if (size > block_size_ / 4)
+      return AllocateBlock(size);
+    ptr_ = static_cast<char*>(AllocateBlock(block_size_));
+    end_ = ptr_ + block_size_;
+  }
+  void* result = ptr_;
+  ptr_ += size;
+  return result;
+}
+
+void* Arena::AllocateBlock(size_t size) {
+  char* block = static_cast<char*>(malloc(size));
+  if (!block)
+    throw std::bad_alloc();
+  blocks_.push_back(block);
+  return block;
+}
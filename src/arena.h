@@ -0,0 +1,132 @@
+#ifndef ARENA_H_
+#define ARENA_H_
+
+#include <stddef.h>
+#include <new>
+#include <string>
+#include <vector>
+
+// A bump allocator for the objects decoded by code generated with --arena.
+// Nothing allocated from an Arena is freed or destroyed on its own; deleting
+// the Arena frees all of it at once, without running any destructors.
+class Arena {
+ public:
+  static const size_t kDefaultBlockSize = 8192;
+
+  explicit Arena(size_t block_size = kDefaultBlockSize);
+  ~Arena();
+
+  // Aligned for any of the types the generated code stores.
+  void* Allocate(size_t size);
+
+  template <typename T>
+  T* New() {
+    return new (Allocate(sizeof(T))) T();
+  }
+
+  // The arena of the innermost ScopedArena on this thread, or NULL.
+  static Arena* current() { return current_; }
+
+  size_t bytes_allocated() const { return bytes_allocated_; }
+
+ private:
+  friend class ScopedArena;
+
+  void* AllocateBlock(size_t size);
+
+  // C++98 has no thread_local.
+  static __thread Arena* current_;
+
+  size_t block_size_;
+  std::vector<char*> blocks_;
+  char* ptr_;
+  char* end_;
+  size_t bytes_allocated_;
+
+  Arena(const Arena&);
+  Arena& operator =(const Arena&);
+};
+
+// Makes |arena| current for the lifetime of the ScopedArena, so that every
+// ArenaAllocator constructed meanwhile allocates from it.
+class ScopedArena {
+ public:
+  explicit ScopedArena(Arena* arena) : prev_(Arena::current_) {
+    Arena::current_ = arena;
+  }
+  ~ScopedArena() {
+    Arena::current_ = prev_;
+  }
+
+ private:
+  Arena* prev_;
+
+  ScopedArena(const ScopedArena&);
+  ScopedArena& operator =(const ScopedArena&);
+};
+
+// A standard allocator that allocates from the arena that was current when
+// it was constructed, or from the heap if there was none. Copies, including
+// rebound copies in the nodes of a std::map, share the arena.
+template <typename T>
+class ArenaAllocator {
+ public:
+  typedef size_t size_type;
+  typedef ptrdiff_t difference_type;
+  typedef T* pointer;
+  typedef const T* const_pointer;
+  typedef T& reference;
+  typedef const T& const_reference;
+  typedef T value_type;
+
+  template <typename U>
+  struct rebind {
+    typedef ArenaAllocator<U> other;
+  };
+
+  ArenaAllocator() : arena_(Arena::current()) {}
+  explicit ArenaAllocator(Arena* arena) : arena_(arena) {}
+  template <typename U>
+  ArenaAllocator(const ArenaAllocator<U>& other) : arena_(other.arena()) {}
+
+  Arena* arena() const { return arena_; }
+
+  pointer address(reference x) const { return &x; }
+  const_pointer address(const_reference x) const { return &x; }
+
+  pointer allocate(size_type n, const void* hint = 0) {
+    size_t size = n * sizeof(T);
+    if (arena_)
+      return static_cast<pointer>(arena_->Allocate(size));
+    return static_cast<pointer>(::operator new(size));
+  }
+
+  void deallocate(pointer p, size_type n) {
+    // Arena memory is only freed with the arena.
+    if (!arena_)
+      ::operator delete(p);
+  }
+
+  size_type max_size() const { return static_cast<size_type>(-1) / sizeof(T); }
+
+  void construct(pointer p, const T& value) { new (p) T(value); }
+  void destroy(pointer p) { p->~T(); }
+
+ private:
+  Arena* arena_;
+};
+
+template <typename T, typename U>
+bool operator ==(const ArenaAllocator<T>& a, const ArenaAllocator<U>& b) {
+  return a.arena() == b.arena();
+}
+
+template <typename T, typename U>
+bool operator !=(const ArenaAllocator<T>& a, const ArenaAllocator<U>& b) {
+  return a.arena() != b.arena();
+}
+
+typedef std::basic_string<char, std::char_traits<char>, ArenaAllocator<char> >
+    ArenaString;
+
+#endif  // ARENA_H_
@@ -0,0 +1,116 @@
+#include "base64.h"
+
+namespace {
+
+const char kBase64Chars[] =
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/";
+const char kBase64UrlChars[] =
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_";
+
+// The 6-bit value of each char of either alphabet, or -1.
+const int8_t kDecode[256] = {
+  -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1,
+  -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1,
+  -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, 62, -1, 62, -1, 63,
+  52, 53, 54, 55, 56, 57, 58, 59, 60, 61, -1, -1, -1, -1, -1, -1,
+  -1,  0,  1,  2,  3,  4,  5,  6,  7,  8,  9, 10, 11, 12, 13, 14,
+  15, 16, 17, 18, 19, 20, 21, 22, 23, 24, 25, -1, -1, -1, -1, 63,
+  -1, 26, 27, 28, 29, 30, 31, 32, 33, 34, 35, 36, 37, 38, 39, 40,
+  41, 42, 43, 44, 45, 46, 47, 48, 49, 50, 51, -1, -1, -1, -1, -1,
+  -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1,
+  -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1,
+  -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1,
+  -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1,
+  -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1,
+  -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1,
+  -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1,
+  -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1,
+};
+
+// The values of the chars s[0..3], or -1 if any of them is not base64.
+inline int32_t DecodeQuad(const unsigned char* s) {
+  int32_t a = kDecode[s[0]];
+  int32_t b = kDecode[s[1]];
+  int32_t c = kDecode[s[2]];
+  int32_t d = kDecode[s[3]];
+  if ((a | b | c | d) < 0)
+    return -1;
+  return a << 18 | b << 12 | c << 6 | d;
+}
+
+}  // namespace
+
+void Base64Encode(const uint8_t* data, size_t size, Base64Alphabet alphabet,
+                  char* out) {
+  const char* chars = alphabet == BASE64_URL ? kBase64UrlChars : kBase64Chars;
+  // 3 bytes at a time, as a 24-bit word.
+  const uint8_t* end = data + size / 3 * 3;
+  for (; data != end; data += 3, out += 4) {
+    uint32_t word = data[0] << 16 | data[1] << 8 | data[2];
+    out[0] = chars[word >> 18];
+    out[1] = chars[(word >> 12) & 0x3f];
+    out[2] = chars[(word >> 6) & 0x3f];
+    out[3] = chars[word & 0x3f];
+  }
+  switch (size % 3) {
+    case 1: {
+      uint32_t word = data[0] << 16;
+      out[0] = chars[word >> 18];
+      out[1] = chars[(word >> 12) & 0x3f];
+      out[2] = '=';
+      out[3] = '=';
+      break;
+    }
+    case 2: {
+      uint32_t word = data[0] << 16 | data[1] << 8;
+      out[0] = chars[word >> 18];
+      out[1] = chars[(word >> 12) & 0x3f];
+      out[2] = chars[(word >> 6) & 0x3f];
+      out[3] = '=';
+      break;
+    }
+  }
+}
+
+bool Base64Decode(const char* s, size_t length, uint8_t* out, size_t* size) {
+  const unsigned char* p = reinterpret_cast<const unsigned char*>(s);
+  if (length % 4 == 0 && length > 0 && p[length - 1] == '=') {
+    --length;
+    if (p[length - 1] == '=')
+      --length;
+  }
+  uint8_t* start = out;
+  // 4 chars at a time, into a 24-bit word.
+  const unsigned char* end = p + length / 4 * 4;
+  for (; p != end; p += 4, out += 3) {
+    int32_t word = DecodeQuad(p);
+    if (word < 0)
+      return false;
+    out[0] = word >> 16;
+    out[1] = word >> 8;
+    out[2] = word;
+  }
+  switch (length % 4) {
+    case 1:
+      return false;
+    case 2: {
+      unsigned char quad[4] = { p[0], p[1], 'A', 'A' };
+      int32_t word = DecodeQuad(quad);
+      if (word < 0)
+        return false;
+      *out++ = word >> 16;
+      break;
+    }
+    case 3: {
+      unsigned char quad[4] = { p[0], p[1], p[2], 'A' };
+      int32_t word = DecodeQuad(quad);
+      if (word < 0)
+        return false;
+      *out++ = word >> 16;
+      *out++ = word >> 8;
+      break;
+    }
+  }
+  *size = out - start;
+  return true;
+}
@@ -0,0 +1,49 @@
+#ifndef BASE64_H_
+#define BASE64_H_
+
+#include <stddef.h>
+#include <stdint.h>
+
+// The codec of the ('string', 'byte') fields of discovery documents, which
+// are std::vector<uint8_t> in the generated code and base64 in JSON.
+
+enum Base64Alphabet {
+  BASE64,      // RFC 4648 section 4: '+' and '/'.
+  BASE64_URL,  // RFC 4648 section 5: '-' and '_'.
+};
+
+// The length of the base64 of |size| bytes, with '=' padding.
+inline size_t Base64EncodedSize(size_t size) {
+  return (size + 2) / 3 * 4;
+}
+
+// Writes the Base64EncodedSize(size) chars of the base64 of (data, size) to
+// |out|.
+void Base64Encode(const uint8_t* data, size_t size, Base64Alphabet alphabet,
+                  char* out);
+
+// At least as many bytes as the base64 (s, length) decodes to.
+inline size_t Base64MaxDecodedSize(size_t length) {
+  return length / 4 * 3 + 2;
+}
+
+// Decodes (s, length), in either alphabet, with or without padding, into
+// |out|, which has room for Base64MaxDecodedSize(length) bytes. Sets |size|
+// to the number of bytes decoded. Returns false if (s, length) is not base64.
+bool Base64Decode(const char* s, size_t length, uint8_t* out, size_t* size);
+
+// Decodes (s, length) straight into |out|, a std::vector<uint8_t> or another
+// container of bytes with resize, e.g. the vectors of --arena.
+template <typename Vector>
+bool Base64DecodeTo(const char* s, size_t length, Vector* out) {
+  out->resize(Base64MaxDecodedSize(length));
+  size_t size;
+  if (!Base64Decode(s, length, &(*out)[0], &size)) {
+    out->clear();
+    return false;
+  }
+  out->resize(size);
+  return true;
+}
+
+#endif  // BASE64_H_
@@ -0,0 +1,683 @@
+// Micro-benchmarks for the generated code.
+//
+// Usage: gapi_bench [benchmark name...]
+// With no names, every benchmark is run.
+
+#define __STDC_FORMAT_MACROS  // For PRI* macros
+#include <inttypes.h>
+#include <stdio.h>
+#include <string.h>
+#include <sys/time.h>
+#include <string>
+#include <vector>
+#include "arena.h"
+#include "base64.h"
+#include "field_mask.h"
+#include "io.h"
+#include "json_generator.h"
+#include "json_index.h"
+#include "json_number.h"
+#include "json_parser.h"
+#include "string_view.h"
+#include "out/gen/src/bench/data/urlshortener_direct.h"
+#include "out/gen/src/bench/data/urlshortener_lazy.h"
+#include "out/gen/src/bench/data/urlshortener_yajl.h"
+#include "out/gen/src/bench/data/wide_schema.h"
+#include "out/gen/src/bench/data/wide_schema_arena.h"
+#include "out/gen/src/bench/data/wide_schema_linear.h"
+#include "out/gen/src/bench/data/wide_schema_presence.h"
+#include "out/gen/src/bench/data/wide_schema_views.h"
+
+namespace {
+
+double Now() {
+  struct timeval tv;
+  gettimeofday(&tv, NULL);
+  return tv.tv_sec + tv.tv_usec * 1e-6;
+}
+
+// Decode |json| into a new T |iterations| times. Returns the seconds taken,
+// or -1 on a decode error.
+template <typename T>
+double TimeDecode(void (*decode)(Reader*, T*, ErrorPtr*),
+                  const std::string& json, int iterations) {
+  double start = Now();
+  for (int i = 0; i < iterations; ++i) {
+    T data;
+    MemoryReader reader(json.data(), json.size());
+    ErrorPtr error;
+    decode(&reader, &data, &error);
+    if (error) {
+      fprintf(stderr, "Decode error: %s\n", error->ToString().c_str());
+      return -1;
+    }
+  }
+  return Now() - start;
+}
+
+// Encode |data| |iterations| times. Returns the seconds taken, or -1 on an
+// encode error.
+template <typename T>
+double TimeEncode(
+    void (*encode)(Writer*, T*, const JsonGeneratorOptions&, ErrorPtr*),
+    T* data, const JsonGeneratorOptions& options, int iterations) {
+  double start = Now();
+  for (int i = 0; i < iterations; ++i) {
+    MemoryWriter writer;
+    ErrorPtr error;
+    encode(&writer, data, options, &error);
+    if (error) {
+      fprintf(stderr, "Encode error: %s\n", error->ToString().c_str());
+      return -1;
+    }
+  }
+  return Now() - start;
+}
+
+// Like TimeDecode, only decoding the fields that |mask| selects.
+template <typename T>
+double TimeMaskedDecode(
+    void (*decode)(Reader*, T*, const FieldMask&, ErrorPtr*),
+    const FieldMask& mask, const std::string& json, int iterations) {
+  double start = Now();
+  for (int i = 0; i < iterations; ++i) {
+    T data;
+    MemoryReader reader(json.data(), json.size());
+    ErrorPtr error;
+    decode(&reader, &data, mask, &error);
+    if (error) {
+      fprintf(stderr, "Decode error: %s\n", error->ToString().c_str());
+      return -1;
+    }
+  }
+  return Now() - start;
+}
+
+// Like TimeDecode, for code generated with --arena. Each decode gets a fresh
+// arena, which is deleted in one go.
+template <typename T>
+double TimeArenaDecode(void (*decode)(Reader*, Arena*, T**, ErrorPtr*),
+                       const std::string& json, int iterations) {
+  double start = Now();
+  for (int i = 0; i < iterations; ++i) {
+    Arena arena;
+    T* data;
+    MemoryReader reader(json.data(), json.size());
+    ErrorPtr error;
+    decode(&reader, &arena, &data, &error);
+    if (error) {
+      fprintf(stderr, "Decode error: %s\n", error->ToString().c_str());
+      return -1;
+    }
+  }
+  return Now() - start;
+}
+
+// Like TimeDecode, for code generated with --string-views.
+template <typename T>
+double TimeViewDecode(void (*decode)(PinnedBuffer*, T*, ErrorPtr*),
+                      const std::string& json, int iterations) {
+  double start = Now();
+  for (int i = 0; i < iterations; ++i) {
+    T data;
+    PinnedBuffer input(json.data(), json.size());
+    ErrorPtr error;
+    decode(&input, &data, &error);
+    if (error) {
+      fprintf(stderr, "Decode error: %s\n", error->ToString().c_str());
+      return -1;
+    }
+  }
+  return Now() - start;
+}
+
+// All 64 properties of Wide, in an order unrelated to the schema's.
+const char* kWideKeys[] = {
+  "accountKind", "userState", "itemSize", "accountUrl", "itemState", "userSize",
+  "userOwner", "orderId", "accountType", "userLabel", "accountStatus",
+  "resourceType", "orderState", "itemType", "userTime", "itemName", "orderName",
+  "itemUrl", "itemCount", "orderLabel", "accountOwner", "accountId",
+  "itemOwner", "orderEtag", "accountLabel", "orderUrl", "resourceTime",
+  "resourceKind", "resourceUrl", "orderTime", "itemEtag", "orderOwner",
+  "orderSize", "accountSize", "itemLabel", "resourceEtag", "userType",
+  "resourceLabel", "itemKind", "userUrl", "userStatus", "userCount", "itemTime",
+  "resourceSize", "userKind", "resourceId", "userName", "accountTime",
+  "orderStatus", "userEtag", "accountCount", "resourceCount", "itemStatus",
+  "resourceOwner", "accountEtag", "accountName", "resourceName", "orderType",
+  "orderCount", "orderKind", "itemId", "resourceStatus", "userId",
+  "accountState",
+};
+
+bool IsIntKey(const char* key) {
+  size_t length = strlen(key);
+  const char* suffixes[] = { "Count", "Size", "Time" };
+  for (size_t i = 0; i < sizeof(suffixes)/sizeof(suffixes[0]); ++i) {
+    size_t suffix_length = strlen(suffixes[i]);
+    if (length >= suffix_length &&
+        strcmp(key + length - suffix_length, suffixes[i]) == 0)
+      return true;
+  }
+  return false;
+}
+
+const size_t kNumKeys = sizeof(kWideKeys)/sizeof(kWideKeys[0]);
+
+// A Wide object with every property set. The strings are |string_value|.
+std::string WideJson(const char* string_value = "x") {
+  std::string json = "{";
+  for (size_t i = 0; i < kNumKeys; ++i) {
+    if (i) json += ", ";
+    json += "\"";
+    json += kWideKeys[i];
+    if (IsIntKey(kWideKeys[i])) {
+      json += "\": 1";
+    } else {
+      json += "\": \"";
+      json += string_value;
+      json += "\"";
+    }
+  }
+  json += "}";
+  return json;
+}
+
+// A WideList of |num_items| copies of |item|.
+std::string WideListJson(const std::string& item, int num_items) {
+  std::string json = "{\"items\": [";
+  for (int i = 0; i < num_items; ++i) {
+    if (i) json += ", ";
+    json += item;
+  }
+  json += "]}";
+  return json;
+}
+
+// Decodes a 64-property object with the length/byte switch dispatch that
+// the generator emits by default, and with --map-key-dispatch linear.
+void BenchMapKeyDispatch(int iterations) {
+  std::string json = WideJson();
+  double linear = TimeDecode<wide_schema_linear::Wide>(
+      &wide_schema_linear::Decode, json, iterations);
+  double dispatch = TimeDecode<wide_schema::Wide>(&wide_schema::Decode, json,
+                                                  iterations);
+  if (linear < 0 || dispatch < 0)
+    return;
+  double keys = static_cast<double>(kNumKeys) * iterations;
+  printf("  linear: %8.1f ns/key\n", linear * 1e9 / keys);
+  printf("  switch: %8.1f ns/key (%.2fx)\n", dispatch * 1e9 / keys,
+         linear / dispatch);
+}
+
+// Decodes a list of 1000 Wide objects into heap allocated structs (one
+// shared_ptr per item, one allocation per string), and with --arena.
+void BenchArenaDecode(int iterations) {
+  const int kNumItems = 1000;
+  std::string json = WideListJson(WideJson(), kNumItems);
+  double heap = TimeDecode<wide_schema::WideList>(&wide_schema::Decode, json,
+                                                 iterations);
+  double arena = TimeArenaDecode<wide_schema_arena::WideList>(
+      &wide_schema_arena::Decode, json, iterations);
+  if (heap < 0 || arena < 0)
+    return;
+  double items = static_cast<double>(kNumItems) * iterations;
+  printf("   heap: %8.1f ns/item\n", heap * 1e9 / items);
+  printf("  arena: %8.1f ns/item (%.2fx)\n", arena * 1e9 / items,
+         heap / arena);
+}
+
+// Decodes a list of 1000 Wide objects, with URL-sized strings, into
+// std::string fields, and with --string-views into views of the input.
+void BenchStringViews(int iterations) {
+  const int kNumItems = 1000;
+  size_t num_strings = 0;
+  for (size_t i = 0; i < kNumKeys; ++i)
+    num_strings += !IsIntKey(kWideKeys[i]);
+  std::string json = WideListJson(
+      WideJson("https://www.example.com/resources/0123456789"), kNumItems);
+  double copy = TimeDecode<wide_schema::WideList>(&wide_schema::Decode, json,
+                                                 iterations);
+  double view = TimeViewDecode<wide_schema_views::WideList>(
+      &wide_schema_views::Decode, json, iterations);
+  if (copy < 0 || view < 0)
+    return;
+  double strings = static_cast<double>(num_strings) * kNumItems * iterations;
+  printf("   copy: %8.1f ns/string\n", copy * 1e9 / strings);
+  printf("   view: %8.1f ns/string (%.2fx)\n", view * 1e9 / strings,
+         copy / view);
+}
+
+// Decodes a list of 1000 Wide objects in full, and with a field mask that
+// selects 2 of the 64 properties of each item.
+void BenchFieldMask(int iterations) {
+  const int kNumItems = 1000;
+  std::string json = WideListJson(WideJson(), kNumItems);
+  FieldMask mask;
+  ErrorPtr error;
+  if (!mask.Parse("items(userId,itemCount)", wide_schema::kWideListFields,
+                  &error)) {
+    fprintf(stderr, "%s\n", error->ToString().c_str());
+    return;
+  }
+  double full = TimeDecode<wide_schema::WideList>(&wide_schema::Decode, json,
+                                                 iterations);
+  double masked = TimeMaskedDecode<wide_schema::WideList>(
+      &wide_schema::Decode, mask, json, iterations);
+  if (full < 0 || masked < 0)
+    return;
+  double items = static_cast<double>(kNumItems) * iterations;
+  printf("    full: %8.1f ns/item\n", full * 1e9 / items);
+  printf("  masked: %8.1f ns/item (%.2fx)\n", masked * 1e9 / items,
+         full / masked);
+}
+
+// Counts the records of a DecodeStream.
+class CountRecords : public RecordCallback<wide_schema::Wide> {
+ public:
+  CountRecords() : count(0), failed(false) {}
+  virtual bool OnRecord(size_t index, wide_schema::Wide* data,
+                        const ErrorPtr& error) {
+    ++count;
+    if (error) {
+      fprintf(stderr, "Decode error: %s\n", error->ToString().c_str());
+      failed = true;
+      return false;
+    }
+    return true;
+  }
+  size_t count;
+  bool failed;
+};
+
+// Decodes 10000 small newline-delimited records, one Decode per record, and
+// all of them with one DecodeStream.
+void BenchDecodeStream(int iterations) {
+  const int kNumRecords = 10000;
+  const std::string record = "{\"userId\": \"x\", \"userCount\": 1}";
+  std::string json;
+  for (int i = 0; i < kNumRecords; ++i)
+    json += record + "\n";
+
+  double start = Now();
+  for (int i = 0; i < iterations; ++i) {
+    for (int j = 0; j < kNumRecords; ++j) {
+      wide_schema::Wide data;
+      MemoryReader reader(json.data() + j * (record.size() + 1),
+                          record.size());
+      ErrorPtr error;
+      wide_schema::Decode(&reader, &data, &error);
+      if (error) {
+        fprintf(stderr, "Decode error: %s\n", error->ToString().c_str());
+        return;
+      }
+    }
+  }
+  double each = Now() - start;
+
+  start = Now();
+  for (int i = 0; i < iterations; ++i) {
+    CountRecords callback;
+    MemoryReader reader(json.data(), json.size());
+    ErrorPtr error;
+    wide_schema::DecodeStream(&reader, &callback, &error);
+    if (error || callback.failed || callback.count != kNumRecords) {
+      fprintf(stderr, "DecodeStream failed\n");
+      return;
+    }
+  }
+  double stream = Now() - start;
+
+  double records = static_cast<double>(kNumRecords) * iterations;
+  printf("  decode: %8.1f ns/record\n", each * 1e9 / records);
+  printf("  stream: %8.1f ns/record (%.2fx)\n", stream * 1e9 / records,
+         each / stream);
+}
+
+// An AnalyticsSnapshot with |num_entries| entries in each of its lists.
+std::string SnapshotJson(int num_entries) {
+  const char* lists[] = { "browsers", "countries", "platforms", "referrers" };
+  std::string json = "{\"shortUrlClicks\": \"1234\", \"longUrlClicks\": "
+                     "\"567890\"";
+  for (size_t i = 0; i < sizeof(lists)/sizeof(lists[0]); ++i) {
+    json += std::string(", \"") + lists[i] + "\": [";
+    for (int j = 0; j < num_entries; ++j) {
+      char entry[64];
+      snprintf(entry, sizeof(entry), "%s{\"count\": \"%d\", \"id\": \"%s%d\"}",
+               j ? ", " : "", 1000 - j, lists[i], j);
+      json += entry;
+    }
+    json += "]";
+  }
+  json += "}";
+  return json;
+}
+
+// A UrlHistory of |num_items| Urls with full analytics, like the responses
+// of url.list with projection=FULL.
+std::string UrlHistoryJson(int num_items) {
+  std::string snapshot = SnapshotJson(10);
+  std::string json = "{\"kind\": \"urlshortener#urlHistory\", "
+                     "\"totalItems\": 1, \"items\": [";
+  for (int i = 0; i < num_items; ++i) {
+    char url[256];
+    snprintf(url, sizeof(url),
+             "%s{\"kind\": \"urlshortener#url\", \"id\": \"http://goo.gl/%d\", "
+             "\"longUrl\": \"http://www.example.com/pages/%d\", "
+             "\"status\": \"OK\", \"created\": "
+             "\"2010-10-14T19:01:24.944+00:00\", \"analytics\": {",
+             i ? ", " : "", i, i);
+    json += url;
+    json += "\"allTime\": " + snapshot + ", \"month\": " + snapshot +
+            ", \"week\": " + snapshot + ", \"day\": " + snapshot +
+            ", \"twoHours\": " + snapshot + "}}";
+  }
+  json += "]}";
+  return json;
+}
+
+// Decodes a few megabytes of UrlHistory with the yajl callbacks, and with
+// the recursive-descent parser of --decoder direct.
+void BenchDirectDecoder(int iterations) {
+  const int kNumItems = 2000;
+  std::string json = UrlHistoryJson(kNumItems);
+  double yajl = TimeDecode<urlshortener_yajl::UrlHistory>(
+      &urlshortener_yajl::Decode, json, iterations);
+  double direct = TimeDecode<urlshortener_direct::UrlHistory>(
+      &urlshortener_direct::Decode, json, iterations);
+  if (yajl < 0 || direct < 0)
+    return;
+  double megabytes = json.size() * 1e-6 * iterations;
+  printf("  %.1f MB\n", json.size() * 1e-6);
+  printf("    yajl: %8.1f MB/s\n", megabytes / yajl);
+  printf("  direct: %8.1f MB/s (%.2fx)\n", megabytes / direct,
+         yajl / direct);
+}
+
+// Reads the longUrl of one item of a few megabytes of UrlHistory: by decoding
+// all of it, and by indexing it and decoding the one value with --lazy.
+void BenchLazyDecode(int iterations) {
+  const int kNumItems = 2000;
+  std::string json = UrlHistoryJson(kNumItems);
+  double full = TimeDecode<urlshortener_lazy::UrlHistory>(
+      &urlshortener_lazy::Decode, json, iterations);
+  if (full < 0)
+    return;
+
+  double start = Now();
+  for (int i = 0; i < iterations; ++i) {
+    JsonIndex index;
+    ErrorPtr error;
+    if (!index.Build(json.data(), json.size(), &error)) {
+      fprintf(stderr, "Build error: %s\n", error->ToString().c_str());
+      return;
+    }
+    urlshortener_lazy::LazyUrlHistory history(&index, index.root());
+    urlshortener_lazy::LazyUrl* item = history.ItemsAt(kNumItems / 2);
+    if (!item || item->GetLongUrl(&error).empty()) {
+      fprintf(stderr, "Lazy decode failed\n");
+      return;
+    }
+  }
+  double lazy = Now() - start;
+
+  printf("  full: %8.2f ms\n", full * 1e3 / iterations);
+  printf("  lazy: %8.2f ms (%.2fx)\n", lazy * 1e3 / iterations, full / lazy);
+}
+
+// Encodes a few megabytes of UrlHistory with yajl, and straight into the
+// output buffer with the pre-escaped keys.
+void BenchEncode(int iterations) {
+  std::string json = UrlHistoryJson(2000);
+  urlshortener_yajl::UrlHistory data;
+  MemoryReader reader(json.data(), json.size());
+  ErrorPtr error;
+  urlshortener_yajl::Decode(&reader, &data, &error);
+  if (error) {
+    fprintf(stderr, "Decode error: %s\n", error->ToString().c_str());
+    return;
+  }
+  MemoryWriter writer;
+  urlshortener_yajl::Encode(&writer, &data, JsonGeneratorOptions(), &error);
+
+  JsonGeneratorOptions options;
+  options.use_yajl = true;
+  double yajl = TimeEncode(&urlshortener_yajl::Encode, &data, options,
+                           iterations);
+  options.use_yajl = false;
+  double direct = TimeEncode(&urlshortener_yajl::Encode, &data, options,
+                             iterations);
+  if (yajl < 0 || direct < 0)
+    return;
+  double megabytes = writer.data().size() * 1e-6 * iterations;
+  printf("  %.1f MB\n", writer.data().size() * 1e-6);
+  printf("    yajl: %8.1f MB/s\n", megabytes / yajl);
+  printf("  direct: %8.1f MB/s (%.2fx)\n", megabytes / direct,
+         yajl / direct);
+}
+
+// Encodes UrlHistory into a MemoryWriter that grows as it goes, and into one
+// reserved with EncodedSize first.
+void BenchEncodedSize(int iterations) {
+  std::string json = UrlHistoryJson(2000);
+  urlshortener_yajl::UrlHistory data;
+  MemoryReader reader(json.data(), json.size());
+  ErrorPtr error;
+  urlshortener_yajl::Decode(&reader, &data, &error);
+  if (error) {
+    fprintf(stderr, "Decode error: %s\n", error->ToString().c_str());
+    return;
+  }
+  JsonGeneratorOptions options;
+
+  size_t size = 0;
+  double start = Now();
+  for (int i = 0; i < iterations; ++i)
+    size = urlshortener_yajl::EncodedSize(data, options);
+  double sizing = Now() - start;
+
+  start = Now();
+  for (int i = 0; i < iterations; ++i) {
+    MemoryWriter writer;
+    urlshortener_yajl::Encode(&writer, &data, options, &error);
+  }
+  double growing = Now() - start;
+
+  start = Now();
+  for (int i = 0; i < iterations; ++i) {
+    MemoryWriter writer;
+    writer.Reserve(urlshortener_yajl::EncodedSize(data, options));
+    urlshortener_yajl::Encode(&writer, &data, options, &error);
+    if (writer.data().size() != size) {
+      fprintf(stderr, "EncodedSize %d != %d\n", static_cast<int>(size),
+              static_cast<int>(writer.data().size()));
+      return;
+    }
+  }
+  double reserved = Now() - start;
+
+  printf("  %.1f MB\n", size * 1e-6);
+  printf("      EncodedSize: %8.2f ms\n", sizing * 1e3 / iterations);
+  printf("    Encode, grown: %8.2f ms\n", growing * 1e3 / iterations);
+  printf("  Encode, reserved: %8.2f ms (%.2fx), including EncodedSize\n",
+         reserved * 1e3 / iterations, growing / reserved);
+}
+
+// Decodes a list of 1000 Wide objects with 4 of their 64 properties set, and
+// encodes it again, with and without --presence.
+void BenchPresence(int iterations) {
+  const int kNumItems = 1000;
+  std::string json = WideListJson(
+      "{\"itemId\": \"x\", \"itemCount\": 1, \"userName\": \"x\", "
+      "\"orderTime\": 1}", kNumItems);
+  wide_schema::WideList data;
+  wide_schema_presence::WideList presence_data;
+  MemoryReader reader(json.data(), json.size());
+  ErrorPtr error;
+  wide_schema::Decode(&reader, &data, &error);
+  MemoryReader presence_reader(json.data(), json.size());
+  if (!error)
+    wide_schema_presence::Decode(&presence_reader, &presence_data, &error);
+  if (error) {
+    fprintf(stderr, "Decode error: %s\n", error->ToString().c_str());
+    return;
+  }
+
+  JsonGeneratorOptions options;
+  double all = TimeEncode(&wide_schema::Encode, &data, options, iterations);
+  double present = TimeEncode(&wide_schema_presence::Encode, &presence_data,
+                              options, iterations);
+  if (all < 0 || present < 0)
+    return;
+  printf("       all: %8.2f ms, %6d KB\n", all * 1e3 / iterations,
+         static_cast<int>(wide_schema::EncodedSize(data, options) / 1000));
+  printf("  presence: %8.2f ms, %6d KB (%.2fx)\n",
+         present * 1e3 / iterations,
+         static_cast<int>(
+             wide_schema_presence::EncodedSize(presence_data, options) / 1000),
+         all / present);
+}
+
+// Encodes and decodes a 1 MB attachment, as in a ('string', 'byte') field.
+void BenchBase64(int iterations) {
+  const size_t kSize = 1 << 20;
+  std::vector<uint8_t> data(kSize);
+  for (size_t i = 0; i < kSize; ++i)
+    data[i] = static_cast<uint8_t>(i * 2654435761u >> 24);
+  std::vector<char> encoded(Base64EncodedSize(kSize));
+
+  double start = Now();
+  for (int i = 0; i < iterations; ++i)
+    Base64Encode(&data[0], kSize, BASE64, &encoded[0]);
+  double encode = Now() - start;
+
+  std::vector<uint8_t> decoded;
+  start = Now();
+  for (int i = 0; i < iterations; ++i) {
+    if (!Base64DecodeTo(&encoded[0], encoded.size(), &decoded) ||
+        decoded != data) {
+      fprintf(stderr, "Base64DecodeTo failed\n");
+      return;
+    }
+  }
+  double decode = Now() - start;
+
+  double megabytes = kSize * 1e-6 * iterations;
+  printf("  encode: %8.1f MB/s\n", megabytes / encode);
+  printf("  decode: %8.1f MB/s\n", megabytes / decode);
+}
+
+// yajl_gen_double's formatting, which JsonGenerator used before FormatDouble.
+size_t PrintfDouble(double value, char* out) {
+  int length = snprintf(out, 32, "%.17g", value);
+  if (strspn(out, "0123456789-") == static_cast<size_t>(length)) {
+    out[length++] = '.';
+    out[length++] = '0';
+  }
+  return length;
+}
+
+size_t PrintfInt64(int64_t value, char* out) {
+  return snprintf(out, 32, "%" PRId64, value);
+}
+
+size_t PrintfInt32(int32_t value, char* out) {
+  return snprintf(out, 16, "%" PRId32, value);
+}
+
+// Formats each of |values| |iterations| times. Returns the seconds taken.
+template <typename T>
+double TimeFormat(size_t (*format)(T, char*), const std::vector<T>& values,
+                  int iterations, size_t* total_length) {
+  char buffer[32];
+  *total_length = 0;
+  double start = Now();
+  for (int i = 0; i < iterations; ++i) {
+    for (size_t j = 0; j < values.size(); ++j)
+      *total_length += format(values[j], buffer);
+  }
+  return Now() - start;
+}
+
+template <typename T>
+void PrintFormatTimes(const char* name, size_t (*printf_format)(T, char*),
+                      size_t (*format)(T, char*),
+                      const std::vector<T>& values, int iterations) {
+  size_t printf_length;
+  size_t length;
+  double printf_time = TimeFormat(printf_format, values, iterations,
+                                  &printf_length);
+  double time = TimeFormat(format, values, iterations, &length);
+  double count = static_cast<double>(values.size()) * iterations;
+  printf("  %s printf: %6.1f ns, %4.1f chars\n", name,
+         printf_time * 1e9 / count, printf_length / count);
+  printf("  %s format: %6.1f ns, %4.1f chars (%.2fx)\n", name,
+         time * 1e9 / count, length / count, printf_time / time);
+}
+
+// Formats random doubles, API-like doubles with few digits, and integers,
+// with printf as yajl does and with the json_number.h formatters.
+void BenchFormatNumbers(int iterations) {
+  const int kNumValues = 100000;
+  std::vector<double> random_doubles;
+  std::vector<double> short_doubles;
+  std::vector<int64_t> int64s;
+  std::vector<int32_t> int32s;
+  uint64_t random = 88172645463325252ull;
+  while (random_doubles.size() < kNumValues) {
+    random ^= random << 13;
+    random ^= random >> 7;
+    random ^= random << 17;
+    double value;
+    memcpy(&value, &random, sizeof(value));
+    if (value == value && value - value == 0)
+      random_doubles.push_back(value);
+    short_doubles.push_back((random % 1000000) / 100.0);
+    int64s.push_back(static_cast<int64_t>(random) >> (random % 64));
+    int32s.push_back(static_cast<int32_t>(random) >> (random % 32));
+  }
+  PrintFormatTimes("random double", &PrintfDouble, &FormatDouble,
+                   random_doubles, iterations);
+  PrintFormatTimes(" short double", &PrintfDouble, &FormatDouble,
+                   short_doubles, iterations);
+  PrintFormatTimes("        int64", &PrintfInt64, &FormatInt64, int64s,
+                   iterations);
+  PrintFormatTimes("        int32", &PrintfInt32, &FormatInt32, int32s,
+                   iterations);
+}
+
+struct Benchmark {
+  const char* name;
+  void (*func)(int iterations);
+  int iterations;
+};
+
+Benchmark kBenchmarks[] = {
+  { "map_key_dispatch", &BenchMapKeyDispatch, 100000 },
+  { "arena_decode", &BenchArenaDecode, 20 },
+  { "string_views", &BenchStringViews, 20 },
+  { "field_mask", &BenchFieldMask, 20 },
+  { "decode_stream", &BenchDecodeStream, 20 },
+  { "direct_decoder", &BenchDirectDecoder, 10 },
+  { "base64", &BenchBase64, 100 },
+  { "lazy_decode", &BenchLazyDecode, 10 },
+  { "encode", &BenchEncode, 10 },
+  { "format_numbers", &BenchFormatNumbers, 10 },
+  { "encoded_size", &BenchEncodedSize, 10 },
+  { "presence", &BenchPresence, 20 },
+};
+
+}  // namespace
+
+int main(int argc, char** argv) {
+  const size_t kNumBenchmarks = sizeof(kBenchmarks)/sizeof(kBenchmarks[0]);
+  for (size_t i = 0; i < kNumBenchmarks; ++i) {
+    Benchmark& benchmark = kBenchmarks[i];
+    bool selected = argc == 1;
+    for (int j = 1; j < argc; ++j)
+      selected |= strcmp(argv[j], benchmark.name) == 0;
+    if (!selected)
+      continue;
+    printf("%s:\n", benchmark.name);
+    benchmark.func(benchmark.iterations);
+  }
+  return 0;
+}
@@ -0,0 +1,193 @@
+#include "field_mask.h"
+
+#include <stdio.h>
+#include <string.h>
+
+class FieldMask::Parser {
+ public:
+  explicit Parser(const char* fields) : fields_(fields), s_(fields) {}
+
+  bool ParseFields(FieldMask* mask, const FieldMaskSchema* schema,
+                   ErrorPtr* error);
+  bool AtEnd() const { return *s_ == 0; }
+  bool SetError(ErrorPtr* error, const std::string& message);
+
+ private:
+  bool ParseField(FieldMask* mask, const FieldMaskSchema* schema,
+                  ErrorPtr* error);
+  std::string ParseName();
+  bool Consume(char c);
+
+  const char* fields_;
+  const char* s_;
+};
+
+namespace {
+
+// Finds |name| in |schema|, and sets |child_schema| to the schema of its
+// value. Returns false if there is no such property.
+bool FindProperty(const FieldMaskSchema* schema, const std::string& name,
+                  const FieldMaskSchema** child_schema) {
+  for (size_t i = 0; i < schema->num_properties; ++i) {
+    if (name == schema->properties[i].name) {
+      *child_schema = schema->properties[i].schema;
+      return true;
+    }
+  }
+  if (schema->has_additional_properties) {
+    *child_schema = schema->additional_properties;
+    return true;
+  }
+  return false;
+}
+
+}  // namespace
+
+bool FieldMask::Parser::ParseFields(FieldMask* mask,
+                                    const FieldMaskSchema* schema,
+                                    ErrorPtr* error) {
+  do {
+    if (!ParseField(mask, schema, error))
+      return false;
+  } while (Consume(','));
+  return true;
+}
+
+bool FieldMask::Parser::ParseField(FieldMask* mask,
+                                   const FieldMaskSchema* schema,
+                                   ErrorPtr* error) {
+  // Selections inside a field that is already selected as a whole change
+  // nothing, so they are parsed (and checked) into |ignored|.
+  FieldMask ignored;
+  while (true) {
+    std::string name = ParseName();
+    if (name.empty())
+      return SetError(error, "Expected a field name");
+    if (name == "*") {
+      if (*s_ == '/' || *s_ == '(')
+        return SetError(error, "Expected ',' or ')' after '*'");
+      mask->Clear();
+      mask->all_ = true;
+      return true;
+    }
+
+    const FieldMaskSchema* child_schema;
+    if (!FindProperty(schema, name, &child_schema))
+      return SetError(error, "Unknown field \"" + name + "\"");
+
+    Child* child = mask->FindChild(name.data(), name.size());
+    bool selected_as_whole = child && !child->mask;
+    if (!child) {
+      Child new_child;
+      new_child.name = name;
+      new_child.mask = NULL;
+      mask->children_.push_back(new_child);
+      child = &mask->children_.back();
+    }
+
+    if (*s_ != '/' && *s_ != '(') {
+      // The whole value.
+      delete child->mask;
+      child->mask = NULL;
+      return true;
+    }
+
+    if (!child_schema)
+      return SetError(error, "Field \"" + name + "\" has no fields");
+    if (selected_as_whole) {
+      ignored.Clear();
+      mask = &ignored;
+    } else {
+      if (!child->mask) {
+        child->mask = new FieldMask();
+        child->mask->schema_ = child_schema;
+      }
+      mask = child->mask;
+    }
+    schema = child_schema;
+
+    if (Consume('('))
+      return ParseFields(mask, schema, error) &&
+             (Consume(')') || SetError(error, "Expected ')'"));
+    Consume('/');
+  }
+}
+
+std::string FieldMask::Parser::ParseName() {
+  const char* start = s_;
+  while (*s_ && !strchr(",/()", *s_))
+    ++s_;
+  return std::string(start, s_);
+}
+
+bool FieldMask::Parser::Consume(char c) {
+  if (*s_ != c)
+    return false;
+  ++s_;
+  return true;
+}
+
+bool FieldMask::Parser::SetError(ErrorPtr* error, const std::string& message) {
+  if (error) {
+    char offset[32];
+    snprintf(offset, sizeof(offset), " at offset %d",
+             static_cast<int>(s_ - fields_));
+    error->reset(new MessageError(
+        "Invalid field mask \"" + std::string(fields_) + "\": " + message +
+        offset));
+  }
+  return false;
+}
+
+FieldMask::FieldMask()
+    : schema_(NULL),
+      all_(false) {
+}
+
+FieldMask::~FieldMask() {
+  Clear();
+}
+
+bool FieldMask::Parse(const char* fields, const FieldMaskSchema& schema,
+                      ErrorPtr* error) {
+  Clear();
+  schema_ = &schema;
+  Parser parser(fields);
+  if (!parser.ParseFields(this, &schema, error))
+    return false;
+  if (!parser.AtEnd())
+    return parser.SetError(error, "Expected ','");
+  return true;
+}
+
+bool FieldMask::Select(const char* s, size_t length,
+                       const FieldMask** child) const {
+  if (all_) {
+    *child = NULL;
+    return true;
+  }
+  for (size_t i = 0; i < children_.size(); ++i) {
+    const Child& c = children_[i];
+    if (c.name.size() == length && memcmp(c.name.data(), s, length) == 0) {
+      *child = c.mask;
+      return true;
+    }
+  }
+  return false;
+}
+
+void FieldMask::Clear() {
+  for (size_t i = 0; i < children_.size(); ++i)
+    delete children_[i].mask;
+  children_.clear();
+  all_ = false;
+}
+
+FieldMask::Child* FieldMask::FindChild(const char* s, size_t length) {
+  for (size_t i = 0; i < children_.size(); ++i) {
+    if (children_[i].name.size() == length &&
+        memcmp(children_[i].name.data(), s, length) == 0)
+      return &children_[i];
+  }
+  return NULL;
+}
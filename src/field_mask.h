@@ -0,0 +1,65 @@
+#ifndef FIELD_MASK_H_
+#define FIELD_MASK_H_
+
+#include <stddef.h>
+#include <string>
+#include <vector>
+#include "error.h"
+
+// The properties of an object, generated for each schema so that field masks
+// can be checked against it. Arrays are transparent: the schema of an array
+// property is the schema of its (innermost) elements.
+struct FieldMaskSchema {
+  struct Property {
+    const char* name;
+    const FieldMaskSchema* schema;  // NULL unless the property is an object.
+  };
+
+  const Property* properties;
+  size_t num_properties;
+  // Whether the object has additionalProperties, i.e. any key is valid.
+  bool has_additional_properties;
+  // The schema of the additionalProperties values, if they are objects.
+  const FieldMaskSchema* additional_properties;
+};
+
+// The fields to decode, in the syntax of the fields= parameter of Google
+// APIs: e.g. "items(id,snippet/title),nextPageToken". "a/b" is short for
+// "a(b)", and "*" selects every field of an object.
+class FieldMask {
+ public:
+  FieldMask();
+  ~FieldMask();
+
+  // Parses |fields| and checks every name against |schema|, the generated
+  // k<Schema>Fields. Returns false and sets |error| if either fails.
+  bool Parse(const char* fields, const FieldMaskSchema& schema,
+             ErrorPtr* error);
+
+  // The schema Parse checked the mask against.
+  const FieldMaskSchema* schema() const { return schema_; }
+
+  // Whether the key (s, length) is selected. If so, sets |child| to the mask
+  // of its value, or to NULL if all of the value is selected.
+  bool Select(const char* s, size_t length, const FieldMask** child) const;
+
+ private:
+  struct Child {
+    std::string name;
+    FieldMask* mask;  // NULL selects all of the value.
+  };
+
+  class Parser;
+
+  void Clear();
+  Child* FindChild(const char* s, size_t length);
+
+  const FieldMaskSchema* schema_;
+  bool all_;
+  std::vector<Child> children_;
+
+  FieldMask(const FieldMask&);
+  FieldMask& operator =(const FieldMask&);
+};
+
+#endif  // FIELD_MASK_H_
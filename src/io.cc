@@ -62,12 +62,67 @@ MemoryWriter::~MemoryWriter() {
 }
 
 size_t MemoryWriter::Write(const void* buf, size_t count, ErrorPtr* error) {
-  size_t old_size = data_.size();
-  data_.resize(old_size + count);
-  memcpy(&data_[old_size], buf, count);
+  if (data_.capacity() - data_.size() < count)
+    Reserve(std::max(count, data_.capacity()));
+  const char* p = static_cast<const char*>(buf);
+  data_.insert(data_.end(), p, p + count);
   return count;
 }
 
+void MemoryWriter::Reserve(size_t count) {
+  data_.reserve(data_.size() + count);
+}
+
+const size_t BufferedWriter::kDefaultBufferSize;
+
+BufferedWriter::BufferedWriter(Writer* dst, size_t buffer_size)
+    : dst_(dst),
+      buffer_(buffer_size),
+      used_(0) {
+}
+
+BufferedWriter::~BufferedWriter() {
+  WriteBuffer();
+}
+
+size_t BufferedWriter::Write(const void* buf, size_t count, ErrorPtr* error) {
+  if (buffer_.size() - used_ < count)
+    WriteBuffer();
+  if (count < buffer_.size()) {
+    memcpy(&buffer_[used_], buf, count);
+    used_ += count;
+  } else if (!error_) {
+    // Too big to be worth copying.
+    dst_->Write(buf, count, &error_);
+  }
+  if (error_) {
+    if (error)
+      *error = error_;
+    return 0;
+  }
+  return count;
+}
+
+bool BufferedWriter::Flush(ErrorPtr* error) {
+  WriteBuffer();
+  if (error)
+    *error = error_;
+  return !error_;
+}
+
+void BufferedWriter::MakeRoom(size_t count) {
+  WriteBuffer();
+  if (buffer_.size() < count)
+    buffer_.resize(count);
+}
+
+void BufferedWriter::WriteBuffer() {
+  // After an error, what is buffered is dropped.
+  if (used_ && !error_)
+    dst_->Write(&buffer_[0], used_, &error_);
+  used_ = 0;
+}
+
 size_t Copy(Writer* dst, Reader* src, ErrorPtr* out_error) {
   const size_t BUFFER_SIZE = 32*1024;
   char buffer[BUFFER_SIZE];
@@ -51,12 +51,62 @@ class MemoryWriter : public Writer {
   ~MemoryWriter();
   virtual size_t Write(const void* buf, size_t count, ErrorPtr* error);
 
+  // Makes room for |count| more bytes, e.g. when the size of what will be
+  // written is known, so that writing them doesn't reallocate.
+  void Reserve(size_t count);
+
   const std::vector<char>& data() const { return data_; }
 
  private:
   std::vector<char> data_;
 };
 
+// Collects writes in a buffer, and writes them to another Writer when the
+// buffer is full, on Flush and on destruction, so that writing many small
+// pieces, like JSON tokens, costs a few large writes.
+class BufferedWriter : public Writer {
+ public:
+  static const size_t kDefaultBufferSize = 4096;
+
+  explicit BufferedWriter(Writer* dst,
+                          size_t buffer_size = kDefaultBufferSize);
+  ~BufferedWriter();
+  virtual size_t Write(const void* buf, size_t count, ErrorPtr* error);
+
+  // Writes the buffered bytes to the other Writer. Returns false and sets
+  // |error| if that, or an earlier write to it, failed.
+  bool Flush(ErrorPtr* error);
+
+  // To write into the buffer without copying: Reserve returns room for at
+  // least |count| bytes, flushing the buffer or growing it as needed, and
+  // Commit adds the first |count| bytes of that room to what is buffered.
+  char* Reserve(size_t count) {
+    if (buffer_.size() - used_ < count)
+      MakeRoom(count);
+    return &buffer_[used_];
+  }
+  void Commit(size_t count) { used_ += count; }
+
+  void Put(char c) {
+    if (used_ == buffer_.size())
+      MakeRoom(1);
+    buffer_[used_++] = c;
+  }
+
+ private:
+  void MakeRoom(size_t count);
+  void WriteBuffer();
+
+  Writer* dst_;
+  std::vector<char> buffer_;
+  size_t used_;
+  // The first error of the other Writer.
+  ErrorPtr error_;
+
+  BufferedWriter(const BufferedWriter&);
+  BufferedWriter& operator =(const BufferedWriter&);
+};
+
 size_t Copy(Writer* dst, Reader* src, ErrorPtr* error);
 int Compare(Reader* r1, Reader* r2, ErrorPtr* error);
 
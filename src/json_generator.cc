@@ -1,25 +1,92 @@
 #include "json_generator.h"
-#define __STDC_FORMAT_MACROS  // For PRI* macros
-#include <inttypes.h>
+#include <math.h>
+#include <string.h>
+#include <algorithm>
+#include "json_number.h"
+
+namespace {
+
+const char kHexDigits[] = "0123456789ABCDEF";
+
+// Whether (s, length) is UTF-8 as far as yajl checks it: the right number
+// of continuation bytes after each leading byte.
+bool IsValidUtf8(const unsigned char* s, size_t length) {
+  const unsigned char* end = s + length;
+  while (s != end) {
+    unsigned char c = *s++;
+    int trailing;
+    if (c < 0x80)
+      continue;
+    else if ((c >> 5) == 0x6)
+      trailing = 1;
+    else if ((c >> 4) == 0xe)
+      trailing = 2;
+    else if ((c >> 3) == 0x1e)
+      trailing = 3;
+    else
+      return false;
+    for (; trailing > 0; --trailing, ++s) {
+      if (s == end || (*s >> 6) != 0x2)
+        return false;
+    }
+  }
+  return true;
+}
+
+// The char after the backslash of the escape of |c|, 'u' for the four hex
+// digit kind, or 0 if |c| is not escaped.
+inline char EscapeOf(unsigned char c, bool escape_solidus) {
+  if (c >= 0x20) {
+    if (c == '"' || c == '\\')
+      return c;
+    return c == '/' && escape_solidus ? '/' : 0;
+  }
+  switch (c) {
+    case '\b': return 'b';
+    case '\f': return 'f';
+    case '\n': return 'n';
+    case '\r': return 'r';
+    case '\t': return 't';
+  }
+  return 'u';
+}
+
+}  // namespace
+
+const int JsonGenerator::kMaxDepth;
 
 JsonGeneratorOptions::JsonGeneratorOptions()
     : beautify(false),
       escape_solidus(false),
       validate_utf8(true),
-      indent_string("") {
+      indent_string(""),
+      base64_alphabet(BASE64),
+      use_yajl(false),
+      buffer_size(BufferedWriter::kDefaultBufferSize) {
 }
 
 JsonGenerator::JsonGenerator(Writer* dst)
-    : dst_(dst) {
+    : out_(dst) {
   Init(JsonGeneratorOptions());
 }
 
 JsonGenerator::JsonGenerator(Writer* dst, const JsonGeneratorOptions& options)
-    : dst_(dst) {
+    : out_(dst, options.buffer_size) {
   Init(options);
 }
 
 void JsonGenerator::Init(const JsonGeneratorOptions& options) {
+  base64_alphabet_ = options.base64_alphabet;
+  escape_solidus_ = options.escape_solidus;
+  validate_utf8_ = options.validate_utf8;
+  depth_ = 0;
+  need_comma_ = false;
+  expect_key_ = false;
+  if (!options.beautify && !options.use_yajl) {
+    handle_ = NULL;
+    return;
+  }
+
   // NULL => use the default C alloc funcs (malloc, realloc, free).
   handle_ = yajl_gen_alloc(NULL);
   yajl_gen_config(handle_, yajl_gen_print_callback, ThunkOnPrint, this);
@@ -31,64 +98,76 @@ void JsonGenerator::Init(const JsonGeneratorOptions& options) {
 }
 
 JsonGenerator::~JsonGenerator() {
-  yajl_gen_free(handle_);
+  if (handle_)
+    yajl_gen_free(handle_);
 }
 
 bool JsonGenerator::GenNull(ErrorPtr* error) {
+  if (!handle_) {
+    if (!BeginValue(error))
+      return false;
+    out_.Write("null", 4, NULL);
+    EndValue();
+    return true;
+  }
   yajl_gen_status status = yajl_gen_null(handle_);
   SetErrorFromStatus(error, status);
   return status == yajl_gen_status_ok;
 }
 
 bool JsonGenerator::GenBool(bool value, ErrorPtr* error) {
+  if (!handle_) {
+    if (!BeginValue(error))
+      return false;
+    if (value)
+      out_.Write("true", 4, NULL);
+    else
+      out_.Write("false", 5, NULL);
+    EndValue();
+    return true;
+  }
   yajl_gen_status status = yajl_gen_bool(handle_, value);
   SetErrorFromStatus(error, status);
   return status == yajl_gen_status_ok;
 }
 
 bool JsonGenerator::GenInt32(int32_t value, ErrorPtr* error) {
-  yajl_gen_status status = yajl_gen_integer(handle_, value);
-  SetErrorFromStatus(error, status);
-  return status == yajl_gen_status_ok;
+  char buffer[kMaxFormattedNumberLength];
+  return GenNumber(buffer, FormatInt32(value, buffer), false, error);
 }
 
 bool JsonGenerator::GenUint32(uint32_t value, ErrorPtr* error) {
-  yajl_gen_status status = yajl_gen_integer(handle_, value);
-  SetErrorFromStatus(error, status);
-  return status == yajl_gen_status_ok;
+  char buffer[kMaxFormattedNumberLength];
+  return GenNumber(buffer, FormatUint32(value, buffer), false, error);
 }
 
 bool JsonGenerator::GenInt64(int64_t value, ErrorPtr* error) {
-  char buffer[32];
-  int length = snprintf(&buffer[0], 32, "%"PRId64, value);
-  yajl_gen_status status = yajl_gen_string(
-      handle_, reinterpret_cast<const unsigned char*>(buffer), length);
-  SetErrorFromStatus(error, status);
-  return status == yajl_gen_status_ok;
+  char buffer[kMaxFormattedNumberLength];
+  return GenNumber(buffer, FormatInt64(value, buffer), true, error);
 }
 
 bool JsonGenerator::GenUint64(uint64_t value, ErrorPtr* error) {
-  char buffer[32];
-  int length = snprintf(&buffer[0], 32, "%"PRIu64, value);
-  yajl_gen_status status = yajl_gen_string(
-      handle_, reinterpret_cast<const unsigned char*>(buffer), length);
-  SetErrorFromStatus(error, status);
-  return status == yajl_gen_status_ok;
+  char buffer[kMaxFormattedNumberLength];
+  return GenNumber(buffer, FormatUint64(value, buffer), true, error);
 }
 
 bool JsonGenerator::GenFloat(float value, ErrorPtr* error) {
-  yajl_gen_status status = yajl_gen_double(handle_, value);
-  SetErrorFromStatus(error, status);
-  return status == yajl_gen_status_ok;
+  if (isnan(value) || isinf(value))
+    return Fail(error, "Invalid number");
+  char buffer[kMaxFormattedNumberLength];
+  return GenNumber(buffer, FormatFloat(value, buffer), false, error);
 }
 
 bool JsonGenerator::GenDouble(double value, ErrorPtr* error) {
-  yajl_gen_status status = yajl_gen_double(handle_, value);
-  SetErrorFromStatus(error, status);
-  return status == yajl_gen_status_ok;
+  if (isnan(value) || isinf(value))
+    return Fail(error, "Invalid number");
+  char buffer[kMaxFormattedNumberLength];
+  return GenNumber(buffer, FormatDouble(value, buffer), false, error);
 }
 
 bool JsonGenerator::GenString(const char* s, size_t length, ErrorPtr* error) {
+  if (!handle_)
+    return DirectString(s, length, error);
   yajl_gen_status status = yajl_gen_string(
       handle_, reinterpret_cast<const unsigned char*>(s), length);
   SetErrorFromStatus(error, status);
@@ -96,36 +175,213 @@ bool JsonGenerator::GenString(const char* s, size_t length, ErrorPtr* error) {
 }
 
 bool JsonGenerator::GenString(const std::string& s, ErrorPtr* error) {
+  if (!handle_)
+    return DirectString(s.data(), s.length(), error);
   yajl_gen_status status = yajl_gen_string(
       handle_, reinterpret_cast<const unsigned char*>(s.data()), s.length());
   SetErrorFromStatus(error, status);
   return status == yajl_gen_status_ok;
 }
 
+bool JsonGenerator::GenKeyLiteral(const char* s, size_t length,
+                                  ErrorPtr* error) {
+  if (handle_) {
+    // yajl quotes and escapes keys itself.
+    yajl_gen_status status = yajl_gen_string(
+        handle_, reinterpret_cast<const unsigned char*>(s + 1), length - 3);
+    SetErrorFromStatus(error, status);
+    return status == yajl_gen_status_ok;
+  }
+  if (need_comma_) {
+    char* p = out_.Reserve(length + 1);
+    *p = ',';
+    memcpy(p + 1, s, length);
+    out_.Commit(length + 1);
+  } else {
+    out_.Write(s, length, NULL);
+  }
+  need_comma_ = false;
+  expect_key_ = false;
+  return true;
+}
+
+bool JsonGenerator::GenBase64(const uint8_t* data, size_t size,
+                              ErrorPtr* error) {
+  if (size == 0)
+    return GenString("", 0, error);
+  size_t length = Base64EncodedSize(size);
+  if (!handle_ && !expect_key_ &&
+      !(escape_solidus_ && base64_alphabet_ == BASE64)) {
+    // Nothing in it needs escaping.
+    if (need_comma_)
+      out_.Put(',');
+    char* p = out_.Reserve(length + 2);
+    p[0] = '"';
+    Base64Encode(data, size, base64_alphabet_, p + 1);
+    p[length + 1] = '"';
+    out_.Commit(length + 2);
+    EndValue();
+    return true;
+  }
+  if (base64_buffer_.size() < length)
+    base64_buffer_.resize(length);
+  Base64Encode(data, size, base64_alphabet_, &base64_buffer_[0]);
+  return GenString(&base64_buffer_[0], length, error);
+}
+
 bool JsonGenerator::GenStartMap(ErrorPtr* error) {
+  if (!handle_)
+    return DirectStart('{', error);
   yajl_gen_status status = yajl_gen_map_open(handle_);
   SetErrorFromStatus(error, status);
   return status == yajl_gen_status_ok;
 }
 
 bool JsonGenerator::GenEndMap(ErrorPtr* error) {
+  if (!handle_) {
+    if (!DirectEnd('}'))
+      return Fail(error, "Generation complete");
+    return true;
+  }
   yajl_gen_status status = yajl_gen_map_close(handle_);
   SetErrorFromStatus(error, status);
   return status == yajl_gen_status_ok;
 }
 
 bool JsonGenerator::GenStartArray(ErrorPtr* error) {
+  if (!handle_)
+    return DirectStart('[', error);
   yajl_gen_status status = yajl_gen_array_open(handle_);
   SetErrorFromStatus(error, status);
   return status == yajl_gen_status_ok;
 }
 
 bool JsonGenerator::GenEndArray(ErrorPtr* error) {
+  if (!handle_) {
+    if (!DirectEnd(']'))
+      return Fail(error, "Generation complete");
+    return true;
+  }
   yajl_gen_status status = yajl_gen_array_close(handle_);
   SetErrorFromStatus(error, status);
   return status == yajl_gen_status_ok;
 }
 
+bool JsonGenerator::Flush(ErrorPtr* error) {
+  return out_.Flush(error);
+}
+
+bool JsonGenerator::BeginValue(ErrorPtr* error) {
+  if (expect_key_)
+    return Fail(error, "Keys must be strings");
+  if (need_comma_)
+    out_.Put(',');
+  return true;
+}
+
+void JsonGenerator::EndValue() {
+  need_comma_ = true;
+  expect_key_ = depth_ > 0 && in_map_[depth_ - 1];
+}
+
+bool JsonGenerator::GenNumber(const char* s, size_t length, bool quoted,
+                              ErrorPtr* error) {
+  if (handle_) {
+    yajl_gen_status status = quoted ?
+        yajl_gen_string(handle_, reinterpret_cast<const unsigned char*>(s),
+                        length) :
+        yajl_gen_number(handle_, s, length);
+    SetErrorFromStatus(error, status);
+    return status == yajl_gen_status_ok;
+  }
+  if (!BeginValue(error))
+    return false;
+  char* p = out_.Reserve(length + 2);
+  if (quoted) {
+    p[0] = '"';
+    memcpy(p + 1, s, length);
+    p[length + 1] = '"';
+    out_.Commit(length + 2);
+  } else {
+    memcpy(p, s, length);
+    out_.Commit(length);
+  }
+  EndValue();
+  return true;
+}
+
+bool JsonGenerator::DirectString(const char* s, size_t length,
+                                 ErrorPtr* error) {
+  if (validate_utf8_ &&
+      !IsValidUtf8(reinterpret_cast<const unsigned char*>(s), length))
+    return Fail(error, "Invalid string");
+  if (need_comma_)
+    out_.Put(',');
+  out_.Put('"');
+  AppendEscaped(s, length);
+  if (expect_key_) {
+    out_.Write("\":", 2, NULL);
+    need_comma_ = false;
+    expect_key_ = false;
+  } else {
+    out_.Put('"');
+    EndValue();
+  }
+  return true;
+}
+
+bool JsonGenerator::DirectStart(char c, ErrorPtr* error) {
+  if (!BeginValue(error))
+    return false;
+  if (depth_ == kMaxDepth - 1)
+    return Fail(error, "Max depth exceeded");
+  in_map_[depth_++] = c == '{';
+  out_.Put(c);
+  need_comma_ = false;
+  expect_key_ = c == '{';
+  return true;
+}
+
+bool JsonGenerator::DirectEnd(char c) {
+  if (depth_ == 0)
+    return false;
+  --depth_;
+  out_.Put(c);
+  EndValue();
+  return true;
+}
+
+void JsonGenerator::AppendEscaped(const char* s, size_t length) {
+  const char* run = s;
+  const char* end = s + length;
+  for (; s != end; ++s) {
+    char escape = EscapeOf(*s, escape_solidus_);
+    if (!escape)
+      continue;
+    out_.Write(run, s - run, NULL);
+    run = s + 1;
+    char* p = out_.Reserve(6);
+    p[0] = '\\';
+    p[1] = escape;
+    if (escape == 'u') {
+      p[2] = '0';
+      p[3] = '0';
+      p[4] = kHexDigits[static_cast<unsigned char>(*s) >> 4];
+      p[5] = kHexDigits[*s & 0xf];
+      out_.Commit(6);
+    } else {
+      out_.Commit(2);
+    }
+  }
+  out_.Write(run, end - run, NULL);
+}
+
+bool JsonGenerator::Fail(ErrorPtr* error, const char* message) {
+  if (error)
+    error->reset(new MessageError(message));
+  return false;
+}
+
 void JsonGenerator::SetErrorFromStatus(ErrorPtr* error,
                                        yajl_gen_status status) {
   if (!error)
@@ -175,5 +431,67 @@ void JsonGenerator::ThunkOnPrint(void* ctx, const char* s, size_t length) {
 }
 
 void JsonGenerator::OnPrint(const char* s, size_t length) {
-  dst_->Write(s, length, &error_);
+  out_.Write(s, length, NULL);
+}
+
+size_t EncodedInt32Size(int32_t value) {
+  char buffer[kMaxFormattedNumberLength];
+  return FormatInt32(value, buffer);
+}
+
+size_t EncodedUint32Size(uint32_t value) {
+  char buffer[kMaxFormattedNumberLength];
+  return FormatUint32(value, buffer);
+}
+
+size_t EncodedInt64Size(int64_t value) {
+  char buffer[kMaxFormattedNumberLength];
+  return FormatInt64(value, buffer) + 2;
+}
+
+size_t EncodedUint64Size(uint64_t value) {
+  char buffer[kMaxFormattedNumberLength];
+  return FormatUint64(value, buffer) + 2;
+}
+
+size_t EncodedFloatSize(float value) {
+  if (isnan(value) || isinf(value))
+    return 0;
+  char buffer[kMaxFormattedNumberLength];
+  return FormatFloat(value, buffer);
+}
+
+size_t EncodedDoubleSize(double value) {
+  if (isnan(value) || isinf(value))
+    return 0;
+  char buffer[kMaxFormattedNumberLength];
+  return FormatDouble(value, buffer);
+}
+
+size_t EncodedStringSize(const char* s, size_t length,
+                         const JsonGeneratorOptions& options) {
+  size_t size = length + 2;
+  const char* end = s + length;
+  for (; s != end; ++s) {
+    char escape = EscapeOf(*s, options.escape_solidus);
+    if (escape)
+      size += escape == 'u' ? 5 : 1;
+  }
+  return size;
+}
+
+size_t EncodedBase64Size(const uint8_t* data, size_t size,
+                         const JsonGeneratorOptions& options) {
+  size_t encoded_size = Base64EncodedSize(size) + 2;
+  if (!options.escape_solidus || options.base64_alphabet != BASE64)
+    return encoded_size;
+  // Count the '/'s, which are escaped, encoding a chunk at a time.
+  char chunk[1024];
+  const size_t kChunkSize = sizeof(chunk) / 4 * 3;
+  for (size_t i = 0; i < size; i += kChunkSize) {
+    size_t n = std::min(kChunkSize, size - i);
+    Base64Encode(data + i, n, BASE64, chunk);
+    encoded_size += std::count(chunk, chunk + Base64EncodedSize(n), '/');
+  }
+  return encoded_size;
 }
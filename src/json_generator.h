@@ -4,6 +4,8 @@
 #include <stdint.h>
 #include <stdlib.h>
 #include <string>
+#include <vector>
+#include "base64.h"
 #include "error.h"
 #include "io.h"
 #include "yajl/yajl_gen.h"
@@ -15,8 +17,21 @@ struct JsonGeneratorOptions {
   bool escape_solidus;
   bool validate_utf8;
   std::string indent_string;
+  // The alphabet of GenBase64, for the ('string', 'byte') fields.
+  Base64Alphabet base64_alphabet;
+  // Generates compact JSON with yajl too, rather than straight into the
+  // output buffer; for comparing the two. Beautified JSON always comes from
+  // yajl.
+  bool use_yajl;
+  // The size of the buffer that the JSON is written to the Writer from.
+  size_t buffer_size;
 };
 
+// The JSON goes through a BufferedWriter: it is written to the Writer when
+// the buffer fills up, by Flush and on destruction. Without beautify, it is
+// generated straight into the buffer, with only the strings escaped; the
+// output is the same as yajl's. Either way, numbers are formatted by
+// json_number.h: floats as the shortest decimal that reads back the same.
 class JsonGenerator {
  public:
   explicit JsonGenerator(Writer* dst);
@@ -33,21 +48,72 @@ class JsonGenerator {
   bool GenDouble(double value, ErrorPtr* error);
   bool GenString(const char* s, size_t length, ErrorPtr* error);
   bool GenString(const std::string& s, ErrorPtr* error);
+  // A key of the map being generated, as the generated encoders have it:
+  // (s, length) is the key already escaped and quoted, followed by ':'.
+  bool GenKeyLiteral(const char* s, size_t length, ErrorPtr* error);
+  // A string with the base64 of (data, size).
+  bool GenBase64(const uint8_t* data, size_t size, ErrorPtr* error);
   bool GenStartMap(ErrorPtr* error);
   bool GenEndMap(ErrorPtr* error);
   bool GenStartArray(ErrorPtr* error);
   bool GenEndArray(ErrorPtr* error);
 
+  // Writes what has been generated but not written yet. Returns false and
+  // sets |error| if writing it, or anything before it, failed.
+  bool Flush(ErrorPtr* error);
+
  private:
+  // As deep as yajl goes.
+  static const int kMaxDepth = 128;
+
   void Init(const JsonGeneratorOptions& options);
+  // The formatted number (s, length), as a string if |quoted|.
+  bool GenNumber(const char* s, size_t length, bool quoted, ErrorPtr* error);
+  // The direct counterparts of the Gen* functions.
+  bool BeginValue(ErrorPtr* error);
+  void EndValue();
+  bool DirectString(const char* s, size_t length, ErrorPtr* error);
+  bool DirectStart(char c, ErrorPtr* error);
+  bool DirectEnd(char c);
+  void AppendEscaped(const char* s, size_t length);
+  static bool Fail(ErrorPtr* error, const char* message);
   void SetErrorFromStatus(ErrorPtr* error, yajl_gen_status status);
   static void ThunkOnPrint(void* ctx, const char* s, size_t length);
   void OnPrint(const char* s, size_t length);
 
  private:
   yajl_gen handle_;
-  Writer* dst_;
-  ErrorPtr error_;
+  BufferedWriter out_;
+  Base64Alphabet base64_alphabet_;
+  // Reused by every GenBase64, since yajl takes whole strings.
+  std::vector<char> base64_buffer_;
+
+  // Direct generation, when handle_ is NULL.
+  bool escape_solidus_;
+  bool validate_utf8_;
+  int depth_;
+  // Whether each open container is a map.
+  bool in_map_[kMaxDepth];
+  // Whether a ',' goes before the next key or value.
+  bool need_comma_;
+  // Whether a string is a key.
+  bool expect_key_;
 };
 
+// The sizes of the JSON that JsonGenerator generates for single values
+// without beautify, for the EncodedSize functions of the generated code:
+// strings with their quotes and escapes, and 64-bit integers quoted. The
+// sizes of values that JsonGenerator fails on, like NaN, are meaningless.
+inline size_t EncodedBoolSize(bool value) { return value ? 4 : 5; }
+size_t EncodedInt32Size(int32_t value);
+size_t EncodedUint32Size(uint32_t value);
+size_t EncodedInt64Size(int64_t value);
+size_t EncodedUint64Size(uint64_t value);
+size_t EncodedFloatSize(float value);
+size_t EncodedDoubleSize(double value);
+size_t EncodedStringSize(const char* s, size_t length,
+                         const JsonGeneratorOptions& options);
+size_t EncodedBase64Size(const uint8_t* data, size_t size,
+                         const JsonGeneratorOptions& options);
+
 #endif  // JSON_GENERATOR_H_
@@ -0,0 +1,210 @@
+#include "json_index.h"
+
+#include <stdio.h>
+#include <string.h>
+#include "json_scanner.h"
+
+namespace {
+
+bool IsDelimiter(char c) {
+  switch (c) {
+    case ' ': case '\t': case '\n': case '\r':
+    case ',': case ']': case '}': case ':':
+      return true;
+  }
+  return false;
+}
+
+}  // namespace
+
+const size_t JsonIndex::kNone;
+const size_t JsonIndex::kMaxSize;
+const size_t JsonIndex::kMaxDepth;
+
+JsonIndex::JsonIndex()
+    : data_(NULL),
+      size_(0) {
+}
+
+bool JsonIndex::Build(const std::vector<char>& data, ErrorPtr* error) {
+  return Build(data.empty() ? NULL : &data[0], data.size(), error);
+}
+
+bool JsonIndex::Build(const char* data, size_t size, ErrorPtr* error) {
+  data_ = data;
+  size_ = size;
+  values_.clear();
+  children_.clear();
+  if (size > kMaxSize)
+    return Fail(error, "Input too large to index", 0);
+  // Typical API responses have a value every 10-20 bytes.
+  values_.reserve(size / 16);
+  children_.reserve(size / 16);
+
+  // The objects and arrays that have started and not ended.
+  std::vector<size_t> open;
+  // The key of the next value, if it is a member.
+  uint32_t key = 0;
+  uint32_t key_length = 0;
+  size_t i = SkipWhitespace(0);
+  while (true) {
+    // A value starts at i.
+    if (i == size_)
+      return Fail(error, "Unexpected end of input", i);
+    size_t value = values_.size();
+    Value new_value = { i, i, key, key_length, 0, 0 };
+    values_.push_back(new_value);
+    if (!open.empty())
+      open_children_[open.size() - 1].push_back(value);
+
+    char c = data_[i];
+    if (c == '{' || c == '[') {
+      if (open.size() == kMaxDepth)
+        return Fail(error, "Too deeply nested", i);
+      open.push_back(value);
+      if (open_children_.size() < open.size())
+        open_children_.resize(open.size());
+      open_children_[open.size() - 1].clear();
+      i = SkipWhitespace(i + 1);
+      // Unless it is empty, go on with its first value.
+      if (i == size_ || data_[i] != (c == '{' ? '}' : ']')) {
+        if (c == '{' && !ReadKey(&i, &key, &key_length, error))
+          return false;
+        if (c == '[')
+          key = key_length = 0;
+        continue;
+      }
+    } else {
+      if (c == '"') {
+        if (!SkipString(&i, error))
+          return false;
+      } else {
+        // A number or a literal; decoding checks which.
+        while (i != size_ && !IsDelimiter(data_[i]))
+          ++i;
+        if (i == static_cast<size_t>(values_[value].begin))
+          return Fail(error, "Invalid value", i);
+      }
+      values_[value].end = i;
+      i = SkipWhitespace(i);
+    }
+
+    // After a value, end the objects and arrays that end here, up to the
+    // next value.
+    while (true) {
+      if (open.empty()) {
+        if (i != size_)
+          return Fail(error, "Trailing garbage", i);
+        return true;
+      }
+      bool is_object = data_[values_[open.back()].begin] == '{';
+      char end = is_object ? '}' : ']';
+      if (i != size_ && data_[i] == end) {
+        EndContainer(open.back(), i + 1, open.size() - 1);
+        open.pop_back();
+        i = SkipWhitespace(i + 1);
+        continue;
+      }
+      if (i != size_ && data_[i] == ',') {
+        i = SkipWhitespace(i + 1);
+        if (is_object) {
+          if (!ReadKey(&i, &key, &key_length, error))
+            return false;
+        } else {
+          key = key_length = 0;
+        }
+        break;
+      }
+      return Fail(error, is_object ? "Expected ',' or '}'" :
+                                     "Expected ',' or ']'", i);
+    }
+  }
+}
+
+size_t JsonIndex::Find(size_t value, const char* key, size_t length) const {
+  for (size_t i = num_children(value); i > 0; --i) {
+    size_t member = child(value, i - 1);
+    if (KeyEquals(values_[member], key, length))
+      return member;
+  }
+  return kNone;
+}
+
+size_t JsonIndex::SkipWhitespace(size_t i) const {
+  while (i != size_) {
+    switch (data_[i]) {
+      case ' ': case '\t': case '\n': case '\r':
+        ++i;
+        break;
+      default:
+        return i;
+    }
+  }
+  return i;
+}
+
+bool JsonIndex::SkipString(size_t* i, ErrorPtr* error) const {
+  // data_[*i] is the opening quote. Most strings are short, so a loop beats
+  // memchr.
+  for (size_t j = *i + 1; j != size_; ++j) {
+    char c = data_[j];
+    if (c == '"') {
+      *i = j + 1;
+      return true;
+    }
+    if (c == '\\' && ++j == size_)
+      break;
+  }
+  return Fail(error, "Unterminated string", *i);
+}
+
+bool JsonIndex::ReadKey(size_t* i, uint32_t* key, uint32_t* key_length,
+                        ErrorPtr* error) const {
+  if (*i == size_ || data_[*i] != '"')
+    return Fail(error, "Expected a key", *i);
+  size_t start = *i;
+  if (!SkipString(i, error))
+    return false;
+  *key = start + 1;
+  *key_length = *i - start - 2;
+  *i = SkipWhitespace(*i);
+  if (*i == size_ || data_[*i] != ':')
+    return Fail(error, "Expected ':'", *i);
+  *i = SkipWhitespace(*i + 1);
+  return true;
+}
+
+void JsonIndex::EndContainer(size_t value, size_t end, size_t depth) {
+  Value& container = values_[value];
+  container.end = end;
+  container.first_child = children_.size();
+  container.num_children = open_children_[depth].size();
+  children_.insert(children_.end(), open_children_[depth].begin(),
+                   open_children_[depth].end());
+}
+
+bool JsonIndex::KeyEquals(const Value& value, const char* key,
+                          size_t length) const {
+  const char* s = data_ + value.key;
+  if (value.key_length == length && memcmp(s, key, length) == 0)
+    return true;
+  if (!memchr(s, '\\', value.key_length))
+    return false;
+  // Compare the key unescaped, quotes included.
+  JsonScanner scanner(s - 1, value.key_length + 2);
+  const char* unescaped;
+  size_t unescaped_length;
+  return scanner.ReadString(&unescaped, &unescaped_length) &&
+         unescaped_length == length &&
+         memcmp(unescaped, key, length) == 0;
+}
+
+bool JsonIndex::Fail(ErrorPtr* error, const char* message,
+                     size_t offset) const {
+  if (error) {
+    char at[32];
+    snprintf(at, sizeof(at), " at offset %d", static_cast<int>(offset));
+    error->reset(new MessageError(std::string(message) + at));
+  }
+  return false;
+}
@@ -0,0 +1,126 @@
+#ifndef JSON_INDEX_H_
+#define JSON_INDEX_H_
+
+#include <stddef.h>
+#include <stdint.h>
+#include <vector>
+#include "error.h"
+#include "json_parser.h"
+
+// A structural index of a JSON document, for the Lazy classes generated with
+// --lazy: the byte range of every value, and the members or elements of
+// every object and array. Building it only looks at quotes, escapes,
+// brackets, commas and colons; scalars and strings are checked when a Lazy
+// class decodes them, so errors in values that are never accessed go
+// unreported.
+//
+// Values are numbered in document order; the document itself is value 0.
+class JsonIndex {
+ public:
+  static const size_t kNone = static_cast<size_t>(-1);
+  // Offsets are 32-bit, to keep the index small.
+  static const size_t kMaxSize = 0xffffffff;
+  // As deep as yajl goes.
+  static const size_t kMaxDepth = 128;
+
+  JsonIndex();
+
+  // Indexes (data, size), which the caller keeps alive, unchanged, for as
+  // long as the index. Returns false and sets |error| if the structure of
+  // the document is invalid.
+  bool Build(const char* data, size_t size, ErrorPtr* error);
+  bool Build(const std::vector<char>& data, ErrorPtr* error);
+
+  size_t root() const { return 0; }
+  size_t num_values() const { return values_.size(); }
+
+  // The bytes of |value|.
+  const char* data(size_t value) const { return data_ + values_[value].begin; }
+  size_t size(size_t value) const {
+    return values_[value].end - values_[value].begin;
+  }
+
+  bool IsObject(size_t value) const { return *data(value) == '{'; }
+  bool IsArray(size_t value) const { return *data(value) == '['; }
+
+  // The number of members of an object or elements of an array; 0 for any
+  // other value.
+  size_t num_children(size_t value) const {
+    return values_[value].num_children;
+  }
+  // The i-th element of an array, or the value of the i-th member of an
+  // object.
+  size_t child(size_t value, size_t i) const {
+    return children_[values_[value].first_child + i];
+  }
+
+  // The value of the member of object |value| whose key is (key, length),
+  // or kNone. Like the decoders, the last of duplicate keys wins.
+  size_t Find(size_t value, const char* key, size_t length) const;
+
+ private:
+  struct Value {
+    uint32_t begin;
+    uint32_t end;
+    // The key of a member, between the quotes, as it is in the input.
+    uint32_t key;
+    uint32_t key_length;
+    uint32_t first_child;
+    uint32_t num_children;
+  };
+
+  size_t SkipWhitespace(size_t i) const;
+  bool SkipString(size_t* i, ErrorPtr* error) const;
+  bool ReadKey(size_t* i, uint32_t* key, uint32_t* key_length,
+               ErrorPtr* error) const;
+  void EndContainer(size_t value, size_t end, size_t depth);
+  bool KeyEquals(const Value& value, const char* key, size_t length) const;
+  bool Fail(ErrorPtr* error, const char* message, size_t offset) const;
+
+  const char* data_;
+  size_t size_;
+  std::vector<Value> values_;
+  std::vector<uint32_t> children_;
+  // The children of the objects and arrays being indexed, one list per
+  // nesting level, moved to children_ when the object or array ends.
+  std::vector<std::vector<uint32_t> > open_children_;
+
+  JsonIndex(const JsonIndex&);
+  JsonIndex& operator =(const JsonIndex&);
+};
+
+// Decodes the member (key, length) of the object |value| of |index| into
+// |data|, with the CB callbacks of its type. Leaves |data| as it is if there
+// is no such member. Returns false and sets |error| if it fails.
+template <typename CB, typename T>
+bool DecodeIndexedMember(const JsonIndex& index, size_t value,
+                         const char* key, size_t length, T* data,
+                         ErrorPtr* error) {
+  size_t member = index.Find(value, key, length);
+  if (member == JsonIndex::kNone)
+    return true;
+  JsonParser p;
+  p.PushCallbacksFor<CB>(data);
+  ErrorPtr member_error;
+  p.DecodeMember(key, length, index.data(member), index.size(member),
+                 &member_error);
+  if (error)
+    *error = member_error;
+  return !member_error;
+}
+
+// Decodes all of |value| into |data|.
+template <typename CB, typename T>
+bool DecodeIndexedValue(const JsonIndex& index, size_t value, T* data,
+                        ErrorPtr* error) {
+  JsonParser p;
+  p.PushCallbacksFor<CB>(data);
+  MemoryReader reader(index.data(value), index.size(value));
+  ErrorPtr value_error;
+  p.Decode(&reader, &value_error);
+  if (error)
+    *error = value_error;
+  return !value_error;
+}
+
+#endif  // JSON_INDEX_H_
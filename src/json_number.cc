@@ -0,0 +1,616 @@
+#include "json_number.h"
+
+#include <float.h>
+#include <string.h>
+#include <limits>
+#include <string>
+#include "json_number_tables.h"
+
+namespace {
+
+// The fast float paths need each operation to be rounded once, to the
+// precision of its type. x87 arithmetic rounds to extended precision first.
+#if defined(__FLT_EVAL_METHOD__) && __FLT_EVAL_METHOD__ == 0
+const bool kExactArithmetic = true;
+#else
+const bool kExactArithmetic = false;
+#endif
+
+// More digits than this may not fit in a uint64_t.
+const int kMaxMantissaDigits = 19;
+
+// Powers of ten that are exact as a double (or float).
+const double kDoublePow10[] = {
+  1e0, 1e1, 1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9, 1e10, 1e11, 1e12, 1e13,
+  1e14, 1e15, 1e16, 1e17, 1e18, 1e19, 1e20, 1e21, 1e22,
+};
+const int kMaxDoublePow10 = 22;
+const float kFloatPow10[] = {
+  1e0f, 1e1f, 1e2f, 1e3f, 1e4f, 1e5f, 1e6f, 1e7f, 1e8f, 1e9f, 1e10f,
+};
+const int kMaxFloatPow10 = 10;
+
+inline bool IsDigit(char c) {
+  return c >= '0' && c <= '9';
+}
+
+// Parses the decimal digits in [s, end), which must not be empty, into *out.
+// Digits after an overflow are still checked, so that trailing garbage is
+// reported as invalid rather than out of range.
+ParseNumberResult ParseDigits(const char* s, const char* end, uint64_t max,
+                              uint64_t* out) {
+  if (s == end)
+    return PARSE_NUMBER_INVALID;
+  uint64_t value = 0;
+  bool overflow = false;
+  for (; s != end; ++s) {
+    if (!IsDigit(*s))
+      return PARSE_NUMBER_INVALID;
+    unsigned digit = *s - '0';
+    if (value > (max - digit) / 10)
+      overflow = true;
+    else
+      value = value * 10 + digit;
+  }
+  if (overflow)
+    return PARSE_NUMBER_OUT_OF_RANGE;
+  *out = value;
+  return PARSE_NUMBER_OK;
+}
+
+// Only '-': like JSON numbers, integers have no leading '+'.
+const char* ParseSign(const char* s, const char* end, bool* negative) {
+  *negative = s != end && *s == '-';
+  return *negative ? s + 1 : s;
+}
+
+template <typename T>
+ParseNumberResult ParseSigned(const char* s, size_t length, T* out) {
+  const char* end = s + length;
+  bool negative;
+  s = ParseSign(s, end, &negative);
+  // The magnitude of the minimum is one more than the maximum.
+  uint64_t max = static_cast<uint64_t>(std::numeric_limits<T>::max()) +
+                 negative;
+  uint64_t value;
+  ParseNumberResult result = ParseDigits(s, end, max, &value);
+  if (result != PARSE_NUMBER_OK)
+    return result;
+  if (negative && value)
+    *out = -static_cast<T>(value - 1) - 1;
+  else
+    *out = static_cast<T>(value);
+  return PARSE_NUMBER_OK;
+}
+
+template <typename T>
+ParseNumberResult ParseUnsigned(const char* s, size_t length, T* out) {
+  const char* end = s + length;
+  bool negative;
+  s = ParseSign(s, end, &negative);
+  uint64_t value;
+  ParseNumberResult result =
+      ParseDigits(s, end, std::numeric_limits<T>::max(), &value);
+  if (result != PARSE_NUMBER_OK)
+    return result;
+  // Unlike strtoul, don't wrap negative values around. "-0" is fine.
+  if (negative && value)
+    return PARSE_NUMBER_OUT_OF_RANGE;
+  *out = static_cast<T>(value);
+  return PARSE_NUMBER_OK;
+}
+
+// A JSON number as mantissa * 10^exponent.
+struct Decimal {
+  uint64_t mantissa;  // The first kMaxMantissaDigits significant digits.
+  int exponent;
+  bool negative;
+  bool truncated;  // Non-zero digits didn't fit in mantissa.
+  int digits;  // Significant digits in mantissa.
+};
+
+void AddDigit(Decimal* d, char c, bool fraction) {
+  unsigned digit = c - '0';
+  if (d->mantissa == 0 && digit == 0) {
+    // A leading zero.
+    if (fraction)
+      --d->exponent;
+  } else if (d->digits < kMaxMantissaDigits) {
+    d->mantissa = d->mantissa * 10 + digit;
+    ++d->digits;
+    if (fraction)
+      --d->exponent;
+  } else {
+    if (digit)
+      d->truncated = true;
+    if (!fraction)
+      ++d->exponent;
+  }
+}
+
+// Returns false unless all of [s, end) is a JSON number.
+bool ScanDecimal(const char* s, const char* end, Decimal* d) {
+  d->mantissa = 0;
+  d->exponent = 0;
+  d->negative = false;
+  d->truncated = false;
+  d->digits = 0;
+
+  if (s != end && *s == '-') {
+    d->negative = true;
+    ++s;
+  }
+  const char* start = s;
+  for (; s != end && IsDigit(*s); ++s)
+    AddDigit(d, *s, false);
+  if (s == start)
+    return false;
+
+  if (s != end && *s == '.') {
+    start = ++s;
+    for (; s != end && IsDigit(*s); ++s)
+      AddDigit(d, *s, true);
+    if (s == start)
+      return false;
+  }
+
+  if (s != end && (*s == 'e' || *s == 'E')) {
+    ++s;
+    bool negative_exponent = false;
+    if (s != end && (*s == '-' || *s == '+')) {
+      negative_exponent = *s == '-';
+      ++s;
+    }
+    start = s;
+    int exponent = 0;
+    for (; s != end && IsDigit(*s); ++s) {
+      // Anything this large is out of range anyway; don't overflow.
+      if (exponent < 100000)
+        exponent = exponent * 10 + (*s - '0');
+    }
+    if (s == start)
+      return false;
+    d->exponent += negative_exponent ? -exponent : exponent;
+  }
+  return s == end;
+}
+
+// Calls |func| (strtod or strtof) on a NUL-terminated copy of (s, length).
+// Only used for numbers the fast paths can't convert exactly.
+template <typename T>
+T SlowParse(const char* s, size_t length, T (*func)(const char*, char**)) {
+  char buffer[64];
+  if (length < sizeof(buffer)) {
+    memcpy(&buffer[0], s, length);
+    buffer[length] = 0;
+    return func(&buffer[0], NULL);
+  }
+  std::string copy(s, length);
+  return func(copy.c_str(), NULL);
+}
+
+}  // namespace
+
+ParseNumberResult ParseInt32(const char* s, size_t length, int32_t* out) {
+  return ParseSigned(s, length, out);
+}
+
+ParseNumberResult ParseUint32(const char* s, size_t length, uint32_t* out) {
+  return ParseUnsigned(s, length, out);
+}
+
+ParseNumberResult ParseInt64(const char* s, size_t length, int64_t* out) {
+  return ParseSigned(s, length, out);
+}
+
+ParseNumberResult ParseUint64(const char* s, size_t length, uint64_t* out) {
+  return ParseUnsigned(s, length, out);
+}
+
+ParseNumberResult ParseFloat(const char* s, size_t length, float* out) {
+  Decimal d;
+  if (!ScanDecimal(s, s + length, &d))
+    return PARSE_NUMBER_INVALID;
+  if (d.mantissa == 0) {
+    *out = d.negative ? -0.0f : 0.0f;
+    return PARSE_NUMBER_OK;
+  }
+
+  float value;
+  if (kExactArithmetic && !d.truncated &&
+      d.mantissa <= (static_cast<uint64_t>(1) << FLT_MANT_DIG) &&
+      d.exponent >= -kMaxFloatPow10 && d.exponent <= kMaxFloatPow10) {
+    // Both operands are exact, so the result is correctly rounded.
+    value = static_cast<float>(d.mantissa);
+    if (d.exponent < 0)
+      value /= kFloatPow10[-d.exponent];
+    else
+      value *= kFloatPow10[d.exponent];
+    if (d.negative)
+      value = -value;
+  } else {
+    value = SlowParse(s, length, &strtof);
+    // The mantissa isn't zero, so zero means the value underflowed. Like
+    // strtof's ERANGE, subnormal results are out of range too.
+    if (value > FLT_MAX || value < -FLT_MAX ||
+        (value < FLT_MIN && value > -FLT_MIN))
+      return PARSE_NUMBER_OUT_OF_RANGE;
+  }
+  *out = value;
+  return PARSE_NUMBER_OK;
+}
+
+ParseNumberResult ParseDouble(const char* s, size_t length, double* out) {
+  Decimal d;
+  if (!ScanDecimal(s, s + length, &d))
+    return PARSE_NUMBER_INVALID;
+  if (d.mantissa == 0) {
+    *out = d.negative ? -0.0 : 0.0;
+    return PARSE_NUMBER_OK;
+  }
+
+  double value;
+  if (kExactArithmetic && !d.truncated &&
+      d.mantissa <= (static_cast<uint64_t>(1) << DBL_MANT_DIG) &&
+      d.exponent >= -kMaxDoublePow10 && d.exponent <= kMaxDoublePow10) {
+    // Both operands are exact, so the result is correctly rounded.
+    value = static_cast<double>(d.mantissa);
+    if (d.exponent < 0)
+      value /= kDoublePow10[-d.exponent];
+    else
+      value *= kDoublePow10[d.exponent];
+    if (d.negative)
+      value = -value;
+  } else {
+    value = SlowParse(s, length, &strtod);
+    // The mantissa isn't zero, so zero means the value underflowed. Like
+    // strtod's ERANGE, subnormal results are out of range too.
+    if (value > DBL_MAX || value < -DBL_MAX ||
+        (value < DBL_MIN && value > -DBL_MIN))
+      return PARSE_NUMBER_OUT_OF_RANGE;
+  }
+  *out = value;
+  return PARSE_NUMBER_OK;
+}
+
+namespace {
+
+const char kDigitPairs[] =
+    "00010203040506070809101112131415161718192021222324252627282930313233343536"
+    "37383940414243444546474849505152535455565758596061626364656667686970717273"
+    "7475767778798081828384858687888990919293949596979899";
+
+// The number of decimal digits of |value|.
+template <typename T>
+inline int DecimalLength(T value) {
+  int length = 1;
+  while (true) {
+    if (value < 10)
+      return length;
+    if (value < 100)
+      return length + 1;
+    if (value < 1000)
+      return length + 2;
+    if (value < 10000)
+      return length + 3;
+    value /= 10000;
+    length += 4;
+  }
+}
+
+// Writes the |length| decimal digits of |value| to |out|, two at a time.
+template <typename T>
+inline void WriteDigits(T value, int length, char* out) {
+  char* p = out + length;
+  while (value >= 100) {
+    unsigned pair = static_cast<unsigned>(value % 100);
+    value /= 100;
+    p -= 2;
+    memcpy(p, &kDigitPairs[pair * 2], 2);
+  }
+  if (value >= 10)
+    memcpy(p - 2, &kDigitPairs[value * 2], 2);
+  else
+    p[-1] = static_cast<char>('0' + value);
+}
+
+template <typename T>
+inline size_t FormatUnsigned(T value, char* out) {
+  int length = DecimalLength(value);
+  WriteDigits(value, length, out);
+  return length;
+}
+
+template <typename T, typename UnsignedT>
+inline size_t FormatSigned(T value, char* out) {
+  if (value >= 0)
+    return FormatUnsigned(static_cast<UnsignedT>(value), out);
+  *out = '-';
+  // Also right for the minimum, whose magnitude T can't hold.
+  UnsignedT magnitude = 0 - static_cast<UnsignedT>(value);
+  return 1 + FormatUnsigned(magnitude, out + 1);
+}
+
+// The shortest formatting is Ryu (Ulf Adams, "Ryu: fast float-to-string
+// conversion", PLDI 2018), with 64-bit decimal mantissas for floats too.
+
+const int kPow5Bits = 125;
+
+// ceil(log2(5^e)), or 1 for e = 0.
+inline int Pow5Bits(int e) {
+  return ((e * 1217359) >> 19) + 1;
+}
+
+// floor(log10(2^e)).
+inline int Log10Pow2(int e) {
+  return (e * 78913) >> 18;
+}
+
+// floor(log10(5^e)).
+inline int Log10Pow5(int e) {
+  return (e * 732923) >> 20;
+}
+
+inline bool IsMultipleOfPow5(uint64_t value, int p) {
+  int count = 0;
+  for (; value % 5 == 0; value /= 5)
+    ++count;
+  return count >= p;
+}
+
+inline bool IsMultipleOfPow2(uint64_t value, int p) {
+  return (value & ((static_cast<uint64_t>(1) << p) - 1)) == 0;
+}
+
+// (m * mul) >> j, where mul is a 125-bit table entry and 64 < j < 128.
+inline uint64_t MulShift(uint64_t m, const uint64_t* mul, int j) {
+#if defined(__SIZEOF_INT128__)
+  typedef unsigned __int128 uint128_t;
+  uint128_t low = static_cast<uint128_t>(m) * mul[0];
+  uint128_t high = static_cast<uint128_t>(m) * mul[1];
+  return static_cast<uint64_t>(((low >> 64) + high) >> (j - 64));
+#else
+  // The 128-bit products from 32-bit halves.
+  uint64_t m_low = m & 0xffffffff;
+  uint64_t m_high = m >> 32;
+  uint64_t products[2][2];
+  for (int i = 0; i < 2; ++i) {
+    uint64_t low = mul[i] & 0xffffffff;
+    uint64_t high = mul[i] >> 32;
+    uint64_t low_low = m_low * low;
+    uint64_t low_high = m_low * high;
+    uint64_t high_low = m_high * low;
+    uint64_t high_high = m_high * high;
+    uint64_t middle = (low_low >> 32) + (low_high & 0xffffffff) +
+                      (high_low & 0xffffffff);
+    products[i][0] = (middle << 32) | (low_low & 0xffffffff);
+    products[i][1] = high_high + (low_high >> 32) + (high_low >> 32) +
+                     (middle >> 32);
+  }
+  uint64_t sum = products[0][1] + products[1][0];
+  uint64_t high = products[1][1] + (sum < products[0][1]);
+  int shift = j - 64;
+  return (high << (64 - shift)) | (sum >> shift);
+#endif
+}
+
+// A finite, non-zero float as mantissa * 10^exponent, with as few digits in
+// mantissa as read back as the same float.
+struct ShortestDecimal {
+  uint64_t mantissa;
+  int exponent;
+};
+
+// The shortest decimal of the IEEE float with the fields |ieee_mantissa| and
+// |ieee_exponent|, and |mantissa_bits| and |bias| for its type.
+ShortestDecimal ToShortestDecimal(uint64_t ieee_mantissa, int ieee_exponent,
+                                  int mantissa_bits, int bias) {
+  // The float is m2 * 2^e2, with 2 more bits for the halfway points to its
+  // neighbours.
+  int e2;
+  uint64_t m2;
+  if (ieee_exponent == 0) {
+    e2 = 1 - bias - mantissa_bits - 2;
+    m2 = ieee_mantissa;
+  } else {
+    e2 = ieee_exponent - bias - mantissa_bits - 2;
+    m2 = (static_cast<uint64_t>(1) << mantissa_bits) | ieee_mantissa;
+  }
+  // Round to even: an even mantissa owns the halfway points.
+  bool accept_bounds = (m2 & 1) == 0;
+
+  // The halfway points are 4 * m2 + 2 and 4 * m2 - 1 - mm_shift; the lower
+  // one is closer at powers of two.
+  uint64_t mv = 4 * m2;
+  int mm_shift = ieee_mantissa != 0 || ieee_exponent <= 1;
+
+  // vm, vr and vp are the halfway points and the float in a power of ten.
+  uint64_t vr, vp, vm;
+  int e10;
+  bool vm_is_trailing_zeros = false;
+  bool vr_is_trailing_zeros = false;
+  if (e2 >= 0) {
+    int q = Log10Pow2(e2) - (e2 > 3);
+    e10 = q;
+    int k = kPow5Bits + Pow5Bits(q) - 1;
+    int i = -e2 + q + k;
+    vr = MulShift(mv, kPow5InvSplit[q], i);
+    vp = MulShift(mv + 2, kPow5InvSplit[q], i);
+    vm = MulShift(mv - 1 - mm_shift, kPow5InvSplit[q], i);
+    if (q <= 21) {
+      // Only one of mv, mv + 2 and mv - 1 - mm_shift can be a multiple of 5.
+      if (mv % 5 == 0)
+        vr_is_trailing_zeros = IsMultipleOfPow5(mv, q);
+      else if (accept_bounds)
+        vm_is_trailing_zeros = IsMultipleOfPow5(mv - 1 - mm_shift, q);
+      else
+        vp -= IsMultipleOfPow5(mv + 2, q);
+    }
+  } else {
+    int q = Log10Pow5(-e2) - (-e2 > 1);
+    e10 = q + e2;
+    int i = -e2 - q;
+    int k = Pow5Bits(i) - kPow5Bits;
+    int j = q - k;
+    vr = MulShift(mv, kPow5Split[i], j);
+    vp = MulShift(mv + 2, kPow5Split[i], j);
+    vm = MulShift(mv - 1 - mm_shift, kPow5Split[i], j);
+    if (q <= 1) {
+      // mv has at least 2 trailing zero bits, and mv - 1 - mm_shift has one
+      // if mm_shift is 1.
+      vr_is_trailing_zeros = true;
+      if (accept_bounds)
+        vm_is_trailing_zeros = mm_shift == 1;
+      else
+        --vp;
+    } else if (q < 63) {
+      vr_is_trailing_zeros = IsMultipleOfPow2(mv, q);
+    }
+  }
+
+  // Remove the digits that vm and vp share, rounding vr.
+  int removed = 0;
+  uint64_t output;
+  if (vm_is_trailing_zeros || vr_is_trailing_zeros) {
+    // The rare general case.
+    int last_removed_digit = 0;
+    while (vp / 10 > vm / 10) {
+      vm_is_trailing_zeros &= vm % 10 == 0;
+      vr_is_trailing_zeros &= last_removed_digit == 0;
+      last_removed_digit = static_cast<int>(vr % 10);
+      vr /= 10;
+      vp /= 10;
+      vm /= 10;
+      ++removed;
+    }
+    if (vm_is_trailing_zeros) {
+      while (vm % 10 == 0) {
+        vr_is_trailing_zeros &= last_removed_digit == 0;
+        last_removed_digit = static_cast<int>(vr % 10);
+        vr /= 10;
+        vp /= 10;
+        vm /= 10;
+        ++removed;
+      }
+    }
+    if (vr_is_trailing_zeros && last_removed_digit == 5 && vr % 2 == 0) {
+      // Exactly halfway: round to even.
+      last_removed_digit = 4;
+    }
+    output = vr + ((vr == vm && (!accept_bounds || !vm_is_trailing_zeros)) ||
+                   last_removed_digit >= 5);
+  } else {
+    bool round_up = false;
+    if (vp / 100 > vm / 100) {
+      // Two digits at a time, most of the time.
+      round_up = vr % 100 >= 50;
+      vr /= 100;
+      vp /= 100;
+      vm /= 100;
+      removed += 2;
+    }
+    while (vp / 10 > vm / 10) {
+      round_up = vr % 10 >= 5;
+      vr /= 10;
+      vp /= 10;
+      vm /= 10;
+      ++removed;
+    }
+    output = vr + (vr == vm || round_up);
+  }
+
+  ShortestDecimal result = { output, e10 + removed };
+  return result;
+}
+
+// Writes mantissa * 10^exponent as FormatDouble describes.
+size_t FormatDecimal(bool negative, uint64_t mantissa, int exponent,
+                     char* out) {
+  char* p = out;
+  if (negative)
+    *p++ = '-';
+  int length = DecimalLength(mantissa);
+  // The value is 0.DIGITS * 10^point.
+  int point = length + exponent;
+  if (point > 21 || point < -5) {
+    // D.IGITSe+X, with the first digit moved before the '.'.
+    WriteDigits(mantissa, length, p + 1);
+    p[0] = p[1];
+    if (length > 1) {
+      p[1] = '.';
+      p += length + 1;
+    } else {
+      p += 1;
+    }
+    *p++ = 'e';
+    int e = point - 1;
+    *p++ = e < 0 ? '-' : '+';
+    p += FormatUnsigned(static_cast<unsigned>(e < 0 ? -e : e), p);
+  } else if (point <= 0) {
+    // 0.000DIGITS
+    *p++ = '0';
+    *p++ = '.';
+    memset(p, '0', -point);
+    p += -point;
+    WriteDigits(mantissa, length, p);
+    p += length;
+  } else if (point < length) {
+    // DIG.ITS
+    WriteDigits(mantissa, length, p + 1);
+    memmove(p, p + 1, point);
+    p[point] = '.';
+    p += length + 1;
+  } else {
+    // DIGITS000.0
+    WriteDigits(mantissa, length, p);
+    p += length;
+    memset(p, '0', point - length);
+    p += point - length;
+    *p++ = '.';
+    *p++ = '0';
+  }
+  return p - out;
+}
+
+}  // namespace
+
+size_t FormatInt32(int32_t value, char* out) {
+  return FormatSigned<int32_t, uint32_t>(value, out);
+}
+
+size_t FormatUint32(uint32_t value, char* out) {
+  return FormatUnsigned(value, out);
+}
+
+size_t FormatInt64(int64_t value, char* out) {
+  return FormatSigned<int64_t, uint64_t>(value, out);
+}
+
+size_t FormatUint64(uint64_t value, char* out) {
+  return FormatUnsigned(value, out);
+}
+
+size_t FormatFloat(float value, char* out) {
+  uint32_t bits;
+  memcpy(&bits, &value, sizeof(bits));
+  bool negative = bits >> 31;
+  uint32_t ieee_mantissa = bits & ((1u << 23) - 1);
+  int ieee_exponent = (bits >> 23) & 0xff;
+  if (ieee_exponent == 0 && ieee_mantissa == 0)
+    return FormatDecimal(negative, 0, 0, out);
+  ShortestDecimal d = ToShortestDecimal(ieee_mantissa, ieee_exponent, 23, 127);
+  return FormatDecimal(negative, d.mantissa, d.exponent, out);
+}
+
+size_t FormatDouble(double value, char* out) {
+  uint64_t bits;
+  memcpy(&bits, &value, sizeof(bits));
+  bool negative = bits >> 63;
+  uint64_t ieee_mantissa = bits & ((static_cast<uint64_t>(1) << 52) - 1);
+  int ieee_exponent = static_cast<int>((bits >> 52) & 0x7ff);
+  if (ieee_exponent == 0 && ieee_mantissa == 0)
+    return FormatDecimal(negative, 0, 0, out);
+  ShortestDecimal d = ToShortestDecimal(ieee_mantissa, ieee_exponent, 52,
+                                        1023);
+  return FormatDecimal(negative, d.mantissa, d.exponent, out);
+}
@@ -0,0 +1,49 @@
+#ifndef JSON_NUMBER_H_
+#define JSON_NUMBER_H_
+
+#include <stdint.h>
+#include <stdlib.h>
+
+// Parsers for the numbers passed to JsonCallbacks::OnNumber, and for the
+// int64/uint64 values that discovery documents send as strings. They read
+// (s, length) in place: no NUL-terminated copy and no errno.
+//
+// Integers are an optional '-' followed by decimal digits. Anything else,
+// including an empty string, is PARSE_NUMBER_INVALID; a negative value for
+// an unsigned type is out of range. Floats use the JSON number grammar.
+
+enum ParseNumberResult {
+  PARSE_NUMBER_OK,
+  PARSE_NUMBER_INVALID,
+  PARSE_NUMBER_OUT_OF_RANGE,
+};
+
+ParseNumberResult ParseInt32(const char* s, size_t length, int32_t* out);
+ParseNumberResult ParseUint32(const char* s, size_t length, uint32_t* out);
+ParseNumberResult ParseInt64(const char* s, size_t length, int64_t* out);
+ParseNumberResult ParseUint64(const char* s, size_t length, uint64_t* out);
+
+// Correctly rounded. Values too large for the type, and non-zero values
+// below its smallest normal value (subnormal or rounded to zero), are out of
+// range.
+ParseNumberResult ParseFloat(const char* s, size_t length, float* out);
+ParseNumberResult ParseDouble(const char* s, size_t length, double* out);
+
+// Formatters for JsonGenerator. Each writes at most kMaxFormattedNumberLength
+// chars to |out|, without a terminating NUL, and returns how many.
+const size_t kMaxFormattedNumberLength = 25;
+
+size_t FormatInt32(int32_t value, char* out);
+size_t FormatUint32(uint32_t value, char* out);
+size_t FormatInt64(int64_t value, char* out);
+size_t FormatUint64(uint64_t value, char* out);
+
+// The shortest decimal that parses back to |value|, which must be finite;
+// the closest one if there are several. Like JavaScript, it is written with
+// an exponent ("1.5e+21", "1e-7") only if it is at least 1e21 or less than
+// 1e-6, and unlike JavaScript, a ".0" is added to integral values ("100.0"),
+// as yajl does.
+size_t FormatFloat(float value, char* out);
+size_t FormatDouble(double value, char* out);
+
+#endif  // JSON_NUMBER_H_
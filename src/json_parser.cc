@@ -1,13 +1,21 @@
 #include "json_parser.h"
 
-JsonParser::JsonParser() {
+JsonParser::JsonParser()
+    : pinned_buffer_(NULL),
+      skip_depth_(0),
+      depth_(0),
+      record_handler_(NULL),
+      in_record_(false),
+      stream_stopped_(false) {
   // NULL => use the default C alloc funcs (malloc, realloc, free).
   handle_ = yajl_alloc(&s_callbacks, NULL, this);
 }
 
 JsonParser::~JsonParser() {
   for (size_t i = 0; i < callbacks_stack_.size(); ++i)
-    delete callbacks_stack_[i];
+    delete callbacks_stack_[i].callbacks;
+  for (size_t i = 0; i < free_callbacks_.size(); ++i)
+    delete free_callbacks_[i].callbacks;
   yajl_free(handle_);
 }
 
@@ -22,6 +30,145 @@ void JsonParser::Decode(Reader* src, ErrorPtr* out_error) {
   Close(out_error);
 }
 
+void JsonParser::Decode(PinnedBuffer* input, ErrorPtr* out_error) {
+  pinned_buffer_ = input;
+  ErrorPtr error;
+  Write(input->data(), input->size(), &error);
+  if (error) {
+    if (out_error)
+      *out_error = error;
+    return;
+  }
+  Close(out_error);
+}
+
+void JsonParser::DecodeMember(const char* key, size_t key_length,
+                              const char* value, size_t value_length,
+                              ErrorPtr* out_error) {
+  ErrorPtr error;
+  depth_ = 1;
+  bool ok = OnStartMap() &&
+            OnMapKey(reinterpret_cast<const unsigned char*>(key), key_length);
+  if (ok) {
+    Write(value, value_length, &error);
+    if (!error)
+      Close(&error);
+    depth_ = 0;
+    ok = !error && OnEndMap();
+  }
+  if (!ok && !error)
+    error = error_ ? error_ : ErrorPtr(new MessageError("Invalid member"));
+  if (out_error)
+    *out_error = error;
+}
+
+// The bottom of the callbacks stack in DecodeStream. A value that reaches it
+// starts a record: the handler pushes the callbacks of the record, and the
+// value is passed on to them. They pop themselves in the OnEndMap that ends
+// the record, which the parser then passes on to here.
+class JsonParser::StreamCallbacks : public JsonCallbacks {
+ public:
+  virtual int OnNull(JsonParser* p, ErrorPtr* error) {
+    p->BeginRecord();
+    return p->OnNull();
+  }
+  virtual int OnBool(JsonParser* p, bool value, ErrorPtr* error) {
+    p->BeginRecord();
+    return p->OnBool(value);
+  }
+  virtual int OnNumber(
+      JsonParser* p, const char* s, size_t length, ErrorPtr* error) {
+    p->BeginRecord();
+    return p->OnNumber(s, length);
+  }
+  virtual int OnString(
+      JsonParser* p, const unsigned char* s, size_t length, ErrorPtr* error) {
+    p->BeginRecord();
+    return p->OnString(s, length);
+  }
+  virtual int OnStartMap(JsonParser* p, ErrorPtr* error) {
+    p->BeginRecord();
+    return p->OnStartMap();
+  }
+  virtual int OnMapKey(
+      JsonParser* p, const unsigned char* s, size_t length, ErrorPtr* error) {
+    error->reset(new MessageError("Unexpected map key"));
+    return 0;
+  }
+  virtual int OnEndMap(JsonParser* p, ErrorPtr* error) {
+    return p->EndRecord(ErrorPtr());
+  }
+  virtual int OnStartArray(JsonParser* p, ErrorPtr* error) {
+    p->BeginRecord();
+    return p->OnStartArray();
+  }
+  virtual int OnEndArray(JsonParser* p, ErrorPtr* error) {
+    error->reset(new MessageError("Unexpected end of array"));
+    return 0;
+  }
+};
+
+void JsonParser::DecodeStream(Reader* src, JsonRecordHandler* handler,
+                              ErrorPtr* out_error) {
+  BeginStream(handler);
+  ErrorPtr error;
+  Copy(this, src, &error);
+  EndStream(error, out_error);
+}
+
+void JsonParser::DecodeStream(PinnedBuffer* input, JsonRecordHandler* handler,
+                              ErrorPtr* out_error) {
+  pinned_buffer_ = input;
+  BeginStream(handler);
+  ErrorPtr error;
+  Write(input->data(), input->size(), &error);
+  EndStream(error, out_error);
+}
+
+void JsonParser::BeginStream(JsonRecordHandler* handler) {
+  yajl_config(handle_, yajl_allow_multiple_values, 1);
+  record_handler_ = handler;
+  stream_stopped_ = false;
+  PushCallbacks(new StreamCallbacks());
+}
+
+void JsonParser::EndStream(ErrorPtr error, ErrorPtr* out_error) {
+  if (!error && !stream_stopped_)
+    Close(&error);
+  // Stopping cancels yajl, which is not an error.
+  if (stream_stopped_)
+    error.reset();
+  if (out_error)
+    *out_error = error;
+  while (PopCallbacks()) {}
+  record_handler_ = NULL;
+}
+
+void JsonParser::BeginRecord() {
+  in_record_ = true;
+  record_handler_->BeginRecord(this);
+}
+
+int JsonParser::EndRecord(const ErrorPtr& error) {
+  in_record_ = false;
+  if (record_handler_->EndRecord(error))
+    return 1;
+  stream_stopped_ = true;
+  return 0;
+}
+
+int JsonParser::FailRecord() {
+  if (!in_record_ || stream_stopped_)
+    return 0;
+  ErrorPtr error;
+  error.swap(error_);
+  // Back to the StreamCallbacks, skipping what is left of the record.
+  while (callbacks_stack_.size() > 1)
+    PopCallbacks();
+  skip_depth_ = depth_ ? depth_ + 1 : 0;
+  return EndRecord(error);
+}
+
 size_t JsonParser::Write(const void* buf, size_t count, ErrorPtr* error) {
   yajl_status status =
       yajl_parse(handle_, static_cast<const unsigned char*>(buf), count);
@@ -45,8 +192,9 @@ void JsonParser::SetErrorFromStatus(ErrorPtr* error, yajl_status status,
       break;
 
     case yajl_status_client_canceled: {
-      const char* msg = error_ ? error_->ToString().c_str() : "";
-      error->reset(new YajlError(handle_, text, length, msg));
+      // Keep the message alive until YajlError has copied it.
+      std::string msg = error_ ? error_->ToString() : "";
+      error->reset(new YajlError(handle_, text, length, msg.c_str()));
       break;
     }
 
@@ -60,58 +208,111 @@ void JsonParser::SetErrorFromStatus(ErrorPtr* error, yajl_status status,
   }
 }
 
+// While skip_depth_ is set, values are counted instead of passed on, until
+// the skipped value is complete.
+#define SKIP_SCALAR() \
+  if (skip_depth_) { \
+    if (skip_depth_ == 1) skip_depth_ = 0; \
+    return 1; \
+  }
+
+#define SKIP_START() \
+  if (skip_depth_) { \
+    ++skip_depth_; \
+    return 1; \
+  }
+
+#define SKIP_END() \
+  if (skip_depth_) { \
+    if (--skip_depth_ == 1) skip_depth_ = 0; \
+    return 1; \
+  }
+
 int JsonParser::OnNull() {
+  SKIP_SCALAR();
   return top_callbacks()->OnNull(this, &error_);
 }
 
 int JsonParser::OnBool(bool value) {
+  SKIP_SCALAR();
   return top_callbacks()->OnBool(this, value, &error_);
 }
 
 int JsonParser::OnNumber(const char* s, size_t length) {
+  SKIP_SCALAR();
   return top_callbacks()->OnNumber(this, s, length, &error_);
 }
 
 int JsonParser::OnString(const unsigned char* s, size_t length) {
+  SKIP_SCALAR();
   return top_callbacks()->OnString(this, s, length, &error_);
 }
 
 int JsonParser::OnStartMap() {
+  SKIP_START();
   return top_callbacks()->OnStartMap(this, &error_);
 }
 
 int JsonParser::OnMapKey(const unsigned char* s, size_t length) {
+  if (skip_depth_)
+    return 1;
   return top_callbacks()->OnMapKey(this, s, length, &error_);
 }
 
 int JsonParser::OnEndMap() {
+  SKIP_END();
   return top_callbacks()->OnEndMap(this, &error_);
 }
 
 int JsonParser::OnStartArray() {
+  SKIP_START();
   return top_callbacks()->OnStartArray(this, &error_);
 }
 
 int JsonParser::OnEndArray() {
+  SKIP_END();
   return top_callbacks()->OnEndArray(this, &error_);
 }
 
+#undef SKIP_SCALAR
+#undef SKIP_START
+#undef SKIP_END
+
 bool JsonParser::HasCallbacks() const {
   return !callbacks_stack_.empty();
 }
 
 void JsonParser::PushCallbacks(JsonCallbacks* callbacks) {
-  callbacks_stack_.push_back(callbacks);
+  callbacks_stack_.push_back(Frame(callbacks, NULL));
 }
 
 bool JsonParser::PopCallbacks() {
   if (callbacks_stack_.empty())
     return false;
-  delete callbacks_stack_.back();
+  // The callbacks may still be running (they pop themselves in OnEndMap), so
+  // keep them alive until they are reused or the parser is destroyed.
+  const Frame& frame = callbacks_stack_.back();
+  if (frame.key)
+    free_callbacks_.push_back(frame);
+  else
+    delete frame.callbacks;
   callbacks_stack_.pop_back();
   return true;
 }
 
+JsonCallbacks* JsonParser::TakeFreeCallbacks(const void* key) {
+  // The free list holds at most one frame per type and nesting level, and
+  // the most recently popped frame is the likeliest match.
+  for (size_t i = free_callbacks_.size(); i > 0; --i) {
+    if (free_callbacks_[i - 1].key == key) {
+      JsonCallbacks* callbacks = free_callbacks_[i - 1].callbacks;
+      free_callbacks_.erase(free_callbacks_.begin() + (i - 1));
+      return callbacks;
+    }
+  }
+  return NULL;
+}
+
 yajl_callbacks JsonParser::s_callbacks = {
   &JsonParser::ThunkOnNull,
   &JsonParser::ThunkOnBool,
@@ -6,6 +6,8 @@
 #include <vector>
 #include "error.h"
 #include "io.h"
+#include "record_callback.h"
+#include "string_view.h"
 #include "yajl/yajl_parse.h"
 
 class JsonParser;
@@ -27,20 +29,73 @@ class JsonCallbacks {
   virtual int OnEndArray(JsonParser* p, ErrorPtr* ptr) = 0;
 };
 
+// The records of JsonParser::DecodeStream.
+class JsonRecordHandler {
+ public:
+  virtual ~JsonRecordHandler() {}
+  // Pushes the callbacks of the next record onto |p|.
+  virtual void BeginRecord(JsonParser* p) = 0;
+  // The record is complete, or failed with |error|. Returns false to stop.
+  virtual bool EndRecord(const ErrorPtr& error) = 0;
+};
+
 class JsonParser : public Writer, public Closer {
  public:
   JsonParser();
   ~JsonParser();
 
   void Decode(Reader* src, ErrorPtr* error);
+  // Parses all of |input| in one go, so that the parser can pass unescaped
+  // strings from it as they are. See pinned_buffer().
+  void Decode(PinnedBuffer* input, ErrorPtr* error);
+
+  // Decodes a stream of concatenated (e.g. newline-delimited) JSON values,
+  // with the one parser, passing each to |handler| as a record. When the
+  // callbacks of a record fail, the rest of it is skipped and the next one
+  // is decoded. Syntax errors end the stream, and are returned in |error|.
+  void DecodeStream(Reader* src, JsonRecordHandler* handler, ErrorPtr* error);
+  void DecodeStream(PinnedBuffer* input, JsonRecordHandler* handler,
+                    ErrorPtr* error);
+
+  // Decodes one member of an object, as if the input were {"key": value}:
+  // |value| is parsed, and the key is passed to the callbacks as it is. See
+  // DecodeIndexedMember in json_index.h.
+  void DecodeMember(const char* key, size_t key_length, const char* value,
+                    size_t value_length, ErrorPtr* error);
 
   virtual size_t Write(const void* buf, size_t count, ErrorPtr* error);
   virtual void Close(ErrorPtr* error);
 
+  // The input of Decode(PinnedBuffer*, ...), or NULL.
+  PinnedBuffer* pinned_buffer() const { return pinned_buffer_; }
+
   bool HasCallbacks() const;
+  // Takes ownership of |callbacks|; they are deleted when popped.
   void PushCallbacks(JsonCallbacks* callbacks);
   bool PopCallbacks();
 
+  // Pushes a CB for |data|, and returns it. Popped CBs are kept and Reset
+  // for the next object of the same type, so nested objects allocate no
+  // callbacks after the first of each type and depth.
+  template <typename CB, typename T>
+  CB* PushCallbacksFor(T* data) {
+    const void* key = CallbacksKey<CB>();
+    JsonCallbacks* callbacks = TakeFreeCallbacks(key);
+    if (callbacks)
+      static_cast<CB*>(callbacks)->Reset(data);
+    else
+      callbacks = new CB(data);
+    callbacks_stack_.push_back(Frame(callbacks, key));
+    return static_cast<CB*>(callbacks);
+  }
+
+  // Skips the next value, e.g. the value of a key that a FieldMask doesn't
+  // select, without calling the callbacks. Returns 1, to continue parsing.
+  int SkipValue() {
+    skip_depth_ = 1;
+    return 1;
+  }
+
   int OnNull();
   int OnBool(bool value);
   int OnNumber(const char* s, size_t length);
@@ -57,35 +112,60 @@ class JsonParser : public Writer, public Closer {
 
   JsonCallbacks* top_callbacks() {
     assert(!callbacks_stack_.empty());
-    return callbacks_stack_.back();
+    return callbacks_stack_.back().callbacks;
+  }
+
+  // A distinct address for each callbacks type.
+  template <typename CB>
+  static const void* CallbacksKey() {
+    static const char key = 0;
+    return &key;
+  }
+
+  JsonCallbacks* TakeFreeCallbacks(const void* key);
+
+  // DecodeStream.
+  class StreamCallbacks;
+  void BeginStream(JsonRecordHandler* handler);
+  void EndStream(ErrorPtr error, ErrorPtr* out_error);
+  void BeginRecord();
+  int EndRecord(const ErrorPtr& error);
+  int FailRecord();
+
+  // What yajl gets from the callbacks: a failure fails only the record in
+  // DecodeStream.
+  int Result(int result) {
+    return result || !record_handler_ ? result : FailRecord();
   }
 
  private:
-#define THUNK0(NAME) \
+  // DEPTH is the change in depth_. The callbacks see the new depth.
+#define THUNK0(NAME, DEPTH) \
   static int Thunk##NAME(void* ctx) { \
     JsonParser* p = static_cast<JsonParser*>(ctx); \
-    return p->NAME(); \
+    p->depth_ += DEPTH; \
+    return p->Result(p->NAME()); \
   }
 #define THUNK1(NAME, T0) \
   static int Thunk##NAME(void* ctx, T0 arg0) { \
     JsonParser* p = static_cast<JsonParser*>(ctx); \
-    return p->NAME(arg0); \
+    return p->Result(p->NAME(arg0)); \
   }
 #define THUNK2(NAME, T0, T1) \
   static int Thunk##NAME(void* ctx, T0 arg0, T1 arg1) { \
     JsonParser* p = static_cast<JsonParser*>(ctx); \
-    return p->NAME(arg0, arg1); \
+    return p->Result(p->NAME(arg0, arg1)); \
   }
 
-  THUNK0(OnNull);
+  THUNK0(OnNull, 0);
   THUNK1(OnBool, int);
   THUNK2(OnNumber, const char*, size_t);
   THUNK2(OnString, const unsigned char*, size_t);
-  THUNK0(OnStartMap);
+  THUNK0(OnStartMap, 1);
   THUNK2(OnMapKey, const unsigned char*, size_t);
-  THUNK0(OnEndMap);
-  THUNK0(OnStartArray);
-  THUNK0(OnEndArray);
+  THUNK0(OnEndMap, -1);
+  THUNK0(OnStartArray, 1);
+  THUNK0(OnEndArray, -1);
 
 #undef THUNK0
 #undef THUNK1
@@ -94,9 +174,64 @@ class JsonParser : public Writer, public Closer {
   static yajl_callbacks s_callbacks;
   yajl_handle handle_;
   ErrorPtr error_;
+  PinnedBuffer* pinned_buffer_;
+  // While skipping a value, 1 + the number of maps and arrays it has open.
+  int skip_depth_;
+  // The number of maps and arrays open in the input.
+  int depth_;
+  // Set during DecodeStream.
+  JsonRecordHandler* record_handler_;
+  bool in_record_;
+  bool stream_stopped_;
+
+ private:
+  struct Frame {
+    Frame(JsonCallbacks* callbacks, const void* key)
+        : callbacks(callbacks), key(key) {}
+    JsonCallbacks* callbacks;
+    const void* key;  // NULL unless pushed by PushCallbacksFor.
+  };
+  std::vector<Frame> callbacks_stack_;
+  // Popped callbacks waiting to be reused by PushCallbacksFor.
+  std::vector<Frame> free_callbacks_;
+};
+
+// Decodes each record of a DecodeStream into a T, with CB callbacks, and
+// passes it to a RecordCallback. Without an arena, one T is reused for all
+// records; with one, each record is a new T allocated from it.
+template <typename CB, typename T>
+class JsonRecordDecoder : public JsonRecordHandler {
+ public:
+  explicit JsonRecordDecoder(RecordCallback<T>* callback, Arena* arena = NULL)
+      : callback_(callback),
+        arena_(arena),
+        index_(0),
+        data_(NULL) {
+  }
+
+  virtual void BeginRecord(JsonParser* p) {
+    if (arena_) {
+      data_ = arena_->New<T>();
+    } else {
+      // Destroy and construct in place: assigning a new T would construct
+      // it, copy it and destroy it.
+      record_.~T();
+      new (&record_) T();
+      data_ = &record_;
+    }
+    p->PushCallbacksFor<CB>(data_);
+  }
+
+  virtual bool EndRecord(const ErrorPtr& error) {
+    return callback_->OnRecord(index_++, data_, error);
+  }
 
  private:
-  std::vector<JsonCallbacks*> callbacks_stack_;
+  RecordCallback<T>* callback_;
+  Arena* arena_;
+  size_t index_;
+  T record_;
+  T* data_;
 };
 
 #endif  // JSON_PARSER_H_
@@ -1,139 +1,308 @@
 #ifndef JSON_PARSER_MACROS_H_
 #define JSON_PARSER_MACROS_H_
 
-#define PUSH_CALLBACK_REF_AND_RETURN(TYPE, CBTYPE, IDENT) \
+#include "base64.h"
+#include "json_number.h"
+
+// MASK is the field mask of the referent, NULL if all of it is selected.
+#define PUSH_CALLBACK_REF_AND_RETURN(TYPE, CBTYPE, IDENT, MASK) \
   IDENT.reset(new TYPE()); \
-  p->PushCallbacks(new CBTYPE(IDENT.get())); \
+  p->PushCallbacksFor<CBTYPE>(IDENT.get())->set_field_mask(MASK); \
   return p->OnStartMap()
 
-#define PUSH_CALLBACK_REF_ARRAY_AND_RETURN(TYPE, CBTYPE, IDENT) \
+#define PUSH_CALLBACK_REF_ARRAY_AND_RETURN(TYPE, CBTYPE, IDENT, MASK) \
   IDENT.push_back(std::tr1::shared_ptr<TYPE>(new TYPE())); \
-  p->PushCallbacks(new CBTYPE(IDENT.back().get())); \
+  p->PushCallbacksFor<CBTYPE>(IDENT.back().get())->set_field_mask(MASK); \
+  return p->OnStartMap()
+
+// With --arena, the decoded object is allocated from the current arena.
+#define PUSH_CALLBACK_ARENA_REF_AND_RETURN(TYPE, CBTYPE, IDENT, MASK) \
+  IDENT = Arena::current()->New<TYPE>(); \
+  p->PushCallbacksFor<CBTYPE>(IDENT)->set_field_mask(MASK); \
+  return p->OnStartMap()
+
+#define PUSH_CALLBACK_ARENA_REF_ARRAY_AND_RETURN(TYPE, CBTYPE, IDENT, MASK) \
+  IDENT.push_back(Arena::current()->New<TYPE>()); \
+  p->PushCallbacksFor<CBTYPE>(IDENT.back())->set_field_mask(MASK); \
   return p->OnStartMap()
 
 #define APPEND_BOOL_AND_RETURN(IDENT) \
   IDENT.push_back(value); \
   return 1
 
+// The SET_* macros without _AND_RETURN only assign the value, returning 0 if
+// it can't be converted; with --presence, its bit is set after them.
+#define SET_BOOL(IDENT) \
+  IDENT = value
+
 #define SET_BOOL_AND_RETURN(IDENT, STATE) \
-  IDENT = value; \
+  SET_BOOL(IDENT); \
   state_ = STATE; \
   return 1
 
-#define CONVERT_AND_CHECK_INT(TYPE, FUNC, FUNC_TYPE) \
-  errno = 0; \
-  FUNC_TYPE value = FUNC(&buffer[0], &endptr, 10); \
-  if (endptr - &buffer[0] != length) { \
-    if (error) error->reset(new MessageError("Unexpected characters at end of integer")); \
-    return 0; \
-  } else if (errno == ERANGE || \
-      value < std::numeric_limits<TYPE>::min() || \
-      value > std::numeric_limits<TYPE>::max()) { \
-    if (error) error->reset(new MessageError("Integer value out of range")); \
+#define CHECK_PARSE_NUMBER(RESULT, NAME, CAP_NAME) \
+  if (RESULT != PARSE_NUMBER_OK) { \
+    if (error) error->reset(new MessageError( \
+        RESULT == PARSE_NUMBER_OUT_OF_RANGE ? \
+            CAP_NAME " value out of range" : \
+            "Unexpected characters at end of " NAME)); \
     return 0; \
   }
 
-#define APPEND_INT_AND_RETURN(TYPE, IDENT, FUNC, FUNC_TYPE) { \
-  CONVERT_AND_CHECK_INT(TYPE, FUNC, FUNC_TYPE) \
-  IDENT.push_back(static_cast<TYPE>(value)); } \
+// Parses (s, length) in place; s is the argument of OnNumber or OnString.
+#define PARSE_NUMBER(TYPE, FUNC, NAME, CAP_NAME) \
+  TYPE value; \
+  ParseNumberResult result = \
+      FUNC(reinterpret_cast<const char*>(s), length, &value); \
+  CHECK_PARSE_NUMBER(result, NAME, CAP_NAME)
+
+#define APPEND_NUMBER_AND_RETURN(TYPE, IDENT, FUNC, NAME, CAP_NAME) { \
+  PARSE_NUMBER(TYPE, FUNC, NAME, CAP_NAME) \
+  IDENT.push_back(value); } \
+  return 1
+
+#define SET_NUMBER(TYPE, IDENT, FUNC, NAME, CAP_NAME) { \
+  PARSE_NUMBER(TYPE, FUNC, NAME, CAP_NAME) \
+  IDENT = value; }
+
+#define SET_NUMBER_AND_RETURN(TYPE, IDENT, FUNC, NAME, CAP_NAME, STATE) \
+  SET_NUMBER(TYPE, IDENT, FUNC, NAME, CAP_NAME) \
+  state_ = STATE; \
   return 1
 
 #define APPEND_INT32_AND_RETURN(IDENT) \
-  APPEND_INT_AND_RETURN(int32_t, IDENT, strtol, long int)
+  APPEND_NUMBER_AND_RETURN(int32_t, IDENT, ParseInt32, "integer", "Integer")
 
 #define APPEND_UINT32_AND_RETURN(IDENT) \
-  APPEND_INT_AND_RETURN(uint32_t, IDENT, strtoul, unsigned long int)
+  APPEND_NUMBER_AND_RETURN(uint32_t, IDENT, ParseUint32, "integer", "Integer")
 
 #define APPEND_INT64_AND_RETURN(IDENT) \
-  APPEND_INT_AND_RETURN(int64_t, IDENT, strtoll, long long int)
+  APPEND_NUMBER_AND_RETURN(int64_t, IDENT, ParseInt64, "integer", "Integer")
 
 #define APPEND_UINT64_AND_RETURN(IDENT) \
-  APPEND_INT_AND_RETURN(uint64_t, IDENT, strtoull, unsigned long long int)
+  APPEND_NUMBER_AND_RETURN(uint64_t, IDENT, ParseUint64, "integer", "Integer")
 
-#define SET_INT_AND_RETURN(TYPE, IDENT, FUNC, FUNC_TYPE, STATE) { \
-  CONVERT_AND_CHECK_INT(TYPE, FUNC, FUNC_TYPE) \
-  IDENT = static_cast<TYPE>(value); } \
-  state_ = STATE; \
-  return 1
+#define SET_INT32(IDENT) \
+  SET_NUMBER(int32_t, IDENT, ParseInt32, "integer", "Integer")
+
+#define SET_UINT32(IDENT) \
+  SET_NUMBER(uint32_t, IDENT, ParseUint32, "integer", "Integer")
+
+#define SET_INT64(IDENT) \
+  SET_NUMBER(int64_t, IDENT, ParseInt64, "integer", "Integer")
+
+#define SET_UINT64(IDENT) \
+  SET_NUMBER(uint64_t, IDENT, ParseUint64, "integer", "Integer")
 
 #define SET_INT32_AND_RETURN(IDENT, STATE) \
-  SET_INT_AND_RETURN(int32_t, IDENT, strtol, long int, STATE)
+  SET_NUMBER_AND_RETURN(int32_t, IDENT, ParseInt32, "integer", "Integer", STATE)
 
 #define SET_UINT32_AND_RETURN(IDENT, STATE) \
-  SET_INT_AND_RETURN(uint32_t, IDENT, strtoul, unsigned long int, STATE)
+  SET_NUMBER_AND_RETURN(uint32_t, IDENT, ParseUint32, "integer", "Integer", \
+                        STATE)
 
 #define SET_INT64_AND_RETURN(IDENT, STATE) \
-  SET_INT_AND_RETURN(int64_t, IDENT, strtoll, long long int, STATE)
+  SET_NUMBER_AND_RETURN(int64_t, IDENT, ParseInt64, "integer", "Integer", STATE)
 
 #define SET_UINT64_AND_RETURN(IDENT, STATE) \
-  SET_INT_AND_RETURN(uint64_t, IDENT, strtoull, unsigned long long int, STATE)
-
-#define CONVERT_AND_CHECK_FP(TYPE, FUNC) \
-  errno = 0; \
-  TYPE value = FUNC(&buffer[0], &endptr); \
-  if (endptr - &buffer[0] != length) { \
-    if (error) error->reset(new MessageError("Unexpected characters at end of float")); \
-    return 0; \
-  } else if (errno == ERANGE) { \
-    if (error) error->reset(new MessageError("Float value out of range")); \
-    return 0; \
-  }
-
-#define APPEND_FP_AND_RETURN(TYPE, IDENT, FUNC) { \
-  CONVERT_AND_CHECK_FP(TYPE, FUNC) \
-  IDENT.push_back(value); } \
-  return 1
+  SET_NUMBER_AND_RETURN(uint64_t, IDENT, ParseUint64, "integer", "Integer", \
+                        STATE)
 
 #define APPEND_FLOAT_AND_RETURN(IDENT) \
-  APPEND_FP_AND_RETURN(float, IDENT, strtof)
+  APPEND_NUMBER_AND_RETURN(float, IDENT, ParseFloat, "float", "Float")
 
 #define APPEND_DOUBLE_AND_RETURN(IDENT) \
-  APPEND_FP_AND_RETURN(double, IDENT, strtod)
+  APPEND_NUMBER_AND_RETURN(double, IDENT, ParseDouble, "float", "Float")
 
-#define SET_FP_AND_RETURN(TYPE, IDENT, FUNC, STATE) { \
-  CONVERT_AND_CHECK_FP(TYPE, FUNC) \
-  IDENT = value; } \
-  state_ = STATE; \
-  return 1
+#define SET_FLOAT(IDENT) \
+  SET_NUMBER(float, IDENT, ParseFloat, "float", "Float")
+
+#define SET_DOUBLE(IDENT) \
+  SET_NUMBER(double, IDENT, ParseDouble, "float", "Float")
 
 #define SET_FLOAT_AND_RETURN(IDENT, STATE) \
-  SET_FP_AND_RETURN(float, IDENT, strtof, STATE)
+  SET_NUMBER_AND_RETURN(float, IDENT, ParseFloat, "float", "Float", STATE)
 
 #define SET_DOUBLE_AND_RETURN(IDENT, STATE) \
-  SET_FP_AND_RETURN(double, IDENT, strtod, STATE)
+  SET_NUMBER_AND_RETURN(double, IDENT, ParseDouble, "float", "Float", STATE)
 
+// Assigned in place, so it works for any string type, e.g. ArenaString.
 #define APPEND_STRING_AND_RETURN(IDENT) \
-  IDENT.push_back( \
-      std::string(reinterpret_cast<const char*>(s), length)); \
+  IDENT.resize(IDENT.size() + 1); \
+  IDENT.back().assign(reinterpret_cast<const char*>(s), length); \
   return 1
 
+#define SET_STRING(IDENT) \
+  IDENT.assign(reinterpret_cast<const char*>(s), length)
+
 #define SET_STRING_AND_RETURN(IDENT, STATE) \
-  IDENT.assign(reinterpret_cast<const char*>(s), length); \
+  SET_STRING(IDENT); \
+  state_ = STATE; \
+  return 1
+
+// With --string-views, see PinnedBuffer::View.
+#define APPEND_STRING_VIEW_AND_RETURN(IDENT) \
+  IDENT.push_back(p->pinned_buffer()->View( \
+      reinterpret_cast<const char*>(s), length)); \
+  return 1
+
+#define SET_STRING_VIEW(IDENT) \
+  IDENT = p->pinned_buffer()->View(reinterpret_cast<const char*>(s), length)
+
+#define SET_STRING_VIEW_AND_RETURN(IDENT, STATE) \
+  SET_STRING_VIEW(IDENT); \
   state_ = STATE; \
   return 1
 
+// ('string', 'byte') fields are base64, decoded straight into the vector.
+#define DECODE_BASE64(IDENT) \
+  if (!Base64DecodeTo(reinterpret_cast<const char*>(s), length, &IDENT)) { \
+    if (error) error->reset(new MessageError("Invalid base64")); \
+    return 0; \
+  }
+
+#define APPEND_BYTES_AND_RETURN(IDENT) \
+  IDENT.resize(IDENT.size() + 1); \
+  DECODE_BASE64(IDENT.back()) \
+  return 1
+
+#define SET_BYTES(IDENT) \
+  DECODE_BASE64(IDENT)
+
+#define SET_BYTES_AND_RETURN(IDENT, STATE) \
+  SET_BYTES(IDENT) \
+  state_ = STATE; \
+  return 1
+
+// Run on every key of an object D + 1 schemas deep. If the object has a field
+// mask (masks_[D]) that does not select the key, its value is skipped;
+// otherwise masks_[D + 1] becomes the field mask of the value.
+#define CHECK_FIELD_MASK(D) \
+  if (!masks_[D]) { \
+    masks_[D + 1] = NULL; \
+  } else if (!masks_[D]->Select(reinterpret_cast<const char*>(s), length, \
+                                &masks_[D + 1])) { \
+    return p->SkipValue(); \
+  }
+
 #define CHECK_MAP_KEY(NAME, LEN, STATE) \
   if (length == LEN && \
       strncmp(reinterpret_cast<const char*>(s), NAME, length) == 0) { \
     state_ = STATE; \
     return 1; }
 
+// Only used after switching on the key length, so LEN == length.
+#define MATCH_MAP_KEY(NAME, LEN, STATE) \
+  if (memcmp(s, NAME, LEN) == 0) { \
+    state_ = STATE; \
+    return 1; }
+
 #define MAP_KEY_ADDL_PROPS(IDENT, TYPE, ITER, STATE) { \
   const char* ss = reinterpret_cast<const char*>(s); \
-  std::string key(ss, ss + length); \
+  TYPE::key_type key(ss, ss + length); \
   ITER = IDENT.insert(TYPE::value_type(key, TYPE::mapped_type())).first; \
   state_ = STATE; \
   return 1; }
 
 
+// Direct decoding (--decoder direct): read the next value into IDENT with
+// the JsonScanner* scanner, or return false.
+
+#define DIRECT_READ_NUMBER(TYPE, IDENT, READ, FUNC, NAME, CAP_NAME) { \
+  const char* text; \
+  size_t text_length; \
+  if (!scanner->READ(&text, &text_length)) return false; \
+  TYPE value; \
+  ParseNumberResult result = FUNC(text, text_length, &value); \
+  if (result != PARSE_NUMBER_OK) \
+    return scanner->Fail(result == PARSE_NUMBER_OUT_OF_RANGE ? \
+                         CAP_NAME " value out of range" : \
+                         "Unexpected characters at end of " NAME); \
+  IDENT = value; }
+
+#define DIRECT_READ_INT32(IDENT) \
+  DIRECT_READ_NUMBER(int32_t, IDENT, ReadNumber, ParseInt32, "integer", \
+                     "Integer")
+
+#define DIRECT_READ_UINT32(IDENT) \
+  DIRECT_READ_NUMBER(uint32_t, IDENT, ReadNumber, ParseUint32, "integer", \
+                     "Integer")
+
+// 64-bit integers are strings in JSON.
+#define DIRECT_READ_INT64(IDENT) \
+  DIRECT_READ_NUMBER(int64_t, IDENT, ReadString, ParseInt64, "integer", \
+                     "Integer")
+
+#define DIRECT_READ_UINT64(IDENT) \
+  DIRECT_READ_NUMBER(uint64_t, IDENT, ReadString, ParseUint64, "integer", \
+                     "Integer")
+
+#define DIRECT_READ_FLOAT(IDENT) \
+  DIRECT_READ_NUMBER(float, IDENT, ReadNumber, ParseFloat, "float", "Float")
+
+#define DIRECT_READ_DOUBLE(IDENT) \
+  DIRECT_READ_NUMBER(double, IDENT, ReadNumber, ParseDouble, "float", "Float")
+
+#define DIRECT_READ_BOOL(IDENT) { \
+  bool value; \
+  if (!scanner->ReadBool(&value)) return false; \
+  IDENT = value; }
+
+#define DIRECT_READ_STRING(IDENT) { \
+  const char* text; \
+  size_t text_length; \
+  if (!scanner->ReadString(&text, &text_length)) return false; \
+  IDENT.assign(text, text_length); }
+
+#define DIRECT_READ_BYTES(IDENT) { \
+  const char* text; \
+  size_t text_length; \
+  if (!scanner->ReadString(&text, &text_length)) return false; \
+  if (!Base64DecodeTo(text, text_length, &IDENT)) \
+    return scanner->Fail("Invalid base64"); }
+
+#define DIRECT_READ_STRING_VIEW(IDENT) { \
+  const char* text; \
+  size_t text_length; \
+  if (!scanner->ReadString(&text, &text_length)) return false; \
+  IDENT = scanner->pinned_buffer()->View(text, text_length); }
+
+#define DIRECT_READ_OBJECT(IDENT) \
+  if (!ParseObject(scanner, &IDENT)) return false
+
+#define DIRECT_READ_REF(TYPE, IDENT) \
+  IDENT.reset(new TYPE()); \
+  if (!ParseObject(scanner, IDENT.get())) return false
+
+#define DIRECT_READ_ARENA_REF(TYPE, IDENT) \
+  IDENT = Arena::current()->New<TYPE>(); \
+  if (!ParseObject(scanner, IDENT)) return false
+
+
 // Encoding
 
 #define CHECK_GEN(NAME) if (!g->Gen##NAME(error)) return false
 #define CHECK_GEN1(NAME, ARG) if (!g->Gen##NAME(ARG, error)) return false
 #define CHECK_GEN_KEY(KEY, LEN) if (!g->GenString(KEY, LEN, error)) return false
+#define CHECK_GEN_KEY_LITERAL(KEY, LEN) if (!g->GenKeyLiteral(KEY, LEN, error)) return false
 #define CHECK_GEN_STRING(ARG) if (!g->GenString(ARG.data(), ARG.size(), error)) return false
+#define CHECK_GEN_BYTES(ARG) if (!g->GenBase64(ARG.empty() ? NULL : &ARG[0], ARG.size(), error)) return false
 #define CHECK_ENCODE(ARG) if (!Encode(g, ARG, error)) return false
 #define GEN_FOREACH(IX, ARRAY) for (size_t IX = 0; IX < ARRAY.size(); ++IX)
 #define GEN_FOREACH_ITER(IX, VAR, TYPE) for (TYPE::const_iterator IX = VAR.begin(); IX != VAR.end(); ++IX)
 
+
+// Sizing what Encode generates. Members and elements count the ',' before
+// them; SIZE_END counts the brackets, less the first member's ','.
+
+#define SIZE_START(START) const size_t START = size
+#define SIZE_END(START) size += size == START ? 2 : 1
+#define SIZE_ELEMENT ++size
+#define SIZE1(NAME, ARG) size += Encoded##NAME##Size(ARG)
+#define SIZE_KEY(KEY, LEN) size += 2 + EncodedStringSize(KEY, LEN, options)
+#define SIZE_KEY_LITERAL(KEY, LEN) size += 1 + LEN
+#define SIZE_STRING(ARG) size += EncodedStringSize(ARG.data(), ARG.size(), options)
+#define SIZE_BYTES(ARG) size += EncodedBase64Size(ARG.empty() ? NULL : &ARG[0], ARG.size(), options)
+#define SIZE_ENCODE(ARG) size += EncodedSize(ARG, options)
+
 #endif  // JSON_PARSER_MACROS_H_
@@ -0,0 +1,403 @@
+#include "json_scanner.h"
+
+#include <stdio.h>
+#include <string.h>
+
+namespace {
+
+bool IsDigit(char c) {
+  return c >= '0' && c <= '9';
+}
+
+bool MatchLiteral(const char* p, const char* end, const char* literal,
+                  size_t length) {
+  return static_cast<size_t>(end - p) >= length &&
+         memcmp(p, literal, length) == 0;
+}
+
+int HexValue(char c) {
+  if (c >= '0' && c <= '9') return c - '0';
+  if (c >= 'a' && c <= 'f') return c - 'a' + 10;
+  if (c >= 'A' && c <= 'F') return c - 'A' + 10;
+  return -1;
+}
+
+void AppendUtf8(std::string* s, unsigned long code_point) {
+  if (code_point < 0x80) {
+    *s += static_cast<char>(code_point);
+  } else if (code_point < 0x800) {
+    *s += static_cast<char>(0xc0 | (code_point >> 6));
+    *s += static_cast<char>(0x80 | (code_point & 0x3f));
+  } else if (code_point < 0x10000) {
+    *s += static_cast<char>(0xe0 | (code_point >> 12));
+    *s += static_cast<char>(0x80 | ((code_point >> 6) & 0x3f));
+    *s += static_cast<char>(0x80 | (code_point & 0x3f));
+  } else {
+    *s += static_cast<char>(0xf0 | (code_point >> 18));
+    *s += static_cast<char>(0x80 | ((code_point >> 12) & 0x3f));
+    *s += static_cast<char>(0x80 | ((code_point >> 6) & 0x3f));
+    *s += static_cast<char>(0x80 | (code_point & 0x3f));
+  }
+}
+
+}  // namespace
+
+JsonScanner::JsonScanner(const char* data, size_t size)
+    : begin_(data),
+      p_(data),
+      end_(data + size),
+      pinned_buffer_(NULL),
+      depth_(0) {
+}
+
+JsonScanner::JsonScanner(const std::vector<char>& data)
+    : begin_(data.empty() ? NULL : &data[0]),
+      p_(begin_),
+      end_(begin_ + data.size()),
+      pinned_buffer_(NULL),
+      depth_(0) {
+}
+
+JsonScanner::JsonScanner(PinnedBuffer* input)
+    : begin_(input->data()),
+      p_(begin_),
+      end_(begin_ + input->size()),
+      pinned_buffer_(input),
+      depth_(0) {
+}
+
+bool JsonScanner::StartObject() {
+  if (!SkipWhitespace() || *p_ != '{')
+    return Unexpected();
+  ++p_;
+  return Push();
+}
+
+bool JsonScanner::EndObject() {
+  return SkipWhitespace() && *p_ == '}' && Pop();
+}
+
+bool JsonScanner::NextMember() {
+  if (failed())
+    return false;
+  if (SkipWhitespace()) {
+    if (*p_ == ',') {
+      ++p_;
+      return true;
+    }
+    if (*p_ == '}')
+      return !Pop();
+  }
+  return Fail("Expected ',' or '}'");
+}
+
+bool JsonScanner::ReadKey(const char** s, size_t* length) {
+  if (!SkipWhitespace() || *p_ != '"')
+    return Fail("Expected a key");
+  return ReadString(s, length) &&
+         (Consume(':') || Fail("Expected ':'"));
+}
+
+bool JsonScanner::StartArray() {
+  if (!SkipWhitespace() || *p_ != '[')
+    return Unexpected();
+  ++p_;
+  return Push();
+}
+
+bool JsonScanner::EndArray() {
+  return SkipWhitespace() && *p_ == ']' && Pop();
+}
+
+bool JsonScanner::NextElement() {
+  if (failed())
+    return false;
+  if (SkipWhitespace()) {
+    if (*p_ == ',') {
+      ++p_;
+      return true;
+    }
+    if (*p_ == ']')
+      return !Pop();
+  }
+  return Fail("Expected ',' or ']'");
+}
+
+bool JsonScanner::ReadString(const char** s, size_t* length) {
+  if (!SkipWhitespace() || *p_ != '"')
+    return Unexpected();
+  const char* start = ++p_;
+  // Most strings have no escapes; those are passed as they are.
+  while (p_ != end_) {
+    unsigned char c = *p_;
+    if (c == '"') {
+      *s = start;
+      *length = p_ - start;
+      ++p_;
+      return true;
+    }
+    if (c == '\\')
+      return ReadEscapedString(start, s, length);
+    if (c < 0x20)
+      return Fail("Invalid character in string");
+    if (c >= 0x80) {
+      if (!SkipUtf8())
+        return false;
+    } else {
+      ++p_;
+    }
+  }
+  return Fail("Unterminated string");
+}
+
+bool JsonScanner::ReadEscapedString(const char* start, const char** s,
+                                    size_t* length) {
+  scratch_.assign(start, p_);
+  while (p_ != end_) {
+    unsigned char c = *p_;
+    if (c == '"') {
+      *s = scratch_.data();
+      *length = scratch_.size();
+      ++p_;
+      return true;
+    }
+    if (c == '\\') {
+      if (++p_ == end_)
+        break;
+      switch (*p_++) {
+        case '"': scratch_ += '"'; break;
+        case '\\': scratch_ += '\\'; break;
+        case '/': scratch_ += '/'; break;
+        case 'b': scratch_ += '\b'; break;
+        case 'f': scratch_ += '\f'; break;
+        case 'n': scratch_ += '\n'; break;
+        case 'r': scratch_ += '\r'; break;
+        case 't': scratch_ += '\t'; break;
+        case 'u': {
+          unsigned long code_point;
+          if (!ReadUnicodeEscape(&code_point))
+            return false;
+          AppendUtf8(&scratch_, code_point);
+          break;
+        }
+        default:
+          --p_;
+          return Fail("Invalid escape in string");
+      }
+    } else if (c < 0x20) {
+      return Fail("Invalid character in string");
+    } else if (c >= 0x80) {
+      const char* sequence = p_;
+      if (!SkipUtf8())
+        return false;
+      scratch_.append(sequence, p_);
+    } else {
+      scratch_ += static_cast<char>(c);
+      ++p_;
+    }
+  }
+  return Fail("Unterminated string");
+}
+
+bool JsonScanner::ReadUnicodeEscape(unsigned long* code_point) {
+  // p_ is after "\u".
+  unsigned long value = 0;
+  for (int i = 0; i < 4; ++i) {
+    int digit = p_ != end_ ? HexValue(*p_) : -1;
+    if (digit < 0)
+      return Fail("Invalid \\u escape in string");
+    value = value << 4 | digit;
+    ++p_;
+  }
+  if (value >= 0xd800 && value < 0xdc00) {
+    // A high surrogate, which should be followed by a low one.
+    const char* low = p_;
+    unsigned long low_value = 0;
+    if (end_ - low >= 6 && low[0] == '\\' && low[1] == 'u') {
+      for (int i = 2; i < 6; ++i) {
+        int digit = HexValue(low[i]);
+        if (digit < 0)
+          break;
+        low_value = low_value << 4 | digit;
+        if (i == 5 && low_value >= 0xdc00 && low_value < 0xe000) {
+          p_ = low + 6;
+          *code_point =
+              0x10000 + ((value - 0xd800) << 10) + (low_value - 0xdc00);
+          return true;
+        }
+      }
+    }
+    // Like yajl, an unpaired surrogate becomes '?'.
+    value = '?';
+  } else if (value >= 0xdc00 && value < 0xe000) {
+    value = '?';
+  }
+  *code_point = value;
+  return true;
+}
+
+bool JsonScanner::SkipUtf8() {
+  // p_ is at a byte >= 0x80. Checks one UTF-8 sequence, as yajl does.
+  unsigned char c = *p_;
+  int length;
+  unsigned char min_second = 0x80, max_second = 0xbf;
+  if (c >= 0xc2 && c <= 0xdf) {
+    length = 2;
+  } else if (c >= 0xe0 && c <= 0xef) {
+    length = 3;
+    if (c == 0xe0) min_second = 0xa0;  // Overlong.
+    if (c == 0xed) max_second = 0x9f;  // Surrogates.
+  } else if (c >= 0xf0 && c <= 0xf4) {
+    length = 4;
+    if (c == 0xf0) min_second = 0x90;  // Overlong.
+    if (c == 0xf4) max_second = 0x8f;  // Beyond U+10FFFF.
+  } else {
+    return Fail("Invalid UTF-8 in string");
+  }
+  if (end_ - p_ < length)
+    return Fail("Invalid UTF-8 in string");
+  unsigned char second = p_[1];
+  if (second < min_second || second > max_second)
+    return Fail("Invalid UTF-8 in string");
+  for (int i = 2; i < length; ++i) {
+    if ((static_cast<unsigned char>(p_[i]) & 0xc0) != 0x80)
+      return Fail("Invalid UTF-8 in string");
+  }
+  p_ += length;
+  return true;
+}
+
+bool JsonScanner::ReadNumber(const char** s, size_t* length) {
+  if (!SkipWhitespace() || (*p_ != '-' && !IsDigit(*p_)))
+    return Unexpected();
+  // -?(0|[1-9][0-9]*)(\.[0-9]+)?([eE][+-]?[0-9]+)?
+  const char* start = p_;
+  if (*p_ == '-')
+    ++p_;
+  if (p_ == end_ || !IsDigit(*p_))
+    return Fail("Invalid number");
+  if (*p_ == '0') {
+    ++p_;
+  } else {
+    while (p_ != end_ && IsDigit(*p_))
+      ++p_;
+  }
+  if (p_ != end_ && *p_ == '.') {
+    ++p_;
+    if (p_ == end_ || !IsDigit(*p_))
+      return Fail("Invalid number");
+    while (p_ != end_ && IsDigit(*p_))
+      ++p_;
+  }
+  if (p_ != end_ && (*p_ == 'e' || *p_ == 'E')) {
+    ++p_;
+    if (p_ != end_ && (*p_ == '+' || *p_ == '-'))
+      ++p_;
+    if (p_ == end_ || !IsDigit(*p_))
+      return Fail("Invalid number");
+    while (p_ != end_ && IsDigit(*p_))
+      ++p_;
+  }
+  *s = start;
+  *length = p_ - start;
+  return true;
+}
+
+bool JsonScanner::ReadBool(bool* value) {
+  if (!SkipWhitespace())
+    return Unexpected();
+  if (MatchLiteral(p_, end_, "true", 4)) {
+    *value = true;
+    p_ += 4;
+    return true;
+  }
+  if (MatchLiteral(p_, end_, "false", 5)) {
+    *value = false;
+    p_ += 5;
+    return true;
+  }
+  return Unexpected();
+}
+
+bool JsonScanner::Finish() {
+  if (failed())
+    return false;
+  if (SkipWhitespace())
+    return Fail("Trailing garbage");
+  return true;
+}
+
+bool JsonScanner::Fail(const char* message) {
+  // Keep the first error; the rest follow from it.
+  if (!failed()) {
+    char offset[32];
+    snprintf(offset, sizeof(offset), " at offset %d",
+             static_cast<int>(p_ - begin_));
+    error_.reset(new MessageError(std::string(message) + offset));
+  }
+  return false;
+}
+
+bool JsonScanner::SkipWhitespace() {
+  while (p_ != end_) {
+    switch (*p_) {
+      case ' ': case '\t': case '\n': case '\r':
+        ++p_;
+        break;
+      default:
+        return true;
+    }
+  }
+  return false;
+}
+
+bool JsonScanner::Consume(char c) {
+  if (!SkipWhitespace() || *p_ != c)
+    return false;
+  ++p_;
+  return true;
+}
+
+bool JsonScanner::Unexpected() {
+  // Whitespace is skipped, so p_ is at the start of the value.
+  if (p_ == end_)
+    return Fail("Unexpected end of input");
+  switch (*p_) {
+    case '"':
+      return Fail("Unexpected string");
+    case '{':
+      return Fail("Unexpected map");
+    case '[':
+      return Fail("Unexpected array");
+    case 't':
+      if (MatchLiteral(p_, end_, "true", 4))
+        return Fail("Unexpected bool");
+      break;
+    case 'f':
+      if (MatchLiteral(p_, end_, "false", 5))
+        return Fail("Unexpected bool");
+      break;
+    case 'n':
+      if (MatchLiteral(p_, end_, "null", 4))
+        return Fail("Unexpected null");
+      break;
+    default:
+      if (*p_ == '-' || IsDigit(*p_))
+        return Fail("Unexpected number");
+      break;
+  }
+  return Fail("Invalid value");
+}
+
+bool JsonScanner::Push() {
+  if (++depth_ > kMaxDepth)
+    return Fail("Too deeply nested");
+  return true;
+}
+
+bool JsonScanner::Pop() {
+  // p_ is at the '}' or ']' that ends the innermost object or array.
+  ++p_;
+  --depth_;
+  return true;
+}
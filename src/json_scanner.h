@@ -0,0 +1,86 @@
+#ifndef JSON_SCANNER_H_
+#define JSON_SCANNER_H_
+
+#include <stddef.h>
+#include <string>
+#include <vector>
+#include "error.h"
+#include "string_view.h"
+
+// The tokenizer of the decoders generated with --decoder direct. They parse
+// by recursive descent, one function per object schema, and know which token
+// comes next, so they ask for it instead of being called back with whatever
+// the next token is.
+//
+// Each method returns false and sets the error if the input does not match,
+// except EndObject, NextMember, EndArray and NextElement: they also return
+// false at the end of an object or array, so check failed() after the loop.
+class JsonScanner {
+ public:
+  // As deep as yajl goes.
+  static const int kMaxDepth = 128;
+
+  // The caller keeps (data, size) alive for as long as the scanner.
+  JsonScanner(const char* data, size_t size);
+  explicit JsonScanner(const std::vector<char>& data);
+  // With --string-views: strings are views of |input|, see pinned_buffer().
+  explicit JsonScanner(PinnedBuffer* input);
+
+  // '{', then EndObject() for an empty object, else keys and values separated
+  // by NextMember().
+  bool StartObject();
+  bool EndObject();
+  bool NextMember();
+  // A string and ':'. Like ReadString, escaped keys are only valid until the
+  // next string is read.
+  bool ReadKey(const char** s, size_t* length);
+
+  // '[', then EndArray() for an empty array, else values separated by
+  // NextElement().
+  bool StartArray();
+  bool EndArray();
+  bool NextElement();
+
+  // (s, length) is in the input, or in the scanner if the string had escapes.
+  bool ReadString(const char** s, size_t* length);
+  // The text of the number, for the functions of json_number.h.
+  bool ReadNumber(const char** s, size_t* length);
+  bool ReadBool(bool* value);
+
+  // Checks that only whitespace follows the value.
+  bool Finish();
+
+  // Sets the error at the current offset, and returns false.
+  bool Fail(const char* message);
+  bool failed() const { return error_.get() != NULL; }
+  const ErrorPtr& error() const { return error_; }
+
+  // The input of the PinnedBuffer constructor, or NULL.
+  PinnedBuffer* pinned_buffer() const { return pinned_buffer_; }
+
+ private:
+  // Skips whitespace; returns false at the end of the input.
+  bool SkipWhitespace();
+  bool Consume(char c);
+  // Fails with what the next value is instead of the one expected.
+  bool Unexpected();
+  bool ReadEscapedString(const char* start, const char** s, size_t* length);
+  bool ReadUnicodeEscape(unsigned long* code_point);
+  bool SkipUtf8();
+  bool Push();
+  bool Pop();
+
+  const char* begin_;
+  const char* p_;
+  const char* end_;
+  PinnedBuffer* pinned_buffer_;
+  int depth_;
+  // The last string that had escapes.
+  std::string scratch_;
+  ErrorPtr error_;
+
+  JsonScanner(const JsonScanner&);
+  JsonScanner& operator =(const JsonScanner&);
+};
+
+#endif  // JSON_SCANNER_H_
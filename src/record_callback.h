@@ -0,0 +1,20 @@
+#ifndef RECORD_CALLBACK_H_
+#define RECORD_CALLBACK_H_
+
+#include <stddef.h>
+#include "error.h"
+
+// Receives the records of a generated DecodeStream function, one at a time.
+template <typename T>
+class RecordCallback {
+ public:
+  virtual ~RecordCallback() {}
+
+  // Called with record number |index|, counting from 0. If it could not be
+  // decoded, |error| is set and |data| holds what was decoded before the
+  // error; the stream goes on with the next record. |data| is only valid
+  // during the call. Returns false to stop decoding.
+  virtual bool OnRecord(size_t index, T* data, const ErrorPtr& error) = 0;
+};
+
+#endif  // RECORD_CALLBACK_H_
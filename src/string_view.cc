@@ -0,0 +1,37 @@
+#include "string_view.h"
+
+bool operator ==(const StringView& a, const StringView& b) {
+  return a.size() == b.size() && memcmp(a.data(), b.data(), a.size()) == 0;
+}
+
+bool operator !=(const StringView& a, const StringView& b) {
+  return !(a == b);
+}
+
+PinnedBuffer::PinnedBuffer(const void* data, size_t size)
+    : data_(static_cast<const char*>(data)),
+      size_(size),
+      num_copies_(0) {
+}
+
+PinnedBuffer::PinnedBuffer(std::vector<char>* data)
+    : data_(NULL),
+      size_(data->size()),
+      num_copies_(0) {
+  owned_data_.swap(*data);
+  data_ = owned_data_.empty() ? NULL : &owned_data_[0];
+}
+
+StringView PinnedBuffer::View(const char* s, size_t length) {
+  if (length == 0)
+    return StringView();
+  // Compare addresses as integers; |s| may point anywhere.
+  size_t offset = reinterpret_cast<size_t>(s) -
+                  reinterpret_cast<size_t>(data_);
+  if (data_ && offset <= size_ && length <= size_ - offset)
+    return StringView(s, length);
+  char* copy = static_cast<char*>(copies_.Allocate(length));
+  memcpy(copy, s, length);
+  ++num_copies_;
+  return StringView(copy, length);
+}
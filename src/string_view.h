@@ -0,0 +1,65 @@
+#ifndef STRING_VIEW_H_
+#define STRING_VIEW_H_
+
+#include <stddef.h>
+#include <string.h>
+#include <string>
+#include <vector>
+#include "arena.h"
+
+// The string fields of code generated with --string-views. A StringView does
+// not own its bytes: they are in the PinnedBuffer that was decoded, so the
+// decoded structs must not outlive it.
+class StringView {
+ public:
+  StringView() : data_(""), size_(0) {}
+  StringView(const char* data, size_t size) : data_(data), size_(size) {}
+  // |s| must outlive the view, e.g. a literal.
+  StringView(const char* s) : data_(s), size_(strlen(s)) {}
+
+  const char* data() const { return data_; }
+  size_t size() const { return size_; }
+  size_t length() const { return size_; }
+  bool empty() const { return size_ == 0; }
+
+  std::string ToString() const { return std::string(data_, size_); }
+
+ private:
+  const char* data_;
+  size_t size_;
+};
+
+bool operator ==(const StringView& a, const StringView& b);
+bool operator !=(const StringView& a, const StringView& b);
+
+// The input of a --string-views decode. Strings that the parser passes
+// straight from the input become views into it. Strings that had escapes
+// are copied into storage that the PinnedBuffer owns.
+class PinnedBuffer {
+ public:
+  // The caller keeps (data, size) alive for as long as the PinnedBuffer.
+  PinnedBuffer(const void* data, size_t size);
+  // Takes the contents of |data|, leaving it empty.
+  explicit PinnedBuffer(std::vector<char>* data);
+
+  const char* data() const { return data_; }
+  size_t size() const { return size_; }
+
+  // A view of (s, length): in place if it is in the input, else a copy.
+  StringView View(const char* s, size_t length);
+
+  // The number of strings that had to be copied.
+  size_t num_copies() const { return num_copies_; }
+
+ private:
+  std::vector<char> owned_data_;
+  const char* data_;
+  size_t size_;
+  Arena copies_;
+  size_t num_copies_;
+
+  PinnedBuffer(const PinnedBuffer&);
+  PinnedBuffer& operator =(const PinnedBuffer&);
+};
+
+#endif  // STRING_VIEW_H_
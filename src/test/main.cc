@@ -1,10 +1,24 @@
+#include <ctype.h>
+#include <inttypes.h>
+#include <math.h>
 #include "gtest/gtest.h"
+#include "arena.h"
+#include "base64.h"
+#include "field_mask.h"
 #include "io.h"
 #include "json_generator.h"
+#include "json_number.h"
+#include "json_index.h"
 #include "json_parser.h"
+#include "json_scanner.h"
 #include "out/gen/src/test/data/simple_schema.h"
 #include "out/gen/src/test/data/urlshortener_schema.h"
+#include "out/gen/src/test/data/urlshortener_schema_lazy.h"
 #include "out/gen/src/test/data/test_types_schema.h"
+#include "out/gen/src/test/data/test_types_schema_arena.h"
+#include "out/gen/src/test/data/test_types_schema_direct.h"
+#include "out/gen/src/test/data/test_types_schema_presence.h"
+#include "out/gen/src/test/data/test_types_schema_views.h"
 
 namespace {
 
@@ -37,8 +51,70 @@ class ErrorReader : public Reader {
   size_t offs_;
 };
 
+// A MemoryWriter that counts the writes to it, and fails them after
+// |error_at| bytes.
+class CountingWriter : public MemoryWriter {
+ public:
+  explicit CountingWriter(size_t error_at = static_cast<size_t>(-1))
+      : num_writes(0),
+        error_at_(error_at) {
+  }
+
+  virtual size_t Write(const void* buf, size_t count, ErrorPtr* error) {
+    ++num_writes;
+    if (data().size() + count > error_at_) {
+      error->reset(new MessageError("Disk full"));
+      return 0;
+    }
+    return MemoryWriter::Write(buf, count, error);
+  }
+
+  int num_writes;
+
+ private:
+  size_t error_at_;
+};
+
+class CountingCallbacks : public JsonCallbacks {
+ public:
+  explicit CountingCallbacks(int* constructed) { ++*constructed; }
+  void Reset(int* constructed) {}
+  virtual int OnNull(JsonParser* p, ErrorPtr* ptr) { return 1; }
+  virtual int OnBool(JsonParser* p, bool value, ErrorPtr* ptr) { return 1; }
+  virtual int OnNumber(
+      JsonParser* p, const char* s, size_t len, ErrorPtr* ptr) { return 1; }
+  virtual int OnString(
+      JsonParser* p, const unsigned char* s, size_t len, ErrorPtr* ptr) {
+    return 1;
+  }
+  virtual int OnStartMap(JsonParser* p, ErrorPtr* ptr) { return 1; }
+  virtual int OnMapKey(
+      JsonParser* p, const unsigned char* s, size_t len, ErrorPtr* ptr) {
+    return 1;
+  }
+  virtual int OnEndMap(JsonParser* p, ErrorPtr* ptr) { return 1; }
+  virtual int OnStartArray(JsonParser* p, ErrorPtr* ptr) { return 1; }
+  virtual int OnEndArray(JsonParser* p, ErrorPtr* ptr) { return 1; }
+};
+
 }  // namespace
 
+TEST(JsonParserTest, ReusesCallbacks) {
+  JsonParser p;
+  int constructed = 0;
+  p.PushCallbacksFor<CountingCallbacks>(&constructed);
+  for (int i = 0; i < 1000; ++i) {
+    p.PushCallbacksFor<CountingCallbacks>(&constructed);
+    p.PushCallbacksFor<CountingCallbacks>(&constructed);
+    EXPECT_TRUE(p.PopCallbacks());
+    EXPECT_TRUE(p.PopCallbacks());
+  }
+  EXPECT_EQ(3, constructed);
+  EXPECT_TRUE(p.PopCallbacks());
+  EXPECT_FALSE(p.HasCallbacks());
+  EXPECT_FALSE(p.PopCallbacks());
+}
+
 TEST(IOTest, Compare) {
   ErrorPtr dummy_error1(new MessageError("dummy1"));
   ErrorPtr dummy_error2(new MessageError("dummy2"));
@@ -82,6 +158,65 @@ TEST(IOTest, Compare) {
   }
 }
 
+TEST(IOTest, BufferedWriter) {
+  CountingWriter dst;
+  ErrorPtr error;
+  {
+    BufferedWriter writer(&dst, 8);
+    EXPECT_EQ(3, writer.Write("abc", 3, &error));
+    EXPECT_EQ(3, writer.Write("def", 3, &error));
+    EXPECT_EQ(0, dst.num_writes);
+    // Full: "abcdef" is written, "ghi" is buffered.
+    EXPECT_EQ(3, writer.Write("ghi", 3, &error));
+    EXPECT_EQ(1, dst.num_writes);
+    // Too big to buffer: "ghi" is written, then "0123456789" as it is.
+    EXPECT_EQ(10, writer.Write("0123456789", 10, &error));
+    EXPECT_EQ(3, dst.num_writes);
+    char* p = writer.Reserve(20);
+    memcpy(p, "reserved", 8);
+    writer.Commit(8);
+    writer.Put('!');
+    EXPECT_EQ(3, dst.num_writes);
+    EXPECT_TRUE(writer.Flush(&error));
+    EXPECT_EQ(NULL, error.get());
+    EXPECT_EQ(4, dst.num_writes);
+    writer.Put('.');
+  }
+  // The rest is written on destruction.
+  EXPECT_EQ(5, dst.num_writes);
+  EXPECT_EQ("abcdefghi0123456789reserved!.",
+            std::string(dst.data().begin(), dst.data().end()));
+
+  CountingWriter full_dst(4);
+  BufferedWriter writer(&full_dst, 8);
+  EXPECT_EQ(6, writer.Write("abcdef", 6, &error));
+  EXPECT_EQ(NULL, error.get());
+  EXPECT_FALSE(writer.Flush(&error));
+  ASSERT_TRUE(error.get() != NULL);
+  EXPECT_EQ("Disk full", error->ToString());
+  // Later writes fail too, and nothing more is written.
+  error.reset();
+  EXPECT_EQ(0, writer.Write("gh", 2, &error));
+  EXPECT_TRUE(error.get() != NULL);
+  EXPECT_FALSE(writer.Flush(NULL));
+  EXPECT_EQ(1, full_dst.num_writes);
+}
+
+TEST(IOTest, MemoryWriter) {
+  MemoryWriter writer;
+  ErrorPtr error;
+  writer.Reserve(100);
+  size_t capacity = writer.data().capacity();
+  EXPECT_LE(100, capacity);
+  for (int i = 0; i < 10; ++i)
+    EXPECT_EQ(10, writer.Write("0123456789", 10, &error));
+  // Nothing was reallocated.
+  EXPECT_EQ(capacity, writer.data().capacity());
+  EXPECT_EQ(100, writer.data().size());
+  EXPECT_EQ("0123456789", std::string(writer.data().end() - 10,
+                                      writer.data().end()));
+}
+
 TEST(SimpleSchemaTest, Parse) {
   simple_schema::StringCount data;
   char buffer[] = "{\"id\": \"foobar\", \"count\": \"123456\"}";
@@ -148,17 +283,28 @@ TEST(TypesTest, Failures) {
     { "{\"myInt64\": \"1234a\"}", "Unexpected characters at end of integer" },
     { "{\"myInt64\": \"1234.5\"}", "Unexpected characters at end of integer" },
     { "{\"myInt64\": \"10000000000000000000\"}", "Integer value out of range" },
-    // strtoull parses -1 as a valid uint64 (ULLONG_MAX). :-/
-//    { "{\"myUint64\": \"-1\"}", "Integer value out of range" },
+    { "{\"myInt64\": \"\"}", "Unexpected characters at end of integer" },
+    { "{\"myInt64\": \"+1\"}", "Unexpected characters at end of integer" },
+    { "{\"myUint64\": \"-1\"}", "Integer value out of range" },
+    { "{\"myUint64\": \"18446744073709551616\"}", "Integer value out of range" },
     { "{\"myFloat\": \"1.5\"}", "Unexpected string" },
     { "{\"myFloat\": 1e40}", "Float value out of range" },
     { "{\"myDouble\": 1e400}", "Float value out of range" },
+    // Subnormal values are out of range, as strtod's ERANGE made them.
+    { "{\"myFloat\": 1e-40}", "Float value out of range" },
+    { "{\"myDouble\": 1e-310}", "Float value out of range" },
     { "{\"myString\": true}", "Unexpected bool" },
     { "{\"myBool\": 1}", "Unexpected number" },
     { "{\"myBool\": \"true\"}", "Unexpected string" },
     { "{\"myRef\": null}", "Unexpected null" },
     { "{\"myObject\": null}", "Unexpected null" },
     { "{\"myObject\": {\"badProperty\": 123}}", "Unknown map key" },
+    // Same length as "myAny", same byte as "myRef" at the switched offset.
+    { "{\"myRnx\": 123}", "Unknown map key" },
+    // Same length and switched byte as "myInt32", differs later.
+    { "{\"myInt33\": 123}", "Unknown map key" },
+    { "{\"myint32\": 123}", "Unknown map key" },
+    { "{\"myInt32Extra\": 123}", "Unknown map key" },
   };
 
   for (int i = 0; i < sizeof(test_cases)/sizeof(test_cases[0]); ++i) {
@@ -167,8 +313,8 @@ TEST(TypesTest, Failures) {
     MemoryReader reader(&json[0], strlen(json));
     ErrorPtr error;
     test_types_schema::Decode(&reader, &data, &error);
-    const char* error_message = error ? error->ToString().c_str() : "None";
-    EXPECT_TRUE(strstr(error_message, test_cases[i].error) != NULL)
+    std::string error_message = error ? error->ToString() : "None";
+    EXPECT_TRUE(strstr(error_message.c_str(), test_cases[i].error) != NULL)
         << "For testcase: " << json << "\n"
         << "Expected error to be: " << test_cases[i].error << "\n"
         << "Actual error: " << error_message;
@@ -259,8 +405,8 @@ TEST(ArrayTypesTest, Failures) {
     MemoryReader reader(&json[0], strlen(json));
     ErrorPtr error;
     test_types_schema::Decode(&reader, &data, &error);
-    const char* error_message = error ? error->ToString().c_str() : "None";
-    EXPECT_TRUE(strstr(error_message, test_cases[i].error) != NULL)
+    std::string error_message = error ? error->ToString() : "None";
+    EXPECT_TRUE(strstr(error_message.c_str(), test_cases[i].error) != NULL)
         << "For testcase: " << json << "\n"
         << "Expected error to be: " << test_cases[i].error << "\n"
         << "Actual error: " << error_message;
@@ -305,6 +451,36 @@ TEST(ComplexTypesTest, Parse) {
   }
 }
 
+TEST(ComplexTypesTest, ParseRefs) {
+  // Every element needs its own DummyRef, though the callbacks are reused.
+  std::string json = "{\"twoplyRefs\": [[";
+  const int kNumRefs = 100;
+  for (int i = 0; i < kNumRefs; ++i) {
+    char buffer[64];
+    snprintf(buffer, sizeof(buffer), "%s{\"value1\": \"%d\", \"value2\": %d}",
+             i ? ", " : "", i, i);
+    json += buffer;
+  }
+  json += "], [{\"value2\": -1}]]}";
+
+  test_types_schema::ComplexTypes data;
+  MemoryReader reader(json.data(), json.size());
+  ErrorPtr error;
+  test_types_schema::Decode(&reader, &data, &error);
+  ASSERT_TRUE(error.get() == NULL) << "Got error: " << error->ToString();
+  ASSERT_EQ(2, data.twoply_refs.size());
+  ASSERT_EQ(kNumRefs, data.twoply_refs[0].size());
+  for (int i = 0; i < kNumRefs; ++i) {
+    char buffer[16];
+    snprintf(buffer, sizeof(buffer), "%d", i);
+    EXPECT_EQ(buffer, data.twoply_refs[0][i]->value1);
+    EXPECT_EQ(i, data.twoply_refs[0][i]->value2);
+  }
+  ASSERT_EQ(1, data.twoply_refs[1].size());
+  EXPECT_EQ("", data.twoply_refs[1][0]->value1);
+  EXPECT_EQ(-1, data.twoply_refs[1][0]->value2);
+}
+
 TEST(ComplexTypesTest, Gen) {
   test_types_schema::ComplexTypes data;
   data.array_of_nested.resize(2);
@@ -438,6 +614,1490 @@ TEST(SimpleAddlPropsTest, Gen) {
   }
 }
 
+TEST(FieldMaskTest, Parse) {
+  const char* valid[] = {
+    "*",
+    "twoply",
+    "twoply,threeply",
+    "twoplyObjects/x",
+    "twoplyObjects(x)",
+    "twoplyRefs(value1,value2)",
+    "arrayOfNested/x/y",
+    "arrayOfNested(x(y)),twoply",
+    "arrayOfNested/*",
+  };
+  for (int i = 0; i < sizeof(valid)/sizeof(valid[0]); ++i) {
+    FieldMask mask;
+    ErrorPtr error;
+    EXPECT_TRUE(mask.Parse(valid[i], test_types_schema::kComplexTypesFields,
+                           &error))
+        << "For testcase: " << valid[i] << "\n"
+        << "Got error: " << error->ToString();
+  }
+
+  const char* invalid[] = {
+    "",
+    "twoply,",
+    "nope",
+    "twoply/x",
+    "twoplyObjects/y",
+    "twoplyObjects(x",
+    "twoplyObjects(x))",
+    "*/x",
+  };
+  for (int i = 0; i < sizeof(invalid)/sizeof(invalid[0]); ++i) {
+    FieldMask mask;
+    ErrorPtr error;
+    EXPECT_FALSE(mask.Parse(invalid[i], test_types_schema::kComplexTypesFields,
+                            &error))
+        << "For testcase: " << invalid[i];
+    EXPECT_TRUE(error.get() != NULL) << "For testcase: " << invalid[i];
+  }
+}
+
+TEST(FieldMaskTest, Select) {
+  FieldMask mask;
+  ErrorPtr error;
+  ASSERT_TRUE(mask.Parse("arrayOfNested/x/y,twoply,arrayOfNested(x)",
+                         test_types_schema::kComplexTypesFields, &error));
+  const FieldMask* child = &mask;
+  EXPECT_TRUE(mask.Select("twoply", 6, &child));
+  EXPECT_EQ(NULL, child);
+  EXPECT_FALSE(mask.Select("threeply", 8, &child));
+  ASSERT_TRUE(mask.Select("arrayOfNested", 13, &child));
+  ASSERT_TRUE(child != NULL);
+  // Selecting "x" as a whole wins over "x/y".
+  const FieldMask* grandchild = &mask;
+  EXPECT_TRUE(child->Select("x", 1, &grandchild));
+  EXPECT_EQ(NULL, grandchild);
+}
+
+TEST(FieldMaskTest, Decode) {
+  const char* json =
+      "{\"twoply\": [[1, 2]], \"threeply\": [[[3]]],"
+      " \"twoplyObjects\": [[{\"x\": 4}]],"
+      " \"twoplyRefs\": [[{\"value1\": \"5\", \"value2\": 6}]],"
+      " \"arrayOfNested\": [{\"x\": {\"y\": 7}}, {\"x\": {\"y\": 8}}]}";
+  FieldMask mask;
+  ErrorPtr error;
+  ASSERT_TRUE(mask.Parse("twoplyRefs/value2,arrayOfNested/x,threeply",
+                         test_types_schema::kComplexTypesFields, &error));
+  test_types_schema::ComplexTypes data;
+  MemoryReader reader(json, strlen(json));
+  test_types_schema::Decode(&reader, &data, mask, &error);
+  ASSERT_EQ(NULL, error.get()) << "Decode error: " << error->ToString();
+
+  EXPECT_TRUE(data.twoply.empty());
+  EXPECT_TRUE(data.twoply_objects.empty());
+  ASSERT_EQ(1, data.threeply.size());
+  EXPECT_EQ(3, data.threeply[0][0][0]);
+  ASSERT_EQ(1, data.twoply_refs.size());
+  ASSERT_EQ(1, data.twoply_refs[0].size());
+  EXPECT_EQ("", data.twoply_refs[0][0]->value1);
+  EXPECT_EQ(6, data.twoply_refs[0][0]->value2);
+  ASSERT_EQ(2, data.array_of_nested.size());
+  EXPECT_EQ(7, data.array_of_nested[0].x.y);
+  EXPECT_EQ(8, data.array_of_nested[1].x.y);
+}
+
+TEST(FieldMaskTest, DecodeSkipsUnknownKeys) {
+  // Without a field mask unknown keys are errors; with one they are skipped
+  // like any other key the mask does not select.
+  const char* json =
+      "{\"unknown\": {\"a\": [1, {\"b\": null}], \"c\": true},"
+      " \"myInt32\": 1, \"myString\": \"two\", \"myBool\": true}";
+  test_types_schema::Types data;
+  ErrorPtr error;
+  {
+    MemoryReader reader(json, strlen(json));
+    test_types_schema::Decode(&reader, &data, &error);
+    EXPECT_TRUE(error.get() != NULL);
+  }
+
+  FieldMask mask;
+  ASSERT_TRUE(mask.Parse("myString,myBool", test_types_schema::kTypesFields,
+                         &error));
+  MemoryReader reader(json, strlen(json));
+  error.reset();
+  test_types_schema::Decode(&reader, &data, mask, &error);
+  ASSERT_EQ(NULL, error.get()) << "Decode error: " << error->ToString();
+  EXPECT_EQ(0, data.my_int32);
+  EXPECT_EQ("two", data.my_string);
+  EXPECT_TRUE(data.my_bool);
+
+  // The mask must have been parsed for the decoded schema.
+  MemoryReader other_reader(json, strlen(json));
+  test_types_schema::ComplexTypes other_data;
+  test_types_schema::Decode(&other_reader, &other_data, mask, &error);
+  EXPECT_TRUE(error.get() != NULL);
+}
+
+// Keeps the records of a DecodeStream, and their errors.
+class CollectRecords
+    : public RecordCallback<test_types_schema::ComplexTypes> {
+ public:
+  explicit CollectRecords(size_t max_records = static_cast<size_t>(-1))
+      : max_records_(max_records) {}
+
+  virtual bool OnRecord(size_t index, test_types_schema::ComplexTypes* data,
+                        const ErrorPtr& error) {
+    EXPECT_EQ(records.size(), index);
+    records.push_back(*data);
+    errors.push_back(error ? error->ToString() : "");
+    return records.size() < max_records_;
+  }
+
+  std::vector<test_types_schema::ComplexTypes> records;
+  std::vector<std::string> errors;
+
+ private:
+  size_t max_records_;
+};
+
+TEST(DecodeStreamTest, Records) {
+  const char* json =
+      "{\"twoply\": [[1, 2]]}\n"
+      "{\"twoplyRefs\": [[{\"value1\": \"a\"}, {\"value2\": 2}]]}\n"
+      "{\"arrayOfNested\": [{\"x\": {\"y\": 3, \"z\": [{}]}}], \"twoply\": []}\n"
+      "5\n"
+      "{}{\"twoply\": [[4]]}";
+  CollectRecords callback;
+  MemoryReader reader(json, strlen(json));
+  ErrorPtr error;
+  test_types_schema::DecodeStream(&reader, &callback, &error);
+  ASSERT_EQ(NULL, error.get()) << "Got error: " << error->ToString();
+
+  ASSERT_EQ(6, callback.records.size());
+  EXPECT_EQ("", callback.errors[0]);
+  ASSERT_EQ(1, callback.records[0].twoply.size());
+  EXPECT_EQ(2, callback.records[0].twoply[0][1]);
+
+  // The callbacks of the $ref are reused for every record.
+  EXPECT_EQ("", callback.errors[1]);
+  ASSERT_EQ(1, callback.records[1].twoply_refs.size());
+  ASSERT_EQ(2, callback.records[1].twoply_refs[0].size());
+  EXPECT_EQ("a", callback.records[1].twoply_refs[0][0]->value1);
+  EXPECT_EQ(2, callback.records[1].twoply_refs[0][1]->value2);
+  EXPECT_TRUE(callback.records[1].twoply.empty());
+
+  // A record that fails keeps what was decoded before the error, and the
+  // rest of it is skipped.
+  EXPECT_NE(std::string::npos,
+            callback.errors[2].find("Unknown map key")) << callback.errors[2];
+  ASSERT_EQ(1, callback.records[2].array_of_nested.size());
+  EXPECT_EQ(3, callback.records[2].array_of_nested[0].x.y);
+  EXPECT_NE(std::string::npos,
+            callback.errors[3].find("Unexpected number")) << callback.errors[3];
+
+  EXPECT_EQ("", callback.errors[4]);
+  EXPECT_TRUE(callback.records[4].twoply.empty());
+  EXPECT_EQ("", callback.errors[5]);
+  ASSERT_EQ(1, callback.records[5].twoply.size());
+  EXPECT_EQ(4, callback.records[5].twoply[0][0]);
+}
+
+TEST(DecodeStreamTest, Stop) {
+  const char* json = "{\"twoply\": [[1]]} {\"twoply\": [[2]]} {\"twoply\": [[3]]}";
+  CollectRecords callback(2);
+  MemoryReader reader(json, strlen(json));
+  ErrorPtr error;
+  test_types_schema::DecodeStream(&reader, &callback, &error);
+  EXPECT_EQ(NULL, error.get()) << "Got error: " << error->ToString();
+  ASSERT_EQ(2, callback.records.size());
+  EXPECT_EQ(2, callback.records[1].twoply[0][0]);
+}
+
+TEST(DecodeStreamTest, SyntaxError) {
+  const char* json = "{\"twoply\": [[1]]}\n{\"twoply\": [[2]}\n{}";
+  CollectRecords callback;
+  MemoryReader reader(json, strlen(json));
+  ErrorPtr error;
+  test_types_schema::DecodeStream(&reader, &callback, &error);
+  EXPECT_TRUE(error.get() != NULL);
+  ASSERT_EQ(1, callback.records.size());
+  EXPECT_EQ("", callback.errors[0]);
+}
+
+TEST(JsonScannerTest, Strings) {
+  struct TestCase {
+    const char* json;
+    const char* expected;
+  };
+  TestCase test_cases[] = {
+    { "\"\"", "" },
+    { "  \"plain\"", "plain" },
+    { "\"tab\\there\"", "tab\there" },
+    { "\"\\\"\\\\\\/\\b\\f\\n\\r\\t\"", "\"\\/\b\f\n\r\t" },
+    { "\"\\u00e9t\\u00E9\"", "\xc3\xa9t\xc3\xa9" },
+    { "\"\xc3\xa9t\xc3\xa9\"", "\xc3\xa9t\xc3\xa9" },
+    { "\"\\ud83d\\ude00\"", "\xf0\x9f\x98\x80" },
+    { "\"\\ud83d\"", "?" },
+  };
+  for (int i = 0; i < sizeof(test_cases)/sizeof(test_cases[0]); ++i) {
+    const char* json = test_cases[i].json;
+    JsonScanner scanner(json, strlen(json));
+    const char* s;
+    size_t length;
+    ASSERT_TRUE(scanner.ReadString(&s, &length))
+        << "For testcase: " << json << "\n"
+        << "Got error: " << scanner.error()->ToString();
+    EXPECT_EQ(test_cases[i].expected, std::string(s, length))
+        << "For testcase: " << json;
+    EXPECT_TRUE(scanner.Finish());
+  }
+
+  const char* invalid[] = {
+    "\"unterminated",
+    "\"bad \\x escape\"",
+    "\"bad \\u12 escape\"",
+    "\"control \n character\"",
+    "\"bad \xff UTF-8\"",
+    "\"overlong \xc0\xaf\"",
+    "\"truncated \xe2\x82\"",
+    "123",
+  };
+  for (int i = 0; i < sizeof(invalid)/sizeof(invalid[0]); ++i) {
+    const char* json = invalid[i];
+    JsonScanner scanner(json, strlen(json));
+    const char* s;
+    size_t length;
+    EXPECT_FALSE(scanner.ReadString(&s, &length)) << "For testcase: " << json;
+    EXPECT_TRUE(scanner.failed()) << "For testcase: " << json;
+  }
+}
+
+TEST(JsonScannerTest, Numbers) {
+  const char* valid[] = { "0", "-0", "12", "-12.5", "1e9", "1.5E+3", "2e-2" };
+  for (int i = 0; i < sizeof(valid)/sizeof(valid[0]); ++i) {
+    JsonScanner scanner(valid[i], strlen(valid[i]));
+    const char* s;
+    size_t length;
+    EXPECT_TRUE(scanner.ReadNumber(&s, &length)) << "For testcase: " << valid[i];
+    EXPECT_EQ(valid[i], std::string(s, length));
+  }
+
+  const char* invalid[] = { "-", "01", "1.", ".5", "1e", "1e+", "+1", "x" };
+  for (int i = 0; i < sizeof(invalid)/sizeof(invalid[0]); ++i) {
+    JsonScanner scanner(invalid[i], strlen(invalid[i]));
+    const char* s;
+    size_t length;
+    bool ok = scanner.ReadNumber(&s, &length) && scanner.Finish();
+    EXPECT_FALSE(ok) << "For testcase: " << invalid[i];
+  }
+}
+
+// Decodes |json| with the yajl and the direct decoders, and checks that they
+// agree, by encoding both.
+template <typename YajlT, typename DirectT>
+void ExpectSameDecode(
+    void (*yajl_decode)(Reader*, YajlT*, ErrorPtr*),
+    void (*yajl_encode)(Writer*, YajlT*, const JsonGeneratorOptions&,
+                        ErrorPtr*),
+    void (*direct_decode)(Reader*, DirectT*, ErrorPtr*),
+    void (*direct_encode)(Writer*, DirectT*, const JsonGeneratorOptions&,
+                          ErrorPtr*),
+    const std::vector<char>& json) {
+  ErrorPtr error;
+  YajlT yajl_data;
+  MemoryReader yajl_reader(json);
+  yajl_decode(&yajl_reader, &yajl_data, &error);
+  ASSERT_EQ(NULL, error.get()) << "Decode error: " << error->ToString();
+  DirectT direct_data;
+  MemoryReader direct_reader(json);
+  direct_decode(&direct_reader, &direct_data, &error);
+  ASSERT_EQ(NULL, error.get()) << "Decode error: " << error->ToString();
+
+  MemoryWriter yajl_writer;
+  yajl_encode(&yajl_writer, &yajl_data, JsonGeneratorOptions(), &error);
+  ASSERT_EQ(NULL, error.get()) << "Encode error: " << error->ToString();
+  MemoryWriter direct_writer;
+  direct_encode(&direct_writer, &direct_data, JsonGeneratorOptions(), &error);
+  ASSERT_EQ(NULL, error.get()) << "Encode error: " << error->ToString();
+  EXPECT_TRUE(yajl_writer.data() == direct_writer.data());
+}
+
+std::vector<char> ReadFile(const char* filename) {
+  FileReader reader(filename);
+  MemoryWriter writer;
+  ErrorPtr error;
+  Copy(&writer, &reader, &error);
+  return writer.data();
+}
+
+TEST(DirectDecoderTest, Parse) {
+  ExpectSameDecode<test_types_schema::Types, test_types_schema_direct::Types>(
+      &test_types_schema::Decode, &test_types_schema::Encode,
+      &test_types_schema_direct::Decode, &test_types_schema_direct::Encode,
+      ReadFile("test_types_data.json"));
+  ExpectSameDecode<test_types_schema::ArrayTypes,
+                   test_types_schema_direct::ArrayTypes>(
+      &test_types_schema::Decode, &test_types_schema::Encode,
+      &test_types_schema_direct::Decode, &test_types_schema_direct::Encode,
+      ReadFile("test_array_types_data.json"));
+
+  const char* json =
+      "{\"twoply\": [[1, 2], []], \"threeply\": [[[3]], [[]]],"
+      " \"twoplyObjects\": [[{\"x\": 4}]],"
+      " \"twoplyRefs\": [[{\"value1\": \"5\", \"value2\": 6}]],"
+      " \"arrayOfNested\": [{\"x\": {\"y\": 7}}, {\"x\": {}}]}";
+  ExpectSameDecode<test_types_schema::ComplexTypes,
+                   test_types_schema_direct::ComplexTypes>(
+      &test_types_schema::Decode, &test_types_schema::Encode,
+      &test_types_schema_direct::Decode, &test_types_schema_direct::Encode,
+      std::vector<char>(json, json + strlen(json)));
+
+  json = "{\"prop1\": 100, \"ap1\": 34, \"a\\u00e9\": 5}";
+  ExpectSameDecode<test_types_schema::SimpleAddlProps,
+                   test_types_schema_direct::SimpleAddlProps>(
+      &test_types_schema::Decode, &test_types_schema::Encode,
+      &test_types_schema_direct::Decode, &test_types_schema_direct::Encode,
+      std::vector<char>(json, json + strlen(json)));
+}
+
+TEST(DirectDecoderTest, Failures) {
+  struct TestCase {
+    const char* json;
+    const char* error;
+  };
+  TestCase test_cases[] = {
+    { "{\"myInt32\": \"\"}", "Unexpected string" },
+    { "{\"myInt32\": 3.5}", "Unexpected characters at end of integer" },
+    { "{\"myInt32\": 123456789012}", "Integer value out of range" },
+    { "{\"myUint32\": -1}", "Integer value out of range" },
+    { "{\"myInt64\": foo}", "Invalid value" },
+    { "{\"myInt64\": 1234}", "Unexpected number" },
+    { "{\"myInt64\": \"1234a\"}", "Unexpected characters at end of integer" },
+    { "{\"myInt64\": \"+1\"}", "Unexpected characters at end of integer" },
+    { "{\"myUint64\": \"-1\"}", "Integer value out of range" },
+    { "{\"myFloat\": \"1.5\"}", "Unexpected string" },
+    { "{\"myDouble\": 1e400}", "Float value out of range" },
+    // Subnormal values are out of range, as strtod's ERANGE made them.
+    { "{\"myFloat\": 1e-40}", "Float value out of range" },
+    { "{\"myDouble\": 1e-310}", "Float value out of range" },
+    { "{\"myString\": true}", "Unexpected bool" },
+    { "{\"myBool\": 1}", "Unexpected number" },
+    { "{\"myRef\": null}", "Unexpected null" },
+    { "{\"myObject\": []}", "Unexpected array" },
+    { "{\"myObject\": {\"badProperty\": 123}}", "Unknown map key" },
+    { "{\"myRnx\": 123}", "Unknown map key" },
+    { "{\"myInt33\": 123}", "Unknown map key" },
+    { "{\"myInt32\" 1}", "Expected ':'" },
+    { "{\"myInt32\": 1 \"myUint32\": 2}", "Expected ',' or '}'" },
+    { "{\"myInt32\": 1,}", "Expected a key" },
+    { "{\"myInt32\": 1", "Expected ',' or '}'" },
+    { "{\"myInt32\": 1} {}", "Trailing garbage" },
+    { "", "Unexpected end of input" },
+  };
+
+  for (int i = 0; i < sizeof(test_cases)/sizeof(test_cases[0]); ++i) {
+    const char* json = test_cases[i].json;
+    test_types_schema_direct::Types data;
+    MemoryReader reader(&json[0], strlen(json));
+    ErrorPtr error;
+    test_types_schema_direct::Decode(&reader, &data, &error);
+    std::string error_message = error ? error->ToString() : "None";
+    EXPECT_TRUE(strstr(error_message.c_str(), test_cases[i].error) != NULL)
+        << "For testcase: " << json << "\n"
+        << "Expected error to be: " << test_cases[i].error << "\n"
+        << "Actual error: " << error_message;
+  }
+}
+
+TEST(DirectDecoderTest, DeepNesting) {
+  std::string json = "{\"threeply\": ";
+  for (int i = 0; i < JsonScanner::kMaxDepth; ++i)
+    json += "[";
+  test_types_schema_direct::ComplexTypes data;
+  MemoryReader reader(json.data(), json.size());
+  ErrorPtr error;
+  test_types_schema_direct::Decode(&reader, &data, &error);
+  ASSERT_TRUE(error.get() != NULL);
+}
+
+TEST(Base64Test, Encode) {
+  // RFC 4648 section 10.
+  const char* test_cases[][2] = {
+    { "", "" },
+    { "f", "Zg==" },
+    { "fo", "Zm8=" },
+    { "foo", "Zm9v" },
+    { "foob", "Zm9vYg==" },
+    { "fooba", "Zm9vYmE=" },
+    { "foobar", "Zm9vYmFy" },
+  };
+  for (int i = 0; i < sizeof(test_cases)/sizeof(test_cases[0]); ++i) {
+    const char* data = test_cases[i][0];
+    size_t size = strlen(data);
+    std::string encoded(Base64EncodedSize(size), 0);
+    Base64Encode(reinterpret_cast<const uint8_t*>(data), size, BASE64,
+                 &encoded[0]);
+    EXPECT_EQ(test_cases[i][1], encoded);
+  }
+
+  const uint8_t data[] = { 0xfb, 0xff, 0xbf };
+  char encoded[4];
+  Base64Encode(data, sizeof(data), BASE64, encoded);
+  EXPECT_EQ("+/+/", std::string(encoded, 4));
+  Base64Encode(data, sizeof(data), BASE64_URL, encoded);
+  EXPECT_EQ("-_-_", std::string(encoded, 4));
+}
+
+TEST(Base64Test, Decode) {
+  const char* test_cases[][2] = {
+    { "", "" },
+    { "Zg==", "f" },
+    { "Zg", "f" },
+    { "Zm8=", "fo" },
+    { "Zm8", "fo" },
+    { "Zm9v", "foo" },
+    { "Zm9vYmFy", "foobar" },
+    { "+/+/", "\xfb\xff\xbf" },
+    { "-_-_", "\xfb\xff\xbf" },
+  };
+  for (int i = 0; i < sizeof(test_cases)/sizeof(test_cases[0]); ++i) {
+    const char* s = test_cases[i][0];
+    std::vector<uint8_t> data;
+    ASSERT_TRUE(Base64DecodeTo(s, strlen(s), &data)) << "For testcase: " << s;
+    EXPECT_EQ(test_cases[i][1], std::string(data.begin(), data.end()));
+  }
+
+  const char* invalid[] = {
+    "Z", "Zm9vY", "Zg=", "Z===", "=Zg=", "Zg==Zg==", "Zm 9v", "Zm9v\n",
+    "Zm9*",
+  };
+  for (int i = 0; i < sizeof(invalid)/sizeof(invalid[0]); ++i) {
+    std::vector<uint8_t> data;
+    EXPECT_FALSE(Base64DecodeTo(invalid[i], strlen(invalid[i]), &data))
+        << "For testcase: " << invalid[i];
+    EXPECT_TRUE(data.empty());
+  }
+}
+
+TEST(BytesTypesTest, RoundTrip) {
+  const char* json =
+      "{\"myBytes\":\"AAEC_w==\",\"myBytesArray\":[\"Zm9v\",\"\",\"YQ\"]}";
+  test_types_schema::BytesTypes data;
+  MemoryReader reader(json, strlen(json));
+  ErrorPtr error;
+  test_types_schema::Decode(&reader, &data, &error);
+  ASSERT_EQ(NULL, error.get()) << "Decode error: " << error->ToString();
+
+  const uint8_t bytes[] = { 0, 1, 2, 0xff };
+  EXPECT_TRUE(std::vector<uint8_t>(bytes, bytes + 4) == data.my_bytes);
+  ASSERT_EQ(3, data.my_bytes_array.size());
+  EXPECT_EQ("foo", std::string(data.my_bytes_array[0].begin(),
+                               data.my_bytes_array[0].end()));
+  EXPECT_TRUE(data.my_bytes_array[1].empty());
+  EXPECT_EQ("a", std::string(data.my_bytes_array[2].begin(),
+                             data.my_bytes_array[2].end()));
+
+  MemoryWriter writer;
+  test_types_schema::Encode(&writer, &data, JsonGeneratorOptions(), &error);
+  ASSERT_EQ(NULL, error.get()) << "Encode error: " << error->ToString();
+  EXPECT_EQ("{\"myBytes\":\"AAEC/w==\",\"myBytesArray\":"
+            "[\"Zm9v\",\"\",\"YQ==\"]}",
+            std::string(writer.data().begin(), writer.data().end()));
+
+  MemoryWriter url_writer;
+  JsonGeneratorOptions options;
+  options.base64_alphabet = BASE64_URL;
+  test_types_schema::Encode(&url_writer, &data, options, &error);
+  ASSERT_EQ(NULL, error.get()) << "Encode error: " << error->ToString();
+  EXPECT_EQ("{\"myBytes\":\"AAEC_w==\",\"myBytesArray\":"
+            "[\"Zm9v\",\"\",\"YQ==\"]}",
+            std::string(url_writer.data().begin(), url_writer.data().end()));
+
+  ExpectSameDecode<test_types_schema::BytesTypes,
+                   test_types_schema_direct::BytesTypes>(
+      &test_types_schema::Decode, &test_types_schema::Encode,
+      &test_types_schema_direct::Decode, &test_types_schema_direct::Encode,
+      std::vector<char>(json, json + strlen(json)));
+}
+
+TEST(BytesTypesTest, Failures) {
+  const char* test_cases[] = {
+    "{\"myBytes\": \"Zm9vY\"}",
+    "{\"myBytes\": \"Zm9v!\"}",
+    "{\"myBytesArray\": [\"Zm9v\", \"Zg=\"]}",
+  };
+  for (int i = 0; i < sizeof(test_cases)/sizeof(test_cases[0]); ++i) {
+    const char* json = test_cases[i];
+    ErrorPtr error;
+    test_types_schema::BytesTypes data;
+    MemoryReader reader(json, strlen(json));
+    test_types_schema::Decode(&reader, &data, &error);
+    ASSERT_TRUE(error.get() != NULL) << "For testcase: " << json;
+    EXPECT_TRUE(strstr(error->ToString().c_str(), "Invalid base64") != NULL)
+        << "For testcase: " << json << "\n"
+        << "Actual error: " << error->ToString();
+
+    test_types_schema_direct::BytesTypes direct_data;
+    MemoryReader direct_reader(json, strlen(json));
+    test_types_schema_direct::Decode(&direct_reader, &direct_data, &error);
+    ASSERT_TRUE(error.get() != NULL) << "For testcase: " << json;
+    EXPECT_TRUE(strstr(error->ToString().c_str(), "Invalid base64") != NULL)
+        << "For testcase: " << json << "\n"
+        << "Actual error: " << error->ToString();
+  }
+}
+
+TEST(JsonIndexTest, Build) {
+  const char* json =
+      " {\"a\": [1, \"x\\\"]\", {}], \"b\\u0063\": {\"d\": null}, \"a\": true} ";
+  JsonIndex index;
+  ErrorPtr error;
+  ASSERT_TRUE(index.Build(json, strlen(json), &error))
+      << "Build error: " << error->ToString();
+
+  size_t root = index.root();
+  EXPECT_TRUE(index.IsObject(root));
+  EXPECT_EQ(strlen(json) - 2, index.size(root));
+  ASSERT_EQ(3, index.num_children(root));
+
+  size_t array = index.child(root, 0);
+  EXPECT_TRUE(index.IsArray(array));
+  ASSERT_EQ(3, index.num_children(array));
+  EXPECT_EQ("1", std::string(index.data(index.child(array, 0)),
+                             index.size(index.child(array, 0))));
+  EXPECT_EQ("\"x\\\"]\"", std::string(index.data(index.child(array, 1)),
+                                      index.size(index.child(array, 1))));
+  EXPECT_EQ("{}", std::string(index.data(index.child(array, 2)),
+                              index.size(index.child(array, 2))));
+
+  // The last of duplicate keys, and keys compared unescaped.
+  size_t a = index.Find(root, "a", 1);
+  ASSERT_NE(JsonIndex::kNone, a);
+  EXPECT_EQ("true", std::string(index.data(a), index.size(a)));
+  size_t bc = index.Find(root, "bc", 2);
+  ASSERT_NE(JsonIndex::kNone, bc);
+  EXPECT_EQ(1, index.num_children(bc));
+  EXPECT_EQ(JsonIndex::kNone, index.Find(root, "b", 1));
+  EXPECT_EQ(JsonIndex::kNone, index.Find(array, "a", 1));
+}
+
+TEST(JsonIndexTest, Failures) {
+  struct TestCase {
+    const char* json;
+    const char* error;
+  };
+  TestCase test_cases[] = {
+    { "", "Unexpected end of input" },
+    { "{\"a\": 1", "Expected ',' or '}'" },
+    { "[1 2]", "Expected ',' or ']'" },
+    { "{\"a\" 1}", "Expected ':'" },
+    { "{1: 2}", "Expected a key" },
+    { "{\"a\": 1,}", "Expected a key" },
+    { "[1,]", "Invalid value" },
+    { "[\"a]", "Unterminated string" },
+    { "{} {}", "Trailing garbage" },
+  };
+  for (int i = 0; i < sizeof(test_cases)/sizeof(test_cases[0]); ++i) {
+    const char* json = test_cases[i].json;
+    JsonIndex index;
+    ErrorPtr error;
+    EXPECT_FALSE(index.Build(json, strlen(json), &error))
+        << "For testcase: " << json;
+    std::string error_message = error ? error->ToString() : "None";
+    EXPECT_TRUE(strstr(error_message.c_str(), test_cases[i].error) != NULL)
+        << "For testcase: " << json << "\n"
+        << "Expected error to be: " << test_cases[i].error << "\n"
+        << "Actual error: " << error_message;
+  }
+}
+
+TEST(LazyTest, UrlHistory) {
+  std::vector<char> url = ReadFile("urlshortener_response.json");
+  std::string json = "{\"kind\": \"urlshortener#urlHistory\", \"items\": [" +
+                     std::string(url.begin(), url.end()) + ", " +
+                     "{\"id\": \"http://goo.gl/x\", \"analytics\": 1}, " +
+                     std::string(url.begin(), url.end()) + "]}";
+  JsonIndex index;
+  ErrorPtr error;
+  ASSERT_TRUE(index.Build(json.data(), json.size(), &error))
+      << "Build error: " << error->ToString();
+
+  urlshortener_schema_lazy::LazyUrlHistory history(&index, index.root());
+  EXPECT_EQ("urlshortener#urlHistory", history.GetKind(&error));
+  EXPECT_EQ(NULL, error.get());
+  EXPECT_EQ(0, history.GetTotalItems(&error));
+  EXPECT_EQ(NULL, error.get());
+  ASSERT_EQ(3, history.ItemsSize());
+  EXPECT_TRUE(history.data().items.empty());
+  EXPECT_TRUE(history.ItemsAt(3) == NULL);
+
+  // Only what is accessed is decoded, so the bad "analytics" of the second
+  // item goes unnoticed until then.
+  urlshortener_schema_lazy::LazyUrl* item = history.ItemsAt(2);
+  ASSERT_TRUE(item != NULL);
+  EXPECT_EQ(item, history.ItemsAt(2));
+  EXPECT_EQ("http://goo.gl/Lv6ph", item->GetId(&error));
+  EXPECT_TRUE(item->data().long_url.empty());
+  const std::tr1::shared_ptr<urlshortener_schema_lazy::AnalyticsSummary>&
+      analytics = item->GetAnalytics(&error);
+  ASSERT_EQ(NULL, error.get()) << "Decode error: " << error->ToString();
+  ASSERT_TRUE(analytics.get() != NULL);
+  EXPECT_EQ(10073, analytics->all_time->short_url_clicks);
+
+  urlshortener_schema_lazy::LazyUrl* bad_item = history.ItemsAt(1);
+  ASSERT_TRUE(bad_item != NULL);
+  EXPECT_EQ("http://goo.gl/x", bad_item->GetId(&error));
+  EXPECT_EQ(NULL, error.get());
+  bad_item->GetAnalytics(&error);
+  EXPECT_TRUE(error.get() != NULL);
+
+  // DecodeAll matches Decode.
+  urlshortener_schema_lazy::LazyUrl* first = history.ItemsAt(0);
+  const urlshortener_schema_lazy::Url& lazy = first->DecodeAll(&error);
+  ASSERT_EQ(NULL, error.get()) << "Decode error: " << error->ToString();
+  urlshortener_schema_lazy::Url data;
+  MemoryReader reader(url);
+  urlshortener_schema_lazy::Decode(&reader, &data, &error);
+  ASSERT_EQ(NULL, error.get()) << "Decode error: " << error->ToString();
+  MemoryWriter lazy_writer;
+  MemoryWriter writer;
+  urlshortener_schema_lazy::Encode(
+      &lazy_writer, const_cast<urlshortener_schema_lazy::Url*>(&lazy),
+      JsonGeneratorOptions(), &error);
+  urlshortener_schema_lazy::Encode(&writer, &data, JsonGeneratorOptions(),
+                                   &error);
+  EXPECT_TRUE(lazy_writer.data() == writer.data());
+  EXPECT_EQ("http://goo.gl/Lv6ph", first->GetId(&error));
+}
+
+// Encodes |data| with the direct generator and with yajl, and expects the
+// same JSON.
+template <typename T>
+void ExpectSameEncode(
+    void (*encode)(Writer*, T*, const JsonGeneratorOptions&, ErrorPtr*),
+    T* data, JsonGeneratorOptions options) {
+  ErrorPtr error;
+  MemoryWriter direct_writer;
+  options.use_yajl = false;
+  encode(&direct_writer, data, options, &error);
+  ASSERT_EQ(NULL, error.get()) << "Encode error: " << error->ToString();
+  MemoryWriter yajl_writer;
+  options.use_yajl = true;
+  encode(&yajl_writer, data, options, &error);
+  ASSERT_EQ(NULL, error.get()) << "Encode error: " << error->ToString();
+  EXPECT_EQ(std::string(yajl_writer.data().begin(), yajl_writer.data().end()),
+            std::string(direct_writer.data().begin(),
+                        direct_writer.data().end()));
+}
+
+TEST(JsonGeneratorTest, SameAsYajl) {
+  test_types_schema::Types types;
+  FileReader reader("test_types_data.json");
+  ErrorPtr error;
+  test_types_schema::Decode(&reader, &types, &error);
+  ASSERT_EQ(NULL, error.get()) << "Decode error: " << error->ToString();
+  JsonGeneratorOptions options;
+  ExpectSameEncode(&test_types_schema::Encode, &types, options);
+  types.my_string = "\"quotes\" \\ /slashes/ \b\f\n\r\t \x01\x1f\x7f \xc3\xa9";
+  types.my_double = -0.0;
+  types.my_float = 1.5;
+  types.my_int64 = INT64_MIN;
+  types.my_uint64 = UINT64_MAX;
+  ExpectSameEncode(&test_types_schema::Encode, &types, options);
+  options.escape_solidus = true;
+  ExpectSameEncode(&test_types_schema::Encode, &types, options);
+
+  test_types_schema::ArrayTypes arrays;
+  FileReader array_reader("test_array_types_data.json");
+  test_types_schema::Decode(&array_reader, &arrays, &error);
+  ASSERT_EQ(NULL, error.get()) << "Decode error: " << error->ToString();
+  ExpectSameEncode(&test_types_schema::Encode, &arrays, options);
+
+  // Keys that are not literals are escaped.
+  test_types_schema::SimpleAddlProps addl_props;
+  addl_props.prop1 = 1;
+  addl_props._additional_properties["a\"b"] = 2;
+  addl_props._additional_properties["c/\td"] = 3;
+  addl_props._additional_properties[""] = 4;
+  ExpectSameEncode(&test_types_schema::Encode, &addl_props, options);
+
+  test_types_schema::BytesTypes bytes;
+  bytes.my_bytes.assign(100, 0xff);
+  bytes.my_bytes_array.resize(2);
+  ExpectSameEncode(&test_types_schema::Encode, &bytes, options);
+  options.escape_solidus = false;
+  ExpectSameEncode(&test_types_schema::Encode, &bytes, options);
+}
+
+TEST(JsonGeneratorTest, Failures) {
+  // The direct generator fails as yajl does.
+  for (int use_yajl = 0; use_yajl < 2; ++use_yajl) {
+    JsonGeneratorOptions options;
+    options.use_yajl = use_yajl;
+    MemoryWriter writer;
+    ErrorPtr error;
+    {
+      JsonGenerator g(&writer, options);
+      EXPECT_FALSE(g.GenString("\xff", 1, &error));
+      ASSERT_TRUE(error.get() != NULL);
+      EXPECT_EQ("Invalid string", error->ToString());
+    }
+    {
+      JsonGenerator g(&writer, options);
+      EXPECT_FALSE(g.GenDouble(HUGE_VAL, &error));
+      ASSERT_TRUE(error.get() != NULL);
+      EXPECT_EQ("Invalid number", error->ToString());
+    }
+    {
+      JsonGenerator g(&writer, options);
+      EXPECT_TRUE(g.GenStartMap(&error));
+      EXPECT_FALSE(g.GenInt32(1, &error));
+      ASSERT_TRUE(error.get() != NULL);
+      EXPECT_EQ("Keys must be strings", error->ToString());
+    }
+    {
+      JsonGenerator g(&writer, options);
+      int depth = 0;
+      while (g.GenStartArray(&error))
+        ++depth;
+      EXPECT_EQ(127, depth);
+      ASSERT_TRUE(error.get() != NULL);
+      EXPECT_EQ("Max depth exceeded", error->ToString());
+    }
+  }
+}
+
+TEST(JsonGeneratorTest, Writes) {
+  test_types_schema::Types data;
+  FileReader reader("test_types_data.json");
+  ErrorPtr error;
+  test_types_schema::Decode(&reader, &data, &error);
+  ASSERT_EQ(NULL, error.get()) << "Decode error: " << error->ToString();
+
+  // Buffered, however the JSON is generated, into one write.
+  for (int beautify = 0; beautify < 2; ++beautify) {
+    JsonGeneratorOptions options;
+    options.beautify = beautify;
+    CountingWriter writer;
+    test_types_schema::Encode(&writer, &data, options, &error);
+    ASSERT_EQ(NULL, error.get()) << "Encode error: " << error->ToString();
+    EXPECT_EQ(1, writer.num_writes);
+
+    CountingWriter full_writer(10);
+    test_types_schema::Encode(&full_writer, &data, options, &error);
+    ASSERT_TRUE(error.get() != NULL);
+    EXPECT_EQ("Disk full", error->ToString());
+  }
+}
+
+TEST(JsonGeneratorTest, Buffering) {
+  MemoryWriter writer;
+  ErrorPtr error;
+  JsonGenerator g(&writer, JsonGeneratorOptions());
+  ASSERT_TRUE(g.GenStartArray(&error));
+  ASSERT_TRUE(g.GenString("short", 5, &error));
+  // Nothing is written until the buffer fills up or is flushed.
+  EXPECT_TRUE(writer.data().empty());
+  std::string long_string(10000, 'x');
+  long_string[5000] = '\n';
+  ASSERT_TRUE(g.GenString(long_string, &error));
+  ASSERT_TRUE(g.GenEndArray(&error));
+  ASSERT_TRUE(g.Flush(&error));
+  std::string escaped = long_string.substr(0, 5000) + "\\n" +
+                        long_string.substr(5001);
+  EXPECT_EQ("[\"short\",\"" + escaped + "\"]",
+            std::string(writer.data().begin(), writer.data().end()));
+}
+
+// Expects EncodedSize to be the size of what Encode generates for |data|.
+template <typename T>
+void ExpectEncodedSize(
+    void (*encode)(Writer*, T*, const JsonGeneratorOptions&, ErrorPtr*),
+    size_t (*encoded_size)(const T&, const JsonGeneratorOptions&),
+    T* data, const JsonGeneratorOptions& options) {
+  ErrorPtr error;
+  MemoryWriter writer;
+  encode(&writer, data, options, &error);
+  ASSERT_EQ(NULL, error.get()) << "Encode error: " << error->ToString();
+  EXPECT_EQ(writer.data().size(), encoded_size(*data, options));
+}
+
+TEST(JsonGeneratorTest, EncodedSize) {
+  test_types_schema::Types types;
+  JsonGeneratorOptions options;
+  ExpectEncodedSize(&test_types_schema::Encode,
+                    &test_types_schema::EncodedSize, &types, options);
+  EXPECT_EQ(EncodedSize(types, options), EncodedSize(types));
+  FileReader reader("test_types_data.json");
+  ErrorPtr error;
+  test_types_schema::Decode(&reader, &types, &error);
+  ASSERT_EQ(NULL, error.get()) << "Decode error: " << error->ToString();
+  ExpectEncodedSize(&test_types_schema::Encode,
+                    &test_types_schema::EncodedSize, &types, options);
+  types.my_string = "\"quotes\" \\ /slashes/ \b\f\n\r\t \x01\x1f\x7f \xc3\xa9";
+  types.my_double = -1.5e-300;
+  types.my_float = 0.1f;
+  types.my_int64 = INT64_MIN;
+  types.my_uint64 = UINT64_MAX;
+  ExpectEncodedSize(&test_types_schema::Encode,
+                    &test_types_schema::EncodedSize, &types, options);
+  options.escape_solidus = true;
+  ExpectEncodedSize(&test_types_schema::Encode,
+                    &test_types_schema::EncodedSize, &types, options);
+
+  test_types_schema::ArrayTypes arrays;
+  FileReader array_reader("test_array_types_data.json");
+  test_types_schema::Decode(&array_reader, &arrays, &error);
+  ASSERT_EQ(NULL, error.get()) << "Decode error: " << error->ToString();
+  ExpectEncodedSize(&test_types_schema::Encode,
+                    &test_types_schema::EncodedSize, &arrays, options);
+
+  // Empty arrays and maps, and null refs, which are left out.
+  test_types_schema::ComplexTypes complex;
+  ExpectEncodedSize(&test_types_schema::Encode,
+                    &test_types_schema::EncodedSize, &complex, options);
+  complex.threeply.resize(2);
+  complex.threeply[1].resize(2);
+  complex.threeply[1][1].push_back(7);
+  complex.twoply_refs.resize(2);
+  complex.twoply_refs[0].resize(3);
+  complex.twoply_refs[0][1].reset(new test_types_schema::DummyRef());
+  complex.twoply_refs[1].resize(1);
+  ExpectEncodedSize(&test_types_schema::Encode,
+                    &test_types_schema::EncodedSize, &complex, options);
+
+  test_types_schema::ComplexAddlProps complex_addl_props;
+  complex_addl_props.array.resize(2);
+  complex_addl_props.array[1]._additional_properties["x"] = 1;
+  complex_addl_props.nested._additional_properties["a/b"].dummy = 2;
+  complex_addl_props.nested._additional_properties["a/b"].
+      _additional_properties["\n"] = 3;
+  ExpectEncodedSize(&test_types_schema::Encode,
+                    &test_types_schema::EncodedSize, &complex_addl_props,
+                    options);
+
+  test_types_schema::SimpleAddlProps addl_props;
+  addl_props._additional_properties["a\"b"] = 2;
+  addl_props._additional_properties["c/\td"] = 3;
+  addl_props._additional_properties[""] = 4;
+  ExpectEncodedSize(&test_types_schema::Encode,
+                    &test_types_schema::EncodedSize, &addl_props, options);
+
+  // Base64 has '/'s unless it is URL-safe.
+  test_types_schema::BytesTypes bytes;
+  bytes.my_bytes.assign(3000, 0xff);
+  bytes.my_bytes_array.resize(2);
+  bytes.my_bytes_array[1].assign(4, 0xfc);
+  ExpectEncodedSize(&test_types_schema::Encode,
+                    &test_types_schema::EncodedSize, &bytes, options);
+  options.base64_alphabet = BASE64_URL;
+  ExpectEncodedSize(&test_types_schema::Encode,
+                    &test_types_schema::EncodedSize, &bytes, options);
+  options.escape_solidus = false;
+  options.base64_alphabet = BASE64;
+  ExpectEncodedSize(&test_types_schema::Encode,
+                    &test_types_schema::EncodedSize, &bytes, options);
+}
+
+TEST(JsonNumberTest, Integers) {
+  struct TestCase {
+    const char* s;
+    ParseNumberResult result;
+    int64_t value;
+  };
+  TestCase int32_cases[] = {
+    { "0", PARSE_NUMBER_OK, 0 },
+    { "-0", PARSE_NUMBER_OK, 0 },
+    { "+12", PARSE_NUMBER_INVALID, 0 },
+    { "2147483647", PARSE_NUMBER_OK, 2147483647LL },
+    { "-2147483648", PARSE_NUMBER_OK, -2147483648LL },
+    { "0002147483647", PARSE_NUMBER_OK, 2147483647LL },
+    { "2147483648", PARSE_NUMBER_OUT_OF_RANGE, 0 },
+    { "-2147483649", PARSE_NUMBER_OUT_OF_RANGE, 0 },
+    { "99999999999999999999999", PARSE_NUMBER_OUT_OF_RANGE, 0 },
+    { "99999999999999999999999x", PARSE_NUMBER_INVALID, 0 },
+    { "", PARSE_NUMBER_INVALID, 0 },
+    { "-", PARSE_NUMBER_INVALID, 0 },
+    { " 1", PARSE_NUMBER_INVALID, 0 },
+    { "1.0", PARSE_NUMBER_INVALID, 0 },
+    { "1e3", PARSE_NUMBER_INVALID, 0 },
+  };
+  for (size_t i = 0; i < sizeof(int32_cases)/sizeof(int32_cases[0]); ++i) {
+    TestCase& test_case = int32_cases[i];
+    int32_t value = 0;
+    EXPECT_EQ(test_case.result,
+              ParseInt32(test_case.s, strlen(test_case.s), &value))
+        << "For: " << test_case.s;
+    EXPECT_EQ(test_case.value, value) << "For: " << test_case.s;
+  }
+
+  int64_t int64_value;
+  EXPECT_EQ(PARSE_NUMBER_OK, ParseInt64("-9223372036854775808", 20,
+                                        &int64_value));
+  EXPECT_EQ(std::numeric_limits<int64_t>::min(), int64_value);
+  EXPECT_EQ(PARSE_NUMBER_OUT_OF_RANGE,
+            ParseInt64("9223372036854775808", 19, &int64_value));
+
+  uint32_t uint32_value;
+  EXPECT_EQ(PARSE_NUMBER_OK, ParseUint32("4294967295", 10, &uint32_value));
+  EXPECT_EQ(4294967295U, uint32_value);
+  EXPECT_EQ(PARSE_NUMBER_OUT_OF_RANGE,
+            ParseUint32("4294967296", 10, &uint32_value));
+  EXPECT_EQ(PARSE_NUMBER_OUT_OF_RANGE, ParseUint32("-1", 2, &uint32_value));
+  EXPECT_EQ(PARSE_NUMBER_OK, ParseUint32("-0", 2, &uint32_value));
+  EXPECT_EQ(0U, uint32_value);
+
+  uint64_t uint64_value;
+  EXPECT_EQ(PARSE_NUMBER_OK,
+            ParseUint64("18446744073709551615", 20, &uint64_value));
+  EXPECT_EQ(std::numeric_limits<uint64_t>::max(), uint64_value);
+
+  // Only |length| bytes are read.
+  int32_t int32_value;
+  EXPECT_EQ(PARSE_NUMBER_OK, ParseInt32("12345", 3, &int32_value));
+  EXPECT_EQ(123, int32_value);
+}
+
+TEST(JsonNumberTest, FloatingPoint) {
+  // Fast and slow path inputs must agree with strtod.
+  const char* valid[] = {
+    "0", "-0", "1", "-1", "0.1", "1e22", "1e23", "123.456e-5",
+    "9007199254740993", "3.141592653589793238462643383279",
+    "2.2250738585072014e-308", "1.7976931348623157e308",
+    "0.000000000000000000000000000000000000001e40",
+    "1234567890123456789012345678901234567890e-20",
+  };
+  for (size_t i = 0; i < sizeof(valid)/sizeof(valid[0]); ++i) {
+    double value = 0;
+    EXPECT_EQ(PARSE_NUMBER_OK, ParseDouble(valid[i], strlen(valid[i]), &value))
+        << "For: " << valid[i];
+    EXPECT_EQ(strtod(valid[i], NULL), value) << "For: " << valid[i];
+    float float_value = 0;
+    ParseNumberResult result =
+        ParseFloat(valid[i], strlen(valid[i]), &float_value);
+    if (result == PARSE_NUMBER_OK)
+      EXPECT_EQ(strtof(valid[i], NULL), float_value) << "For: " << valid[i];
+  }
+
+  const char* invalid[] = {
+    "", "-", "+1", "1.", ".1", "1e", "1e+", "01x", "1.0 ", "nan", "inf",
+  };
+  for (size_t i = 0; i < sizeof(invalid)/sizeof(invalid[0]); ++i) {
+    double value;
+    EXPECT_EQ(PARSE_NUMBER_INVALID,
+              ParseDouble(invalid[i], strlen(invalid[i]), &value))
+        << "For: " << invalid[i];
+  }
+
+  double value;
+  EXPECT_EQ(PARSE_NUMBER_OUT_OF_RANGE, ParseDouble("1e309", 5, &value));
+  EXPECT_EQ(PARSE_NUMBER_OUT_OF_RANGE, ParseDouble("-1e309", 6, &value));
+  EXPECT_EQ(PARSE_NUMBER_OUT_OF_RANGE, ParseDouble("1e-400", 6, &value));
+  // Subnormal.
+  EXPECT_EQ(PARSE_NUMBER_OUT_OF_RANGE, ParseDouble("4.9e-324", 8, &value));
+  EXPECT_EQ(PARSE_NUMBER_OUT_OF_RANGE,
+            ParseDouble("-2.2250738585072009e-308", 24, &value));
+  EXPECT_EQ(PARSE_NUMBER_OUT_OF_RANGE,
+            ParseDouble("1e99999999999", 13, &value));
+  float float_value;
+  EXPECT_EQ(PARSE_NUMBER_OUT_OF_RANGE, ParseFloat("1e39", 4, &float_value));
+  EXPECT_EQ(PARSE_NUMBER_OUT_OF_RANGE, ParseFloat("1e-50", 5, &float_value));
+  EXPECT_EQ(PARSE_NUMBER_OUT_OF_RANGE, ParseFloat("1e-40", 5, &float_value));
+  EXPECT_EQ(PARSE_NUMBER_OK, ParseFloat("0.1", 3, &float_value));
+  EXPECT_EQ(0.1f, float_value);
+}
+
+TEST(JsonNumberTest, FormatIntegers) {
+  char buffer[kMaxFormattedNumberLength + 1];
+  char expected[32];
+  // Around every power of ten, and the limits.
+  for (uint64_t pow10 = 1; pow10 <= 1000000000000000000ull; pow10 *= 10) {
+    for (uint64_t value = pow10 - 1; value <= pow10 + 1; ++value) {
+      snprintf(expected, sizeof(expected), "%" PRIu64, value);
+      EXPECT_EQ(expected, std::string(buffer, FormatUint64(value, buffer)));
+      int64_t negative = -static_cast<int64_t>(value);
+      snprintf(expected, sizeof(expected), "%" PRId64, negative);
+      EXPECT_EQ(expected, std::string(buffer, FormatInt64(negative, buffer)));
+      if (value > UINT32_MAX)
+        continue;
+      snprintf(expected, sizeof(expected), "%" PRIu64, value);
+      EXPECT_EQ(expected, std::string(buffer, FormatUint32(value, buffer)));
+      if (value > INT32_MAX)
+        continue;
+      EXPECT_EQ(expected, std::string(buffer, FormatInt32(value, buffer)));
+      snprintf(expected, sizeof(expected), "%" PRId64, negative);
+      EXPECT_EQ(expected, std::string(buffer, FormatInt32(negative, buffer)));
+    }
+  }
+  EXPECT_EQ("-2147483648", std::string(buffer, FormatInt32(INT32_MIN, buffer)));
+  EXPECT_EQ("2147483647", std::string(buffer, FormatInt32(INT32_MAX, buffer)));
+  EXPECT_EQ("4294967295",
+            std::string(buffer, FormatUint32(UINT32_MAX, buffer)));
+  EXPECT_EQ("-9223372036854775808",
+            std::string(buffer, FormatInt64(INT64_MIN, buffer)));
+  EXPECT_EQ("9223372036854775807",
+            std::string(buffer, FormatInt64(INT64_MAX, buffer)));
+  EXPECT_EQ("18446744073709551615",
+            std::string(buffer, FormatUint64(UINT64_MAX, buffer)));
+}
+
+// The number of significant digits of the formatted float |s|.
+int SignificantDigits(const std::string& s) {
+  std::string digits;
+  for (size_t i = 0; i < s.size() && s[i] != 'e'; ++i) {
+    if (isdigit(s[i]) && (s[i] != '0' || !digits.empty()))
+      digits += s[i];
+  }
+  size_t last = digits.find_last_not_of('0');
+  return last == std::string::npos ? 1 : last + 1;
+}
+
+// Expects FormatDouble or FormatFloat of |value| to read back as |value|,
+// with no fewer digits doing that.
+template <typename T>
+void ExpectShortestRoundTrip(T value, size_t (*format)(T, char*),
+                             T (*parse)(const char*, char**)) {
+  char buffer[kMaxFormattedNumberLength + 1];
+  size_t length = format(value, buffer);
+  ASSERT_LE(length, kMaxFormattedNumberLength);
+  buffer[length] = 0;
+  T parsed = parse(buffer, NULL);
+  ASSERT_EQ(0, memcmp(&value, &parsed, sizeof(value)))
+      << "For: " << buffer;
+  int digits = SignificantDigits(buffer);
+  if (digits > 1) {
+    // The closest decimal with one digit less.
+    char shorter[64];
+    snprintf(shorter, sizeof(shorter), "%.*e", digits - 2,
+             static_cast<double>(value));
+    EXPECT_NE(value, parse(shorter, NULL))
+        << "For: " << buffer << ", " << shorter << " is shorter";
+  }
+}
+
+TEST(JsonNumberTest, FormatDouble) {
+  struct TestCase {
+    double value;
+    const char* expected;
+  };
+  TestCase test_cases[] = {
+    { 0.0, "0.0" },
+    { -0.0, "-0.0" },
+    { 1.0, "1.0" },
+    { 0.1, "0.1" },
+    { 0.3, "0.3" },
+    { -1.5, "-1.5" },
+    { 100.0, "100.0" },
+    { 3.14159, "3.14159" },
+    { 1e20, "100000000000000000000.0" },
+    { 123456789012345678901.0, "123456789012345680000.0" },
+    { 1e21, "1e+21" },
+    { 1.5e300, "1.5e+300" },
+    { 1e-6, "0.000001" },
+    { 1e-7, "1e-7" },
+    { 1.25e-7, "1.25e-7" },
+    { 9007199254740993.0, "9007199254740992.0" },
+    { 5e-324, "5e-324" },
+    { 2.2250738585072014e-308, "2.2250738585072014e-308" },
+    { 1.7976931348623157e308, "1.7976931348623157e+308" },
+    { -1.7976931348623157e308, "-1.7976931348623157e+308" },
+  };
+  char buffer[kMaxFormattedNumberLength];
+  for (size_t i = 0; i < sizeof(test_cases)/sizeof(test_cases[0]); ++i) {
+    EXPECT_EQ(test_cases[i].expected,
+              std::string(buffer, FormatDouble(test_cases[i].value, buffer)));
+  }
+
+  // Random doubles, subnormals and doubles with short mantissas.
+  uint64_t random = 88172645463325252ull;
+  for (int i = 0; i < 300000; ++i) {
+    random ^= random << 13;
+    random ^= random >> 7;
+    random ^= random << 17;
+    uint64_t bits = random;
+    if (i % 3 == 1)
+      bits &= 0x800fffffffffffffull;
+    else if (i % 3 == 2)
+      bits &= 0xfff00000000000ffull;
+    double value;
+    memcpy(&value, &bits, sizeof(value));
+    if (!std::isfinite(value))
+      continue;
+    ExpectShortestRoundTrip(value, &FormatDouble, &strtod);
+  }
+  for (double value = 1; !std::isinf(value); value *= 10) {
+    ExpectShortestRoundTrip(value, &FormatDouble, &strtod);
+    ExpectShortestRoundTrip(1 / value, &FormatDouble, &strtod);
+  }
+}
+
+TEST(JsonNumberTest, FormatFloat) {
+  struct TestCase {
+    float value;
+    const char* expected;
+  };
+  TestCase test_cases[] = {
+    { 0.0f, "0.0" },
+    { 0.1f, "0.1" },
+    { 3.14159f, "3.14159" },
+    { 16777216.0f, "16777216.0" },
+    { 1e9f, "1000000000.0" },
+    { -1e-7f, "-1e-7" },
+    { 1.4e-45f, "1e-45" },
+    { 3.4028235e38f, "3.4028235e+38" },
+  };
+  char buffer[kMaxFormattedNumberLength];
+  for (size_t i = 0; i < sizeof(test_cases)/sizeof(test_cases[0]); ++i) {
+    EXPECT_EQ(test_cases[i].expected,
+              std::string(buffer, FormatFloat(test_cases[i].value, buffer)));
+  }
+
+  // Every 16411th float; DISABLED_FormatFloatExhaustive checks all of them.
+  for (uint64_t bits = 0; bits <= UINT32_MAX; bits += 16411) {
+    uint32_t float_bits = bits;
+    float value;
+    memcpy(&value, &float_bits, sizeof(value));
+    if (std::isfinite(value))
+      ExpectShortestRoundTrip(value, &FormatFloat, &strtof);
+  }
+}
+
+// Takes about an hour; run with --gtest_also_run_disabled_tests.
+TEST(JsonNumberTest, DISABLED_FormatFloatExhaustive) {
+  for (uint64_t bits = 0; bits <= UINT32_MAX; ++bits) {
+    uint32_t float_bits = bits;
+    float value;
+    memcpy(&value, &float_bits, sizeof(value));
+    if (std::isfinite(value))
+      ExpectShortestRoundTrip(value, &FormatFloat, &strtof);
+  }
+}
+
+TEST(ArenaTest, Allocate) {
+  Arena arena(256);
+  char* small = static_cast<char*>(arena.Allocate(1));
+  char* next = static_cast<char*>(arena.Allocate(10));
+  EXPECT_EQ(small + 8, next);
+  // Too big to share a block.
+  memset(arena.Allocate(1000), 0, 1000);
+  EXPECT_EQ(next + 16, arena.Allocate(8));
+  EXPECT_EQ(8 + 16 + 1000 + 8, arena.bytes_allocated());
+}
+
+TEST(ArenaTest, Allocator) {
+  Arena arena;
+  EXPECT_EQ(NULL, Arena::current());
+  ArenaString heap_string;
+  EXPECT_EQ(NULL, heap_string.get_allocator().arena());
+  {
+    ScopedArena scoped_arena(&arena);
+    EXPECT_EQ(&arena, Arena::current());
+    ArenaString* s = arena.New<ArenaString>();
+    EXPECT_EQ(&arena, s->get_allocator().arena());
+    s->assign(100, 'x');
+    std::vector<int, ArenaAllocator<int> > v;
+    for (int i = 0; i < 1000; ++i)
+      v.push_back(i);
+    EXPECT_EQ(&arena, v.get_allocator().arena());
+  }
+  EXPECT_EQ(NULL, Arena::current());
+  EXPECT_LT(100 + 1000 * sizeof(int), arena.bytes_allocated());
+}
+
+namespace {
+
+// Encodes |data| with the default options.
+template <typename T>
+std::string EncodeToString(T* data) {
+  MemoryWriter writer;
+  ErrorPtr error;
+  test_types_schema_arena::Encode(&writer, data, JsonGeneratorOptions(),
+                                  &error);
+  EXPECT_EQ(NULL, error.get()) << "Encode error: " << error->ToString();
+  return std::string(writer.data().begin(), writer.data().end());
+}
+
+}  // namespace
+
+TEST(ArenaTest, Parse) {
+  Arena arena;
+  test_types_schema_arena::Types* data = NULL;
+  FileReader reader("test_types_data.json");
+  ErrorPtr error;
+  test_types_schema_arena::Decode(&reader, &arena, &data, &error);
+  ASSERT_EQ(NULL, error.get()) << "Decode error: " << error->ToString();
+  ASSERT_TRUE(data != NULL);
+
+  EXPECT_EQ(-1234, data->my_int32);
+  EXPECT_EQ(13123456789, data->my_uint64);
+  EXPECT_DOUBLE_EQ(1e24, data->my_double);
+  EXPECT_STREQ("Hello, World!", data->my_string.c_str());
+  EXPECT_EQ(&arena, data->my_string.get_allocator().arena());
+  ASSERT_TRUE(data->my_ref != NULL);
+  EXPECT_STREQ("Goodbye, moon.", data->my_ref->value1.c_str());
+  EXPECT_EQ(8675309, data->my_ref->value2);
+  EXPECT_STREQ("Hi, rock?", data->my_object.my_object_string.c_str());
+}
+
+TEST(ArenaTest, RoundTrip) {
+  // Decoding into the arena and encoding again gives the same JSON as the
+  // default, heap allocated, structs.
+  const char* json =
+      "{\"arrayOfNested\":[{\"x\":{\"y\":1}},{\"x\":{\"y\":2}}],"
+      "\"threeply\":[[[1,2],[3]],[]],"
+      "\"twoply\":[[1,2],[3,4]],"
+      "\"twoplyObjects\":[[{\"x\":1},{\"x\":2}],[{\"x\":3}]],"
+      "\"twoplyRefs\":[[{\"value1\":\"foo\",\"value2\":1}],"
+      "[{\"value1\":\"bar\",\"value2\":2}]]}";
+
+  test_types_schema::ComplexTypes heap_data;
+  MemoryReader heap_reader(json, strlen(json));
+  ErrorPtr error;
+  test_types_schema::Decode(&heap_reader, &heap_data, &error);
+  ASSERT_EQ(NULL, error.get()) << "Decode error: " << error->ToString();
+  MemoryWriter heap_writer;
+  test_types_schema::Encode(&heap_writer, &heap_data, JsonGeneratorOptions(),
+                            &error);
+  ASSERT_EQ(NULL, error.get()) << "Encode error: " << error->ToString();
+  std::string expected(heap_writer.data().begin(), heap_writer.data().end());
+
+  Arena arena;
+  test_types_schema_arena::ComplexTypes* data = NULL;
+  MemoryReader reader(json, strlen(json));
+  test_types_schema_arena::Decode(&reader, &arena, &data, &error);
+  ASSERT_EQ(NULL, error.get()) << "Decode error: " << error->ToString();
+  EXPECT_EQ(expected, EncodeToString(data));
+  EXPECT_EQ(expected.size(), test_types_schema_arena::EncodedSize(*data));
+  ASSERT_EQ(2, data->twoply_refs.size());
+  EXPECT_STREQ("bar", data->twoply_refs[1][0]->value1.c_str());
+
+  const char* addl_props_json = "{\"a\": 1, \"b\": 2}";
+  test_types_schema_arena::SimpleAddlProps* addl_props = NULL;
+  MemoryReader addl_props_reader(addl_props_json, strlen(addl_props_json));
+  test_types_schema_arena::Decode(&addl_props_reader, &arena, &addl_props,
+                                  &error);
+  ASSERT_EQ(NULL, error.get()) << "Decode error: " << error->ToString();
+  EXPECT_EQ(2, addl_props->_additional_properties.size());
+  EXPECT_EQ(2, addl_props->_additional_properties["b"]);
+}
+
+TEST(StringViewTest, PinnedBuffer) {
+  const char kData[] = "abcdef";
+  PinnedBuffer input(kData, 6);
+  StringView view = input.View(kData + 2, 4);
+  EXPECT_EQ(kData + 2, view.data());
+  EXPECT_EQ(StringView("cdef"), view);
+  EXPECT_EQ(0, input.num_copies());
+
+  // Not in the input, or only partly.
+  std::string outside = "xyz";
+  view = input.View(outside.data(), outside.size());
+  EXPECT_NE(outside.data(), view.data());
+  EXPECT_EQ("xyz", view.ToString());
+  view = input.View(kData + 4, 3);
+  EXPECT_NE(kData + 4, view.data());
+  EXPECT_EQ(2, input.num_copies());
+
+  std::vector<char> data(kData, kData + 6);
+  PinnedBuffer owned_input(&data);
+  EXPECT_TRUE(data.empty());
+  view = owned_input.View(owned_input.data() + 1, 2);
+  EXPECT_EQ(owned_input.data() + 1, view.data());
+  EXPECT_EQ("bc", view.ToString());
+}
+
+TEST(StringViewTest, Parse) {
+  const char json[] =
+      "{\"myString\": \"Hello, World!\", "
+      "\"myObject\": {\"myObjectString\": \"tab\\there\"}, "
+      "\"myRef\": {\"value1\": \"\\u00e9t\\u00e9\"}}";
+  PinnedBuffer input(json, strlen(json));
+  test_types_schema_views::Types data;
+  ErrorPtr error;
+  test_types_schema_views::Decode(&input, &data, &error);
+  ASSERT_EQ(NULL, error.get()) << "Decode error: " << error->ToString();
+
+  // Unescaped strings are views of the input...
+  EXPECT_EQ(strstr(json, "Hello"), data.my_string.data());
+  EXPECT_EQ("Hello, World!", data.my_string.ToString());
+  // ...the others are copies.
+  EXPECT_EQ("tab\there", data.my_object.my_object_string.ToString());
+  EXPECT_EQ("\xc3\xa9t\xc3\xa9", data.my_ref->value1.ToString());
+  EXPECT_EQ(2, input.num_copies());
+
+  // Encoding the views gives the same JSON as std::string fields.
+  test_types_schema::Types heap_data;
+  MemoryReader reader(json, strlen(json));
+  test_types_schema::Decode(&reader, &heap_data, &error);
+  ASSERT_EQ(NULL, error.get()) << "Decode error: " << error->ToString();
+  MemoryWriter heap_writer;
+  test_types_schema::Encode(&heap_writer, &heap_data, JsonGeneratorOptions(),
+                            &error);
+  MemoryWriter writer;
+  test_types_schema_views::Encode(&writer, &data, JsonGeneratorOptions(),
+                                  &error);
+  ASSERT_EQ(NULL, error.get()) << "Encode error: " << error->ToString();
+  EXPECT_TRUE(heap_writer.data() == writer.data());
+  EXPECT_EQ(writer.data().size(), test_types_schema_views::EncodedSize(data));
+}
+
+namespace {
+
+// Encodes |data|, generated with --presence, with the default options, and
+// expects EncodedSize to agree.
+template <typename T>
+std::string EncodePresent(T* data) {
+  MemoryWriter writer;
+  ErrorPtr error;
+  test_types_schema_presence::Encode(&writer, data, JsonGeneratorOptions(),
+                                     &error);
+  EXPECT_EQ(NULL, error.get()) << "Encode error: " << error->ToString();
+  EXPECT_EQ(writer.data().size(), test_types_schema_presence::EncodedSize(*data));
+  return std::string(writer.data().begin(), writer.data().end());
+}
+
+// Keeps whether the records of a DecodeStream have myBool and myInt32.
+class CollectPresence
+    : public RecordCallback<test_types_schema_presence::Types> {
+ public:
+  virtual bool OnRecord(size_t index, test_types_schema_presence::Types* data,
+                        const ErrorPtr& error) {
+    has_bool.push_back(data->has_my_bool());
+    has_int32.push_back(data->has_my_int32());
+    errors.push_back(error ? error->ToString() : "");
+    return true;
+  }
+
+  std::vector<bool> has_bool;
+  std::vector<bool> has_int32;
+  std::vector<std::string> errors;
+};
+
+}  // namespace
+
+TEST(PresenceTest, Setters) {
+  // Only the primitives that are set are encoded, even zeros and empty
+  // strings; objects and arrays always are.
+  test_types_schema_presence::Types data;
+  EXPECT_FALSE(data.has_my_int32());
+  EXPECT_EQ("{\"myObject\":{}}", EncodePresent(&data));
+  data.set_my_int32(0);
+  data.set_my_string("");
+  data.my_object.set_my_object_float(1.5);
+  data.my_bool = true;
+  EXPECT_TRUE(data.has_my_int32());
+  EXPECT_FALSE(data.has_my_bool());
+  EXPECT_EQ("{\"myInt32\":0,\"myObject\":{\"myObjectFloat\":1.5},"
+            "\"myString\":\"\"}",
+            EncodePresent(&data));
+
+  test_types_schema_presence::ArrayTypes arrays;
+  EXPECT_EQ("{\"myAnyArray\":[],\"myBoolArray\":[],\"myDoubleArray\":[],"
+            "\"myFloatArray\":[],\"myInt32Array\":[],\"myInt64Array\":[],"
+            "\"myObjectArray\":[],\"myRefArray\":[],\"myStringArray\":[],"
+            "\"myUint32Array\":[],\"myUint64Array\":[]}",
+            EncodePresent(&arrays));
+  arrays.my_object_array.resize(2);
+  arrays.my_object_array[1].set_my_object_string("x");
+  arrays.my_int32_array.push_back(0);
+  EXPECT_EQ("{\"myAnyArray\":[],\"myBoolArray\":[],\"myDoubleArray\":[],"
+            "\"myFloatArray\":[],\"myInt32Array\":[0],\"myInt64Array\":[],"
+            "\"myObjectArray\":[{},{\"myObjectString\":\"x\"}],"
+            "\"myRefArray\":[],\"myStringArray\":[],"
+            "\"myUint32Array\":[],\"myUint64Array\":[]}",
+            EncodePresent(&arrays));
+}
+
+TEST(PresenceTest, Decode) {
+  // Decoded properties are present, whichever decoder decodes them.
+  const char* json =
+      "{\"myBool\": false, \"myObject\": {\"myObjectString\": \"\"},"
+      " \"myRef\": {\"value2\": 0}, \"myUint64\": \"0\"}";
+  const char* expected =
+      "{\"myBool\":false,\"myObject\":{\"myObjectString\":\"\"},"
+      "\"myRef\":{\"value2\":0},\"myUint64\":\"0\"}";
+  test_types_schema_presence::Types data;
+  MemoryReader reader(json, strlen(json));
+  ErrorPtr error;
+  test_types_schema_presence::Decode(&reader, &data, &error);
+  ASSERT_EQ(NULL, error.get()) << "Decode error: " << error->ToString();
+  EXPECT_TRUE(data.has_my_bool());
+  EXPECT_TRUE(data.my_ref->has_value2());
+  EXPECT_FALSE(data.my_ref->has_value1());
+  EXPECT_EQ(expected, EncodePresent(&data));
+
+  // The yajl callbacks, which decode with field masks.
+  FieldMask mask;
+  ASSERT_TRUE(mask.Parse("myBool,myObject,myRef,myUint64,myString",
+                         test_types_schema_presence::kTypesFields, &error));
+  test_types_schema_presence::Types masked_data;
+  MemoryReader masked_reader(json, strlen(json));
+  test_types_schema_presence::Decode(&masked_reader, &masked_data, mask,
+                                     &error);
+  ASSERT_EQ(NULL, error.get()) << "Decode error: " << error->ToString();
+  EXPECT_EQ(expected, EncodePresent(&masked_data));
+  ASSERT_TRUE(mask.Parse("myObject", test_types_schema_presence::kTypesFields,
+                         &error));
+  test_types_schema_presence::Types object_data;
+  MemoryReader object_reader(json, strlen(json));
+  test_types_schema_presence::Decode(&object_reader, &object_data, mask,
+                                     &error);
+  ASSERT_EQ(NULL, error.get()) << "Decode error: " << error->ToString();
+  EXPECT_EQ("{\"myObject\":{\"myObjectString\":\"\"}}",
+            EncodePresent(&object_data));
+
+  // Properties in arrays and additional properties.
+  const char* addl_json =
+      "{\"nested\": {\"a\": {\"x\": 1}, \"b\": {\"dummy\": 0}}}";
+  test_types_schema_presence::ComplexAddlProps addl_data;
+  MemoryReader addl_reader(addl_json, strlen(addl_json));
+  test_types_schema_presence::Decode(&addl_reader, &addl_data, &error);
+  ASSERT_EQ(NULL, error.get()) << "Decode error: " << error->ToString();
+  EXPECT_EQ("{\"array\":[],\"embedded\":{},\"innerArray\":{},"
+            "\"nested\":{\"a\":{\"x\":1},\"b\":{\"dummy\":0}}}",
+            EncodePresent(&addl_data));
+}
+
+TEST(PresenceTest, FailedValue) {
+  // A value that can't be converted is not present, whichever decoder fails
+  // on it.
+  const char* json = "{\"myBool\": true, \"myInt32\": 4294967296}";
+  test_types_schema_presence::Types data;
+  MemoryReader reader(json, strlen(json));
+  ErrorPtr error;
+  test_types_schema_presence::Decode(&reader, &data, &error);
+  EXPECT_TRUE(error.get() != NULL);
+  EXPECT_TRUE(data.has_my_bool());
+  EXPECT_FALSE(data.has_my_int32());
+
+  FieldMask mask;
+  ASSERT_TRUE(mask.Parse("myBool,myInt32",
+                         test_types_schema_presence::kTypesFields, &error));
+  test_types_schema_presence::Types masked_data;
+  MemoryReader masked_reader(json, strlen(json));
+  test_types_schema_presence::Decode(&masked_reader, &masked_data, mask,
+                                     &error);
+  EXPECT_TRUE(error.get() != NULL);
+  EXPECT_TRUE(masked_data.has_my_bool());
+  EXPECT_FALSE(masked_data.has_my_int32());
+
+  // DecodeStream passes a failed record on as far as it was decoded.
+  const char* stream_json =
+      "{\"myInt32\": 1}\n"
+      "{\"myBool\": true, \"myInt32\": 4294967296}\n"
+      "{\"myBool\": false}";
+  CollectPresence callback;
+  MemoryReader stream_reader(stream_json, strlen(stream_json));
+  error.reset();
+  test_types_schema_presence::DecodeStream(&stream_reader, &callback, &error);
+  ASSERT_EQ(NULL, error.get()) << "Got error: " << error->ToString();
+  ASSERT_EQ(3, callback.errors.size());
+  EXPECT_EQ("", callback.errors[0]);
+  EXPECT_FALSE(callback.has_bool[0]);
+  EXPECT_TRUE(callback.has_int32[0]);
+  EXPECT_NE(std::string::npos, callback.errors[1].find("out of range"))
+      << callback.errors[1];
+  EXPECT_TRUE(callback.has_bool[1]);
+  EXPECT_FALSE(callback.has_int32[1]);
+  EXPECT_EQ("", callback.errors[2]);
+  EXPECT_TRUE(callback.has_bool[2]);
+  EXPECT_FALSE(callback.has_int32[2]);
+}
+
 int main(int argc, char** argv) {
   testing::InitGoogleTest(&argc, argv);
   return RUN_ALL_TESTS();